@@ -0,0 +1,69 @@
+import datetime
+import random
+import tempfile
+import time
+
+from furs_fiscal.analytics import InvoiceColumnStore
+
+INVOICES = 1000000
+
+
+def build_message(day, premise, device, number, lines):
+    vat = [{'TaxRate': rate, 'TaxableAmount': base, 'TaxAmount': round(base * rate / 100, 2)} for rate, base in lines]
+    return {
+        'InvoiceRequest': {
+            'Header': {'MessageID': str(number), 'DateTime': day.strftime("%Y-%m-%dT%H:%M:%S")},
+            'Invoice': {
+                'TaxNumber': 10039856,
+                'IssueDateTime': day.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                'NumberingStructure': 'B',
+                'InvoiceIdentifier': {
+                    'BusinessPremiseID': premise,
+                    'ElectronicDeviceID': device,
+                    'InvoiceNumber': str(number),
+                },
+                'InvoiceAmount': round(sum(base + base * rate / 100 for rate, base in lines), 2),
+                'ProtectedID': '0' * 32,
+                'TaxesPerSeller': [{'VAT': vat}],
+            }
+        }
+    }
+
+
+class AnalyticsBenchmark():
+
+    def run(self):
+        """
+        Store 1M invoices spread over three months in a column store, then time reconciliation queries.
+        """
+        random.seed(0)
+        start_day = datetime.datetime(2024, 1, 1, 12, 0)
+        store = InvoiceColumnStore(tempfile.mkdtemp(), flush_rows=10000)
+
+        start = time.perf_counter()
+        for number in range(INVOICES):
+            lines = [(random.choice((22, 9.5, 5)), random.randint(100, 10000) / 100)
+                     for _ in range(random.randint(1, 3))]
+            message = build_message(start_day + datetime.timedelta(days=number * 90 // INVOICES),
+                                     'BP%d' % random.randint(1, 20), 'B%d' % random.randint(1, 5), number, lines)
+            store.append(message, eor='00000000-0000-0000-0000-%012d' % number, failed=random.random() < 0.001)
+        store.flush()
+        elapsed = time.perf_counter() - start
+        print("build and append     %8.3f s %10.0f invoices/s" % (elapsed, INVOICES / elapsed))
+
+        for name, query in (('totals by premise', lambda: store.totals(by=('premise',))),
+                            ('totals by device', lambda: store.totals(by=('premise', 'device'))),
+                            ('totals for january', lambda: store.totals(by=(), end=datetime.date(2024, 2, 1))),
+                            ('taxes by rate', lambda: store.tax_totals(by=('rate',))),
+                            ('taxes by day, rate', lambda: store.tax_totals(by=('day', 'rate')))):
+            start = time.perf_counter()
+            result = query()
+            print("%-20s %8.3f s %10d groups" % (name, time.perf_counter() - start, len(result)))
+
+        print(store.tax_totals(by=('rate',)))
+        store.close()
+
+
+if __name__ == "__main__":
+    benchmark = AnalyticsBenchmark()
+    benchmark.run()
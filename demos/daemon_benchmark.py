@@ -0,0 +1,81 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from datetime import datetime
+from multiprocessing import Pool
+
+from furs_fiscal.api import TaxesPerSeller
+from furs_fiscal.client import FURSDaemonClient
+from furs_fiscal.simulator import SimulatorServer
+
+# Path to our .p12 cert file
+P12_CERT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'demo_podjetje.p12')
+# Password for out .p12 cert file
+P12_CERT_PASS = 'Geslo123#'
+
+CLIENT_PROCESSES = 8
+INVOICES_PER_CLIENT = 250
+
+
+def issue_invoices(socket_path):
+    client = FURSDaemonClient(socket_path=socket_path)
+    seller = TaxesPerSeller()
+    seller.add_vat_amount(tax_rate=22, tax_base=10, tax_amount=2.2)
+
+    for number in range(1, INVOICES_PER_CLIENT + 1):
+        date_issued = datetime.now()
+        zoi = client.calculate_zoi(tax_number=10039856,
+                                   issued_date=date_issued,
+                                   invoice_number=str(number),
+                                   business_premise_id='BP101',
+                                   electronic_device_id='B%d' % os.getpid(),
+                                   invoice_amount=12.2)
+        client.get_invoice_eor(zoi=zoi,
+                               tax_number=10039856,
+                               issued_date=date_issued,
+                               invoice_number=str(number),
+                               business_premise_id='BP101',
+                               electronic_device_id='B%d' % os.getpid(),
+                               invoice_amount=12.2,
+                               taxes_per_seller=[seller])
+
+
+class DaemonBenchmark():
+
+    def run(self):
+        """
+        Start a local FURS simulator and the fiscalization daemon, then issue invoices from several client
+        processes through the daemon and report throughput.
+        """
+        socket_path = os.path.join(tempfile.mkdtemp(), 'furs-fiscal.sock')
+
+        with SimulatorServer() as simulator:
+            daemon = subprocess.Popen([sys.executable, '-m', 'furs_fiscal.daemon',
+                                       '--p12', P12_CERT_PATH,
+                                       '--endpoint', simulator.endpoint,
+                                       '--socket', socket_path],
+                                      env=dict(os.environ, FURS_P12_PASSWORD=P12_CERT_PASS))
+            while not os.path.exists(socket_path):
+                time.sleep(0.05)
+
+            try:
+                start = time.perf_counter()
+                with Pool(CLIENT_PROCESSES) as pool:
+                    pool.map(issue_invoices, [socket_path] * CLIENT_PROCESSES)
+                elapsed = time.perf_counter() - start
+
+                invoices = CLIENT_PROCESSES * INVOICES_PER_CLIENT
+                print("%d invoices from %d processes in %.2f s: %.0f invoices/s" % (
+                    invoices, CLIENT_PROCESSES, elapsed, invoices / elapsed))
+                print(FURSDaemonClient(socket_path=socket_path).stats())
+            finally:
+                daemon.terminate()
+                daemon.wait()
+
+
+if __name__ == "__main__":
+    benchmark = DaemonBenchmark()
+    benchmark.run()
@@ -0,0 +1,109 @@
+import multiprocessing
+import os
+import time
+
+from datetime import datetime
+
+from furs_fiscal.api import FURSInvoiceAPI, TaxesPerSeller
+from furs_fiscal.simulator import SimulatorServer
+
+# Path to our .p12 cert file
+P12_CERT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'demo_podjetje.p12')
+# Password for out .p12 cert file
+P12_CERT_PASS = 'Geslo123#'
+
+WORKERS = 8
+INVOICES_PER_WORKER = 50
+
+
+def issue_invoice(api, number):
+    seller = TaxesPerSeller()
+    seller.add_vat_amount(tax_rate=22, tax_base=10, tax_amount=2.2)
+    date_issued = datetime.now()
+    zoi = api.calculate_zoi(tax_number=10039856,
+                            issued_date=date_issued,
+                            invoice_number=str(number),
+                            business_premise_id='BP101',
+                            electronic_device_id='B%d' % os.getpid(),
+                            invoice_amount=12.2)
+    return api.get_invoice_eor(zoi=zoi,
+                               tax_number=10039856,
+                               issued_date=date_issued,
+                               invoice_number=str(number),
+                               business_premise_id='BP101',
+                               electronic_device_id='B%d' % os.getpid(),
+                               invoice_amount=12.2,
+                               taxes_per_seller=[seller])
+
+
+def memory_usage():
+    """
+    :return: (tuple) proportional and private memory of this process in kB
+    """
+    values = {}
+    with open('/proc/self/smaps_rollup') as smaps:
+        for line in smaps:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1])
+    return values['Pss'], values['Private_Clean'] + values['Private_Dirty']
+
+
+def worker(api, endpoint, results):
+    start = time.perf_counter()
+    if api is None:
+        # without preloading every worker parses the .p12 on its own
+        api = FURSInvoiceAPI(p12_path=P12_CERT_PATH, p12_password=P12_CERT_PASS, endpoint=endpoint)
+    issue_invoice(api, 1)
+    first = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for number in range(2, INVOICES_PER_WORKER + 1):
+        issue_invoice(api, number)
+    rest = (time.perf_counter() - start) / (INVOICES_PER_WORKER - 1)
+
+    results.put((first, rest) + memory_usage())
+
+
+class ForkBenchmark():
+
+    def run(self):
+        """
+        Fork worker processes like a pre-fork server does, once with the API created in the master before the fork
+        and once with every worker creating its own, and report first request time and memory per worker.
+        """
+        context = multiprocessing.get_context('fork')
+
+        with SimulatorServer() as simulator:
+            for name, preload in (('preloaded', True), ('per worker', False)):
+                api = None
+                if preload:
+                    api = FURSInvoiceAPI(p12_path=P12_CERT_PATH, p12_password=P12_CERT_PASS,
+                                         endpoint=simulator.endpoint)
+                    # leave an open connection in the pool, workers must not share it
+                    issue_invoice(api, 0)
+
+                results = context.Queue()
+                workers = [context.Process(target=worker, args=(api, simulator.endpoint, results))
+                           for _ in range(WORKERS)]
+                for process in workers:
+                    process.start()
+                measurements = [results.get() for _ in workers]
+                for process in workers:
+                    process.join()
+
+                count = len(measurements)
+                print("%-11s first request %6.1f ms, next requests %5.2f ms, PSS %6d kB, private %6d kB per worker" % (
+                    name,
+                    sum(m[0] for m in measurements) * 1000 / count,
+                    sum(m[1] for m in measurements) * 1000 / count,
+                    sum(m[2] for m in measurements) / count,
+                    sum(m[3] for m in measurements) / count))
+
+                if api is not None:
+                    api.connector.close()
+
+
+if __name__ == "__main__":
+    benchmark = ForkBenchmark()
+    benchmark.run()
@@ -0,0 +1,40 @@
+import time
+
+from furs_fiscal import printable
+
+# Data Record as returned by FURSInvoiceAPI.prepare_printable
+DATA_RECORD = '241852225981689263749232311732657822463100398562610190417553'
+RECEIPTS = 2000
+
+
+class PrintableBenchmark():
+
+    def run(self):
+        """
+        Measure how many receipts per second can be rendered in each of the supported output formats.
+        """
+        cases = [
+            ('QR matrix', lambda: printable.qr_matrix(DATA_RECORD)),
+            ('QR ESC/POS raster', lambda: printable.to_escpos_raster(printable.qr_matrix(DATA_RECORD))),
+            ('QR PNG', lambda: printable.to_png(printable.qr_matrix(DATA_RECORD))),
+            ('QR SVG', lambda: printable.to_svg(printable.qr_matrix(DATA_RECORD))),
+            ('Code128 ESC/POS raster',
+             lambda: printable.to_escpos_raster(printable.code128_matrix(DATA_RECORD), scale=2)),
+            ('Code128 PNG', lambda: printable.to_png(printable.code128_matrix(DATA_RECORD), scale=2)),
+            ('QR ESC/POS native', lambda: printable.escpos_qr(DATA_RECORD)),
+            ('PDF417 ESC/POS native', lambda: printable.escpos_pdf417(DATA_RECORD)),
+            ('Code128 ESC/POS native', lambda: printable.escpos_code128(DATA_RECORD)),
+        ]
+
+        for name, render in cases:
+            start = time.perf_counter()
+            for _ in range(RECEIPTS):
+                render()
+            elapsed = time.perf_counter() - start
+
+            print("%-24s %10.0f receipts/s %8.3f ms/receipt" % (name, RECEIPTS / elapsed, elapsed * 1000 / RECEIPTS))
+
+
+if __name__ == "__main__":
+    benchmark = PrintableBenchmark()
+    benchmark.run()
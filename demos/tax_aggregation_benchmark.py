@@ -0,0 +1,42 @@
+import random
+import time
+
+from decimal import Decimal
+
+from furs_fiscal.aggregation import aggregate_taxes, CATEGORY_VAT, CATEGORY_EXEMPT, CATEGORY_NON_TAXABLE
+
+LINES = 1000000
+
+
+class TaxAggregationBenchmark():
+
+    def run(self):
+        """
+        Aggregate 1M invoice lines into TaxesPerSeller objects, with amounts given as Decimals and as integer cents.
+        """
+        random.seed(0)
+        cents = [random.randint(1, 100000) for _ in range(LINES)]
+        amounts = [Decimal(value) / 100 for value in cents]
+        tax_rates = [random.choice((22, 9.5, 5)) for _ in range(LINES)]
+        sellers = [random.choice((None, None, None, 12345678)) for _ in range(LINES)]
+        categories = [random.choice((CATEGORY_VAT,) * 8 + (CATEGORY_EXEMPT, CATEGORY_NON_TAXABLE))
+                      for _ in range(LINES)]
+
+        for name, column, in_cents in (('Decimal amounts', amounts, False), ('integer cents', cents, True)):
+            start = time.perf_counter()
+            taxes_per_seller = aggregate_taxes(column,
+                                               tax_rates=tax_rates,
+                                               sellers=sellers,
+                                               categories=categories,
+                                               amounts_in_cents=in_cents)
+            elapsed = time.perf_counter() - start
+
+            print("%-16s %8.3f s %12.0f lines/s" % (name, elapsed, LINES / elapsed))
+
+        for tax_per_seller in taxes_per_seller:
+            print(tax_per_seller.build_json())
+
+
+if __name__ == "__main__":
+    benchmark = TaxAggregationBenchmark()
+    benchmark.run()
@@ -0,0 +1,63 @@
+import os
+import time
+
+from datetime import datetime
+
+from furs_fiscal.api import FURSInvoiceAPI, TaxesPerSeller
+from furs_fiscal.simulator import SimulatorServer
+from furs_fiscal.transport import LoopbackTransport, RequestsTransport, Urllib3Transport
+
+# Path to our .p12 cert file
+P12_CERT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'demo_podjetje.p12')
+# Password for out .p12 cert file
+P12_CERT_PASS = 'Geslo123#'
+
+INVOICES = 1000
+
+
+class TransportBenchmark():
+
+    def run(self):
+        """
+        Issue invoices through each transport against a local FURS simulator and report per-request time.
+        The loopback transport shows the cost of the library itself, the others add HTTP on top of it.
+        """
+        seller = TaxesPerSeller()
+        seller.add_vat_amount(tax_rate=22, tax_base=10, tax_amount=2.2)
+
+        with SimulatorServer() as simulator:
+            for name, transport in (('requests', RequestsTransport()),
+                                    ('urllib3', Urllib3Transport()),
+                                    ('loopback', LoopbackTransport())):
+                api = FURSInvoiceAPI(p12_path=P12_CERT_PATH,
+                                     p12_password=P12_CERT_PASS,
+                                     endpoint=simulator.endpoint,
+                                     transport=transport)
+
+                start = time.perf_counter()
+                for number in range(1, INVOICES + 1):
+                    date_issued = datetime.now()
+                    zoi = api.calculate_zoi(tax_number=10039856,
+                                            issued_date=date_issued,
+                                            invoice_number=str(number),
+                                            business_premise_id='BP101',
+                                            electronic_device_id='B1',
+                                            invoice_amount=12.2)
+                    api.get_invoice_eor(zoi=zoi,
+                                        tax_number=10039856,
+                                        issued_date=date_issued,
+                                        invoice_number=str(number),
+                                        business_premise_id='BP101',
+                                        electronic_device_id='B1',
+                                        invoice_amount=12.2,
+                                        taxes_per_seller=[seller])
+                elapsed = time.perf_counter() - start
+                transport.close()
+
+                print("%-10s %8.3f ms/invoice %8.0f invoices/s" % (name, elapsed * 1000 / INVOICES,
+                                                                   INVOICES / elapsed))
+
+
+if __name__ == "__main__":
+    benchmark = TransportBenchmark()
+    benchmark.run()
@@ -0,0 +1,136 @@
+"""
+Aggregation of invoice line items into TaxesPerSeller objects.
+
+Line items are given in columnar form - one sequence per attribute - and summed as integer cents, so the result
+does not depend on the order of lines and does not accumulate floating point errors. Taxes are calculated once
+per (seller, tax rate) group and rounded half up to cents.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+from furs_fiscal.api import TaxesPerSeller
+
+
+CATEGORY_VAT = 'VAT'
+CATEGORY_EXEMPT = 'EXEMPT'
+CATEGORY_REVERSE = 'REVERSE'
+CATEGORY_NON_TAXABLE = 'NON_TAXABLE'
+CATEGORY_SPECIAL = 'SPECIAL'
+CATEGORY_OTHER_TAXES = 'OTHER_TAXES'
+
+# category -> TaxesPerSeller attribute
+CATEGORY_FIELDS = {
+    CATEGORY_EXEMPT: 'exempt_vat_taxable_amount',
+    CATEGORY_REVERSE: 'reverse_vat_taxable_amount',
+    CATEGORY_NON_TAXABLE: 'non_taxable_amount',
+    CATEGORY_SPECIAL: 'special_tax_rules_amount',
+    CATEGORY_OTHER_TAXES: 'other_taxes_amount',
+}
+
+_HUNDRED = Decimal(100)
+
+
+def to_cents(amount):
+    """
+    Convert amount to integer cents, rounding half up.
+
+    :param amount: (Decimal, int, float or string) amount in euros
+    :return: (int) amount in cents
+    """
+    return int((Decimal(str(amount)) * _HUNDRED).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def _round_cents(value):
+    return int(value.to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def _from_cents(cents):
+    # cents / 100 always gives the shortest float representation with two decimals, e.g. 2314 -> 23.14
+    return cents / 100
+
+
+def aggregate_taxes(amounts,
+                    tax_rates=None,
+                    sellers=None,
+                    categories=None,
+                    amounts_in_cents=False,
+                    amounts_include_vat=False):
+    """
+    Group invoice lines by seller, category and tax rate and build TaxesPerSeller objects for get_invoice_eor.
+
+    All column arguments are sequences of the same length, one item per invoice line.
+
+    :param amounts: (list) Line amounts. Net amounts, or gross amounts if amounts_include_vat is True
+    :param tax_rates: (list) VAT rate in percent for each line, e.g. 22 or 9.5. Ignored for non-VAT categories
+    :param sellers: (list) Seller tax number for each line, None for the invoice issuer. Default: all lines None
+    :param categories: (list) One of the CATEGORY_* constants for each line. Default: all lines CATEGORY_VAT
+    :param amounts_in_cents: (boolean) Amounts are already integer cents - skips conversion, which is the
+                                       slowest part of aggregation. Default: False
+    :param amounts_include_vat: (boolean) Amounts of VAT lines include VAT. Default: False
+    :return: (list) TaxesPerSeller objects, invoice issuer first
+    """
+    count = len(amounts)
+    if sellers is None:
+        sellers = (None,) * count
+    if categories is None:
+        categories = (CATEGORY_VAT,) * count
+    if tax_rates is None:
+        tax_rates = (None,) * count
+
+    if not len(tax_rates) == len(sellers) == len(categories) == count:
+        raise ValueError("All columns should have the same length")
+
+    if not amounts_in_cents:
+        conversion_cache = {}
+        cents = []
+        for amount in amounts:
+            value = conversion_cache.get(amount)
+            if value is None:
+                value = conversion_cache[amount] = to_cents(amount)
+            cents.append(value)
+        amounts = cents
+
+    # (seller, category, rate) -> sum of cents, rate is None for non-VAT categories
+    groups = {}
+    for amount, rate, seller, category in zip(amounts, tax_rates, sellers, categories):
+        key = (seller, category, rate if category == CATEGORY_VAT else None)
+        groups[key] = groups.get(key, 0) + amount
+
+    rates = {}
+    totals = {}
+    for (seller, category, rate), amount in groups.items():
+        if category == CATEGORY_VAT:
+            if rate is None:
+                raise ValueError("Tax rate is required for VAT lines")
+            # 22, 22.0 and Decimal('22.00') must end up in the same group
+            rate = rates.setdefault(rate, Decimal(str(rate)).normalize())
+        elif category not in CATEGORY_FIELDS:
+            raise ValueError("Unknown tax category: %s" % category)
+        key = (seller, category, rate)
+        totals[key] = totals.get(key, 0) + amount
+
+    taxes_per_seller = {}
+    for (seller, category, rate), amount in sorted(totals.items(), key=_sort_key):
+        if seller not in taxes_per_seller:
+            taxes_per_seller[seller] = TaxesPerSeller(seller_tax_number=seller)
+        tax_per_seller = taxes_per_seller[seller]
+
+        if category == CATEGORY_VAT:
+            if amounts_include_vat:
+                taxable = _round_cents(amount * _HUNDRED / (_HUNDRED + rate))
+                tax = amount - taxable
+            else:
+                taxable = amount
+                tax = _round_cents(amount * rate / _HUNDRED)
+            tax_per_seller.add_vat_amount(tax_rate=float(rate),
+                                          tax_base=_from_cents(taxable),
+                                          tax_amount=_from_cents(tax))
+        else:
+            setattr(tax_per_seller, CATEGORY_FIELDS[category], _from_cents(amount))
+
+    return list(taxes_per_seller.values())
+
+
+def _sort_key(item):
+    (seller, category, rate), _ = item
+    # issuer (None) first, VAT rates from highest to lowest
+    return seller is not None, seller or 0, category, -(rate or 0)
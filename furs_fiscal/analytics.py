@@ -0,0 +1,409 @@
+"""
+Columnar store of fiscalized invoices for end of day reconciliation.
+
+Every invoice is stored as one row of typed columns - issue day, premise, device, amount and flags - and every
+tax line (seller, category and tax rate) as one row of a second table. Each column is a flat binary file of
+fixed size values, so totals over months of invoices are computed by scanning a few memory mapped arrays instead
+of parsing JSON. Strings (premise, device and seller tax numbers) are stored as codes into a shared dictionary.
+"""
+import array
+import datetime
+import json
+import mmap
+import os
+import threading
+
+from furs_fiscal.aggregation import to_cents, CATEGORY_VAT, CATEGORY_EXEMPT, CATEGORY_REVERSE, \
+    CATEGORY_NON_TAXABLE, CATEGORY_SPECIAL, CATEGORY_OTHER_TAXES
+from furs_fiscal.listeners import InvoiceListener
+
+
+FLAG_FAILED = 1
+FLAG_SUBSEQUENT = 2
+FLAG_SALES_BOOK = 4
+
+# category code stored in the category column is the index in this tuple
+CATEGORIES = (CATEGORY_VAT, CATEGORY_EXEMPT, CATEGORY_REVERSE, CATEGORY_NON_TAXABLE, CATEGORY_SPECIAL,
+              CATEGORY_OTHER_TAXES)
+
+# TaxesPerSeller JSON field -> category, for amounts without a tax rate
+_CATEGORY_AMOUNTS = (
+    ('ExemptVATTaxableAmount', CATEGORIES.index(CATEGORY_EXEMPT)),
+    ('ReverseVATTaxableAmount', CATEGORIES.index(CATEGORY_REVERSE)),
+    ('NontaxableAmount', CATEGORIES.index(CATEGORY_NON_TAXABLE)),
+    ('SpecialTaxRulesAmount', CATEGORIES.index(CATEGORY_SPECIAL)),
+    ('OtherTaxesAmount', CATEGORIES.index(CATEGORY_OTHER_TAXES)),
+)
+
+# table -> ((column, array typecode), ...)
+# day is date.toordinal(), rate is in hundredths of a percent, amounts are in cents
+COLUMNS = {
+    'invoices': (('day', 'i'), ('premise', 'i'), ('device', 'i'), ('amount', 'q'), ('flags', 'B')),
+    'taxes': (('day', 'i'), ('premise', 'i'), ('device', 'i'), ('seller', 'i'), ('category', 'B'), ('rate', 'i'),
+              ('taxable', 'q'), ('tax', 'q'), ('flags', 'B')),
+}
+
+EOR_SIZE = 36
+
+
+class InvoiceColumnStore(InvoiceListener):
+    """
+    InvoiceColumnStore appends every issued and failed invoice to a columnar store and answers totals over it.
+
+    Usage:
+        store = InvoiceColumnStore('/var/lib/furs/analytics')
+        api = FURSInvoiceAPI(p12_path, p12_password, listeners=[store])
+        ...
+        store.totals(by=('premise', 'device'), start=datetime.date(2024, 1, 1))
+        store.tax_totals(by=('seller', 'rate'))
+
+    The store must have a single writer. Other processes may open the same directory with readonly=True for
+    queries.
+    """
+    def __init__(self, path, flush_rows=1, readonly=False):
+        """
+        :param path: (string) Directory holding the column files, created if it does not exist
+        :param flush_rows: (int) How many invoices to buffer before writing them to the files. Buffered invoices
+                                 are not visible to other processes and are lost if the process dies. Use a larger
+                                 value for bulk imports
+        :param readonly: (boolean) Only query the store, while another process writes to it
+        """
+        self.path = path
+        self.flush_rows = flush_rows
+        self.readonly = readonly
+
+        os.makedirs(path, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._strings = []
+        self._codes = {}
+        self._dictionary_size = 0
+        self._dictionary_mtime = None
+        self._buffered_invoices = 0
+        self._buffers = dict((table, dict((name, array.array(typecode)) for name, typecode in columns))
+                             for table, columns in COLUMNS.items())
+        self._eor_buffer = []
+
+        self._load_dictionary()
+        if not readonly:
+            self._truncate_partial_rows()
+        self._files = None
+
+    def invoice_issued(self, message, eor):
+        self.append(message, eor=eor)
+
+    def invoice_failed(self, message, exception):
+        self.append(message, failed=True)
+
+    def append(self, message, eor=None, failed=False):
+        """
+        Add an invoice to the store, e.g. when importing invoices issued before the store was used.
+
+        :param message: (dict) InvoiceRequest message as sent to FURS
+        :param eor: (string) EOR received from FURS
+        :param failed: (boolean) FURS did not accept the invoice
+        """
+        if self.readonly:
+            raise ValueError("Store is opened read only")
+
+        request = message['InvoiceRequest']
+        flags = FLAG_FAILED if failed else 0
+        if 'Invoice' in request:
+            invoice = request['Invoice']
+            identifier = invoice['InvoiceIdentifier']
+            day = datetime.date.fromisoformat(invoice['IssueDateTime'][:10]).toordinal()
+            premise = identifier['BusinessPremiseID']
+            device = identifier['ElectronicDeviceID']
+            if invoice.get('SubsequentSubmit'):
+                flags |= FLAG_SUBSEQUENT
+        else:
+            invoice = request['SalesBookInvoice']
+            identifier = invoice['SalesBookIdentifier']
+            day = datetime.date.fromisoformat(invoice['IssueDate'][:10]).toordinal()
+            premise = invoice['BusinessPremiseID']
+            device = '%s/%s' % (identifier['SetNumber'], identifier['SerialNumber'])
+            flags |= FLAG_SALES_BOOK
+
+        # build all rows first, so a malformed message does not leave the columns misaligned
+        amount = to_cents(invoice['InvoiceAmount'])
+        tax_rows = []
+        for taxes in invoice.get('TaxesPerSeller', []):
+            seller = str(taxes.get('SellerTaxNumber') or '')
+            for vat in taxes.get('VAT', []):
+                tax_rows.append((seller, 0, int(round(float(vat['TaxRate']) * 100)), to_cents(vat['TaxableAmount']),
+                                 to_cents(vat['TaxAmount'])))
+            for field, category in _CATEGORY_AMOUNTS:
+                if taxes.get(field):
+                    tax_rows.append((seller, category, 0, to_cents(taxes[field]), 0))
+        eor = (eor or '').encode('ascii')[:EOR_SIZE].ljust(EOR_SIZE, b'\0')
+
+        with self._lock:
+            premise, device = self._code(str(premise)), self._code(str(device))
+
+            columns = self._buffers['invoices']
+            columns['day'].append(day)
+            columns['premise'].append(premise)
+            columns['device'].append(device)
+            columns['amount'].append(amount)
+            columns['flags'].append(flags)
+            self._eor_buffer.append(eor)
+
+            columns = self._buffers['taxes']
+            for seller, category, rate, taxable, tax in tax_rows:
+                columns['day'].append(day)
+                columns['premise'].append(premise)
+                columns['device'].append(device)
+                columns['seller'].append(self._code(seller))
+                columns['category'].append(category)
+                columns['rate'].append(rate)
+                columns['taxable'].append(taxable)
+                columns['tax'].append(tax)
+                columns['flags'].append(flags)
+
+            self._buffered_invoices += 1
+            if self._buffered_invoices >= self.flush_rows:
+                self._flush()
+
+    def flush(self):
+        """
+        Write buffered invoices to the column files.
+        """
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._files is not None:
+                for column_file in self._files.values():
+                    column_file.close()
+                self._files = None
+
+    def totals(self, by=('premise',), start=None, end=None):
+        """
+        Invoice totals.
+
+        :param by: (tuple) Group by these columns: 'day', 'premise' and 'device'. Empty tuple gives grand totals
+        :param start: (date) First issue day included. Default: None, from the beginning
+        :param end: (date) First issue day not included. Default: None, until the end
+        :return: (dict) group key tuple -> dict with count and amount of issued invoices, failed (count of
+                        failures) and subsequent (count of issued subsequent submits)
+        """
+        first, last = InvoiceColumnStore._day_range(start, end)
+        result = {}
+
+        with self._columns('invoices') as columns:
+            keys = zip(*[columns[name] for name in by]) if by else _empty_keys(len(columns['day']))
+            for key, day, amount, flags in zip(keys, columns['day'], columns['amount'], columns['flags']):
+                if not first <= day < last:
+                    continue
+
+                totals = result.get(key)
+                if totals is None:
+                    totals = result[key] = [0, 0, 0, 0]
+
+                if flags & FLAG_FAILED:
+                    totals[2] += 1
+                else:
+                    totals[0] += 1
+                    totals[1] += amount
+                    if flags & FLAG_SUBSEQUENT:
+                        totals[3] += 1
+
+        return dict((self._decode(by, key), {'count': count, 'amount': amount / 100, 'failed': failed,
+                                             'subsequent': subsequent})
+                    for key, (count, amount, failed, subsequent) in result.items())
+
+    def tax_totals(self, by=('rate',), start=None, end=None):
+        """
+        Totals of taxable and tax amounts of issued invoices.
+
+        :param by: (tuple) Group by these columns: 'day', 'premise', 'device', 'seller', 'category' and 'rate'
+        :param start: (date) First issue day included. Default: None, from the beginning
+        :param end: (date) First issue day not included. Default: None, until the end
+        :return: (dict) group key tuple -> dict with taxable and tax amounts
+        """
+        first, last = InvoiceColumnStore._day_range(start, end)
+        result = {}
+
+        with self._columns('taxes') as columns:
+            keys = zip(*[columns[name] for name in by]) if by else _empty_keys(len(columns['day']))
+            for key, day, taxable, tax, flags in zip(keys, columns['day'], columns['taxable'], columns['tax'],
+                                                     columns['flags']):
+                if flags & FLAG_FAILED or not first <= day < last:
+                    continue
+
+                totals = result.get(key)
+                if totals is None:
+                    totals = result[key] = [0, 0]
+                totals[0] += taxable
+                totals[1] += tax
+
+        return dict((self._decode(by, key), {'taxable': taxable / 100, 'tax': tax / 100})
+                    for key, (taxable, tax) in result.items())
+
+    def eors(self, start=0, stop=None):
+        """
+        :return: (list) EORs of invoices in insertion order, None for failed invoices
+        """
+        with self._lock:
+            if not self.readonly:
+                self._flush()
+            with open(self._file_path('invoices', 'eor'), 'rb') as eor_file:
+                eor_file.seek(start * EOR_SIZE)
+                content = eor_file.read(None if stop is None else (stop - start) * EOR_SIZE)
+
+        return [content[offset:offset + EOR_SIZE].rstrip(b'\0').decode('ascii') or None
+                for offset in range(0, len(content) - len(content) % EOR_SIZE, EOR_SIZE)]
+
+    def _decode(self, by, key):
+        decoded = []
+        for name, value in zip(by, key):
+            if name == 'day':
+                decoded.append(datetime.date.fromordinal(value))
+            elif name == 'category':
+                decoded.append(CATEGORIES[value])
+            elif name == 'rate':
+                decoded.append(value / 100)
+            elif name == 'seller':
+                decoded.append(self._strings[value] or None)
+            else:
+                decoded.append(self._strings[value])
+        return tuple(decoded)
+
+    @staticmethod
+    def _day_range(start, end):
+        return (start.toordinal() if start is not None else -2 ** 31,
+                end.toordinal() if end is not None else 2 ** 31)
+
+    def _code(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self._strings)
+            self._strings.append(value)
+        return code
+
+    def _file_path(self, table, column):
+        return os.path.join(self.path, '%s.%s' % (table, column))
+
+    def _flush(self):
+        if not self._buffered_invoices:
+            return
+
+        if self._files is None:
+            self._files = {}
+            for table, columns in COLUMNS.items():
+                for name, typecode in columns:
+                    self._files[table, name] = open(self._file_path(table, name), 'ab')
+            self._files['invoices', 'eor'] = open(self._file_path('invoices', 'eor'), 'ab')
+
+        # codes must be in the dictionary before rows using them are visible
+        if len(self._strings) != self._dictionary_size:
+            temp_path = os.path.join(self.path, 'dictionary.json.tmp')
+            with open(temp_path, 'w') as dictionary:
+                json.dump(self._strings, dictionary)
+            os.replace(temp_path, self._dictionary_path())
+            self._dictionary_size = len(self._strings)
+            self._dictionary_mtime = os.stat(self._dictionary_path()).st_mtime_ns
+
+        for table, columns in self._buffers.items():
+            for name, values in columns.items():
+                column_file = self._files[table, name]
+                values.tofile(column_file)
+                column_file.flush()
+                del values[:]
+
+        eor_file = self._files['invoices', 'eor']
+        eor_file.write(b''.join(self._eor_buffer))
+        eor_file.flush()
+        self._eor_buffer = []
+
+        self._buffered_invoices = 0
+
+    def _dictionary_path(self):
+        return os.path.join(self.path, 'dictionary.json')
+
+    def _load_dictionary(self):
+        try:
+            mtime = os.stat(self._dictionary_path()).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._dictionary_mtime:
+            return
+
+        with open(self._dictionary_path()) as dictionary:
+            self._strings = json.load(dictionary)
+        self._codes = dict((value, code) for code, value in enumerate(self._strings))
+        self._dictionary_size = len(self._strings)
+        self._dictionary_mtime = mtime
+
+    def _truncate_partial_rows(self):
+        # a crash while flushing may leave some columns longer than others
+        for table, columns in COLUMNS.items():
+            sizes = dict(((table, name), array.array(typecode).itemsize) for name, typecode in columns)
+            if table == 'invoices':
+                sizes[table, 'eor'] = EOR_SIZE
+
+            rows = None
+            for (_, name), size in sizes.items():
+                path = self._file_path(table, name)
+                column_rows = os.path.getsize(path) // size if os.path.exists(path) else 0
+                rows = column_rows if rows is None else min(rows, column_rows)
+
+            for (_, name), size in sizes.items():
+                path = self._file_path(table, name)
+                if os.path.exists(path) and os.path.getsize(path) != rows * size:
+                    os.truncate(path, rows * size)
+
+    def _columns(self, table):
+        if not self.readonly:
+            with self._lock:
+                self._flush()
+        return _MappedColumns(self, table)
+
+
+class _MappedColumns(object):
+    """
+    Context manager mapping column files of a table into memory as typed memoryviews, all cut to the same number
+    of rows - the writer may be appending while they are read.
+    """
+    def __init__(self, store, table):
+        self.store = store
+        self.table = table
+        self._maps = []
+        self._views = []
+
+    def __enter__(self):
+        columns = COLUMNS[self.table]
+        files = [(name, typecode, self.store._file_path(self.table, name)) for name, typecode in columns]
+        sizes = [array.array(typecode).itemsize for _, typecode, _ in files]
+        rows = min(os.path.getsize(path) // size if os.path.exists(path) else 0
+                   for (_, _, path), size in zip(files, sizes))
+
+        if self.store.readonly:
+            # codes may have been added by the writer since the dictionary was loaded
+            with self.store._lock:
+                self.store._load_dictionary()
+
+        result = {}
+        for (name, typecode, path), size in zip(files, sizes):
+            if rows == 0:
+                result[name] = array.array(typecode)
+                continue
+            with open(path, 'rb') as column_file:
+                mapped = mmap.mmap(column_file.fileno(), rows * size, access=mmap.ACCESS_READ)
+            view = memoryview(mapped).cast(typecode)
+            self._maps.append(mapped)
+            self._views.append(view)
+            result[name] = view
+        return result
+
+    def __exit__(self, *args):
+        for view in self._views:
+            view.release()
+        for mapped in self._maps:
+            mapped.close()
+
+
+def _empty_keys(rows):
+    return (() for _ in range(rows))
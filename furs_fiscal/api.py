@@ -1,9 +1,17 @@
 import pytz
 import hashlib
+import logging
 import uuid
 import datetime
+import threading
 
+from collections import OrderedDict
+
+from furs_fiscal import forksafe, profiling
 from furs_fiscal.base_api import FURSBaseAPI
+from furs_fiscal.exceptions import ValidationException
+from furs_fiscal.scheduler import PRIORITY_ADMIN, PRIORITY_BULK, PRIORITY_INTERACTIVE, PRIORITY_SUBSEQUENT
+from furs_fiscal.validation import SchemaError
 
 
 TYPE_MOVABLE_PREMISE_A = 'A'
@@ -16,6 +24,8 @@ NUMBERING_STRUCTURE_DEVICE = 'B'
 REGISTER_BUSINESS_UNIT_PATH = 'v1/cash_registers/invoices/register'
 INVOICE_ISSUE_PATH = 'v1/cash_registers/invoices'
 
+logger = logging.getLogger(__name__)
+
 
 class FURSBusinessPremiseAPI(FURSBaseAPI):
     """
@@ -62,6 +72,7 @@ class FURSBusinessPremiseAPI(FURSBaseAPI):
         :return: boolean: Will return True if success or raise an Exception if anything goes wrong
 
         :raises
+            ValidationException - request does not conform to the FURS schema
             FURSException - FURS server returned an error
             ConnectionTimedOutException - connection timed out
             ConnectionException - Generic exception
@@ -90,7 +101,7 @@ class FURSBusinessPremiseAPI(FURSBaseAPI):
             message['BusinessPremiseRequest']['BusinessPremise']\
                 ['BPIdentifier']['RealEstateBP']['Address'].pop('HouseNumberAdditional')
 
-        self._send_request(path=REGISTER_BUSINESS_UNIT_PATH, data=message)
+        self._send_request(path=REGISTER_BUSINESS_UNIT_PATH, data=message, priority=PRIORITY_ADMIN)
 
         return True
 
@@ -119,6 +130,7 @@ class FURSBusinessPremiseAPI(FURSBaseAPI):
         :return: boolean: Will return True if success or raise an Exception if anything goes wrong
 
         :raises
+            ValidationException - request does not conform to the FURS schema
             FURSException - FURS server returned an error
             ConnectionTimedOutException - connection timed out
             ConnectionException - Generic exception
@@ -128,7 +140,7 @@ class FURSBusinessPremiseAPI(FURSBaseAPI):
 
         bpi_identifier['PremiseType'] = movable_type
 
-        self._send_request(path=REGISTER_BUSINESS_UNIT_PATH, data=message)
+        self._send_request(path=REGISTER_BUSINESS_UNIT_PATH, data=message, priority=PRIORITY_ADMIN)
 
         return True
 
@@ -213,6 +225,8 @@ class TaxesPerSeller:
             tax_spec['ExemptVATTaxableAmount'] = self.exempt_vat_taxable_amount
         if self.other_taxes_amount:
             tax_spec['OtherTaxesAmount'] = self.other_taxes_amount
+        if self.special_tax_rules_amount:
+            tax_spec['SpecialTaxRulesAmount'] = self.special_tax_rules_amount
 
         if self.seller_tax_number:
             tax_spec['SellerTaxNumber'] = self.seller_tax_number
@@ -222,15 +236,32 @@ class TaxesPerSeller:
 
 class FURSInvoiceAPI(FURSBaseAPI):
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, deterministic_zoi=False, zoi_cache_size=1024, listeners=None, **kwargs):
         """
         Initialize the class with current active tax rates in Slovenia.
         :param args:
+        :param deterministic_zoi: (boolean) Sign ZOI with PKCS#1 v1.5 (RS256) as required by the FURS specification.
+                                            The same invoice then always yields the same ZOI, which allows
+                                            caching, reprinting and verification of printed ZOIs. Default: False
+        :param zoi_cache_size: (int) How many ZOIs to remember in deterministic mode. 0 disables the cache.
+        :param listeners: (list) InvoiceListener objects notified about every issued or failed invoice
         :param kwargs:
         :return:
         """
         FURSBaseAPI.__init__(self, *args, **kwargs)
 
+        self.listeners = list(listeners or [])
+
+        self.deterministic_zoi = deterministic_zoi
+        self.zoi_cache_size = zoi_cache_size
+        self._zoi_cache = OrderedDict()
+        self._zoi_cache_lock = threading.Lock()
+
+        forksafe.register(self)
+
+    def _after_fork(self):
+        self._zoi_cache_lock = threading.Lock()
+
     def calculate_zoi(self,
                       tax_number,
                       issued_date,
@@ -249,11 +280,85 @@ class FURSInvoiceAPI(FURSBaseAPI):
         :param invoice_amount: (Decimal) invoice amount
         :return: (string) ZOI string
         """
-        content = "%s%s%s%s%s%s" % (tax_number,
-                                    issued_date.strftime('%d-%m-%Y %H:%M:%S'),
-                                    invoice_number, business_premise_id, electronic_device_id, invoice_amount)
+        with profiling.call(self.profiler, 'calculate_zoi'):
+            content = FURSInvoiceAPI._zoi_content(tax_number, issued_date, invoice_number,
+                                                  business_premise_id, electronic_device_id, invoice_amount)
+
+            if not self.deterministic_zoi:
+                with profiling.phase(self.profiler, 'sign'):
+                    return hashlib.md5(self._sign(content=content)).hexdigest()
+
+            # ZOIs of a rotated certificate differ, entries of the previous one age out of the cache
+            certificate = self.connector.certificate
+            cache_key = (certificate.serial, content)
+            with self._zoi_cache_lock:
+                zoi = self._zoi_cache.get(cache_key)
+                if zoi is not None:
+                    self._zoi_cache.move_to_end(cache_key)
+                    return zoi
+
+            with profiling.phase(self.profiler, 'sign'):
+                zoi = hashlib.md5(self._sign(content=content, deterministic=True, key=certificate.key)).hexdigest()
+
+            if self.zoi_cache_size > 0:
+                with self._zoi_cache_lock:
+                    self._zoi_cache[cache_key] = zoi
+                    while len(self._zoi_cache) > self.zoi_cache_size:
+                        self._zoi_cache.popitem(last=False)
+
+            return zoi
+
+    def verify_zoi(self,
+                   zoi,
+                   tax_number,
+                   issued_date,
+                   invoice_number,
+                   business_premise_id,
+                   electronic_device_id,
+                   invoice_amount):
+        """
+        Check that the ZOI belongs to the invoice. ZOI is a digest of the signature, so it can only be checked by
+        signing again - this only works for ZOIs calculated in deterministic mode.
+
+        :param zoi: (string) ZOI to check
+        :param tax_number: (int) issuer tax number
+        :param issued_date: (datetime) datetime of the invoice issue
+        :param invoice_number: (string) invoice sequential number
+        :param business_premise_id: (string) business premise id
+        :param electronic_device_id: (string) electronic device id
+        :param invoice_amount: (Decimal) invoice amount
+        :return: (boolean) True if ZOI matches the invoice
+        """
+        if not self.deterministic_zoi:
+            raise Exception("ZOI can only be verified in deterministic mode")
+
+        # signed directly, a bulk audit must not evict ZOIs cached for live issuance
+        content = FURSInvoiceAPI._zoi_content(tax_number, issued_date, invoice_number,
+                                              business_premise_id, electronic_device_id, invoice_amount)
+        return hashlib.md5(self._sign(content=content, deterministic=True)).hexdigest() == zoi.lower()
+
+    @staticmethod
+    def _zoi_content(tax_number, issued_date, invoice_number, business_premise_id, electronic_device_id,
+                     invoice_amount):
+        return "%s%s%s%s%s%s" % (tax_number,
+                                 issued_date.strftime('%d-%m-%Y %H:%M:%S'),
+                                 invoice_number, business_premise_id, electronic_device_id, invoice_amount)
+
+    def _recalculate_zoi(self, invoice):
+        """
+        Replace ZOI of an Invoice message part with one signed by this API's certificate, when sending an invoice
+        built elsewhere.
 
-        return hashlib.md5(self._sign(content=content)).hexdigest()
+        :param invoice: (dict) Invoice part of an InvoiceRequest message, changed in place
+        """
+        identifier = invoice['InvoiceIdentifier']
+        invoice['ProtectedID'] = self.calculate_zoi(
+            tax_number=invoice['TaxNumber'],
+            issued_date=datetime.datetime.strptime(invoice['IssueDateTime'], "%Y-%m-%dT%H:%M:%SZ"),
+            invoice_number=identifier['InvoiceNumber'],
+            business_premise_id=identifier['BusinessPremiseID'],
+            electronic_device_id=identifier['ElectronicDeviceID'],
+            invoice_amount=invoice['InvoiceAmount'])
 
     def prepare_printable(self, tax_number, zoi, issued_date, timezone='Europe/Ljubljana'):
         """
@@ -296,7 +401,8 @@ class FURSInvoiceAPI(FURSBaseAPI):
                         reference_invoice_electronic_device_id=None,
                         reference_invoice_issued_date=None,
                         numbering_structure=NUMBERING_STRUCTURE_DEVICE,
-                        special_notes=''):
+                        special_notes='',
+                        time_limit=None):
         """
         Obtain EOR from FURS. Will build the request and call the FURS API.
 
@@ -320,6 +426,7 @@ class FURSInvoiceAPI(FURSBaseAPI):
         :param reference_invoice_issued_date: (datetime) - Required if we're issuing Storno
         :param numbering_structure: (string) - defaults to B - numbering is defined by the Register, C for central numbering
         :param special_notes:
+        :param time_limit: (float) - Seconds you can wait for FURS in total, timeouts are shortened to fit
         :return: eor (string) - Invoice UniqueID from FURS
         """
         # build the base message body
@@ -353,6 +460,11 @@ class FURSInvoiceAPI(FURSBaseAPI):
         if reference_invoice_number:
             reference_invoices = []
             if isinstance(reference_invoice_number, list):
+                if self.validate:
+                    self._validate_reference_lists(reference_invoice_number,
+                                                   reference_invoice_business_premise_id,
+                                                   reference_invoice_electronic_device_id,
+                                                   reference_invoice_issued_date)
                 for i in range(0, len(reference_invoice_number)):
                     reference_invoices.append({
                         'ReferenceInvoiceIdentifier': {
@@ -360,7 +472,8 @@ class FURSInvoiceAPI(FURSBaseAPI):
                             'ElectronicDeviceID': reference_invoice_electronic_device_id[i],
                             'InvoiceNumber': reference_invoice_number[i]
                         },
-                        'ReferenceInvoiceIssueDateTime': reference_invoice_issued_date[i].strftime("%Y-%m-%dT%H:%M:%SZ")
+                        'ReferenceInvoiceIssueDateTime':
+                            FURSInvoiceAPI._format_reference_date(reference_invoice_issued_date[i])
                     })
             else:
                 reference_invoices.append({
@@ -369,15 +482,72 @@ class FURSInvoiceAPI(FURSBaseAPI):
                         'ElectronicDeviceID': reference_invoice_electronic_device_id,
                         'InvoiceNumber': reference_invoice_number
                     },
-                    'ReferenceInvoiceIssueDateTime': reference_invoice_issued_date.strftime("%Y-%m-%dT%H:%M:%SZ")
+                    'ReferenceInvoiceIssueDateTime': FURSInvoiceAPI._format_reference_date(reference_invoice_issued_date)
                 })
 
             message['InvoiceRequest']['Invoice']['ReferenceInvoice'] = reference_invoices
             message['InvoiceRequest']['Invoice']['SpecialNotes'] = special_notes
 
-        response = self._send_request(path=INVOICE_ISSUE_PATH, data=message)
+        return self._issue_invoice(message, PRIORITY_SUBSEQUENT if subsequent_submit else PRIORITY_INTERACTIVE,
+                                   time_limit=time_limit)
 
-        return response['InvoiceResponse']['UniqueInvoiceID']
+    def _issue_invoice(self, message, priority, time_limit=None):
+        """
+        Send invoice request to FURS and notify listeners about the outcome.
+
+        :param message: (dict) InvoiceRequest message
+        :param priority: (string) Scheduler priority class
+        :param time_limit: (float) Seconds the caller can wait for FURS in total
+        :return: eor (string) - Invoice UniqueID from FURS
+        """
+        try:
+            response = self._send_request(path=INVOICE_ISSUE_PATH, data=message, priority=priority,
+                                          time_limit=time_limit)
+            eor = response['InvoiceResponse']['UniqueInvoiceID']
+        except Exception as e:
+            self._notify_listeners('invoice_failed', message, e)
+            raise
+
+        self._notify_listeners('invoice_issued', message, eor)
+
+        return eor
+
+    def _notify_listeners(self, event, *args):
+        # listeners run after FURS has answered - their errors must not hide the EOR from the caller
+        for listener in self.listeners:
+            try:
+                getattr(listener, event)(*args)
+            except Exception:
+                logger.exception("Invoice listener %r failed on %s", listener, event)
+
+    @staticmethod
+    def _format_reference_date(issued_date):
+        # missing date is reported by the validator instead of failing here
+        return issued_date.strftime("%Y-%m-%dT%H:%M:%SZ") if issued_date else None
+
+    @staticmethod
+    def _validate_reference_lists(reference_invoice_number,
+                                  reference_invoice_business_premise_id,
+                                  reference_invoice_electronic_device_id,
+                                  reference_invoice_issued_date):
+        """
+        Reference invoice parameters given as lists must all be lists of the same length.
+
+        :raises
+            ValidationException - lists are missing or their lengths do not match
+        """
+        expected = len(reference_invoice_number)
+        errors = []
+        for name, value in (('reference_invoice_business_premise_id', reference_invoice_business_premise_id),
+                            ('reference_invoice_electronic_device_id', reference_invoice_electronic_device_id),
+                            ('reference_invoice_issued_date', reference_invoice_issued_date)):
+            if not isinstance(value, list):
+                errors.append(SchemaError(path=name, message="expected list of %d items" % expected))
+            elif len(value) != expected:
+                errors.append(SchemaError(path=name, message="expected %d items, got %d" % (expected, len(value))))
+
+        if errors:
+            raise ValidationException(errors)
 
     @staticmethod
     def _prepare_invoice_request_header():
@@ -433,7 +603,8 @@ class FURSInvoiceAPI(FURSBaseAPI):
                                    reference_sales_book_set_number=None,
                                    reference_sales_book_serial_number=None,
                                    reference_sales_book_issued_date=None,
-                                   special_notes=''):
+                                   special_notes='',
+                                   time_limit=None):
         """
         Obtain EOR from FURS. Will build the request and call the FURS API.
 
@@ -454,6 +625,7 @@ class FURSInvoiceAPI(FURSBaseAPI):
         :param reference_invoice_electronic_device_id: (string) - Required if we're issuing Storno
         :param reference_invoice_issued_date: (datetime) - Required if we're issuing Storno
         :param special_notes:
+        :param time_limit: (float) - Seconds you can wait for FURS in total, timeouts are shortened to fit
         :return: eor (string) - Invoice UniqueID from FURS
         """
         # build the base message body
@@ -482,7 +654,7 @@ class FURSInvoiceAPI(FURSBaseAPI):
                     'ElectronicDeviceID': reference_invoice_electronic_device_id,
                     'InvoiceNumber': reference_invoice_number
                 },
-                'ReferenceInvoiceIssueDateTime': reference_invoice_issued_date.strftime("%Y-%m-%dT%H:%M:%SZ")
+                'ReferenceInvoiceIssueDateTime': FURSInvoiceAPI._format_reference_date(reference_invoice_issued_date)
             }]
             message['InvoiceRequest']['SalesBookInvoice']['ReferenceInvoice'] = reference_invoice
 
@@ -493,14 +665,13 @@ class FURSInvoiceAPI(FURSBaseAPI):
                     'SetNumber': reference_sales_book_set_number,
                     'SerialNumber': reference_sales_book_serial_number
                 },
-                'ReferenceSalesBookIssueDate': reference_sales_book_issued_date.isoformat()
+                'ReferenceSalesBookIssueDate': reference_sales_book_issued_date.isoformat() \
+                    if reference_sales_book_issued_date else None
             }]
             message['InvoiceRequest']['SalesBookInvoice']['ReferenceSalesBook'] = reference_sales_book
             message['InvoiceRequest']['SalesBookInvoice']['SpecialNotes'] = special_notes
 
-        response = self._send_request(path=INVOICE_ISSUE_PATH, data=message)
-
-        return response['InvoiceResponse']['UniqueInvoiceID']
+        return self._issue_invoice(message, PRIORITY_BULK, time_limit=time_limit)
 
 
     @staticmethod
@@ -0,0 +1,72 @@
+import hashlib
+
+from concurrent.futures import ProcessPoolExecutor
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.serialization.pkcs12 import load_pkcs12
+
+from furs_fiscal.api import FURSInvoiceAPI
+
+
+_worker_key = None
+
+
+def _init_worker(p12_buffer, p12_password):
+    global _worker_key
+    _worker_key = load_pkcs12(p12_buffer, password=bytes(p12_password, 'utf-8')).key
+
+
+def _verify_chunk(invoices):
+    results = []
+    for invoice in invoices:
+        content = FURSInvoiceAPI._zoi_content(invoice['tax_number'],
+                                              invoice['issued_date'],
+                                              invoice['invoice_number'],
+                                              invoice['business_premise_id'],
+                                              invoice['electronic_device_id'],
+                                              invoice['invoice_amount'])
+        signature = _worker_key.sign(data=bytes(content, 'utf-8'),
+                                     padding=padding.PKCS1v15(),
+                                     algorithm=hashes.SHA256())
+        results.append(hashlib.md5(signature).hexdigest() == invoice['zoi'].lower())
+
+    return results
+
+
+def _chunks(invoices, chunk_size):
+    chunk = []
+    for invoice in invoices:
+        chunk.append(invoice)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def verify_zois(invoices, p12_password, p12_path=None, p12_buffer=None, processes=None, chunk_size=500):
+    """
+    Verify a large set of ZOIs calculated in deterministic mode (FURSInvoiceAPI(deterministic_zoi=True)) against
+    the certificate they were issued with. Work is spread over multiple processes, each of them loads the
+    certificate once.
+
+    :param invoices: (iterable) dicts with keys zoi, tax_number, issued_date, invoice_number, business_premise_id,
+                                electronic_device_id and invoice_amount - same as FURSInvoiceAPI.verify_zoi arguments
+    :param p12_password: (string) Password for the .p12 file
+    :param p12_path: (string) Path to the .p12 file
+    :param p12_buffer: (bytes) Buffer of the .p12 file, used instead of p12_path
+    :param processes: (int) Number of worker processes. Default is number of CPUs
+    :param chunk_size: (int) How many invoices to send to a worker at once
+    :return: (generator) True/False for each invoice, in the same order as invoices
+    """
+    if p12_buffer is None:
+        with open(p12_path, 'rb') as p12_file:
+            p12_buffer = p12_file.read()
+
+    with ProcessPoolExecutor(max_workers=processes,
+                             initializer=_init_worker,
+                             initargs=(p12_buffer, p12_password)) as executor:
+        for results in executor.map(_verify_chunk, _chunks(invoices, chunk_size)):
+            for result in results:
+                yield result
@@ -1,4 +1,5 @@
 import json
+import time
 import jwt
 
 from cryptography.hazmat.primitives import hashes
@@ -7,50 +8,142 @@ from cryptography.hazmat.primitives.asymmetric import padding
 from requests.exceptions import Timeout
 from requests import codes
 
+from furs_fiscal import profiling, validation
 from furs_fiscal.connector import Connector
 from furs_fiscal.exceptions import ConnectionException, ConnectionTimedOutException, FURSException
+from furs_fiscal.scheduler import PRIORITY_INTERACTIVE
 
 
 class FURSBaseAPI(object):
-    def __init__(self, p12_path, p12_password, p12_buffer=None, production=True, request_timeout=2.0, proxy=None):
+    def __init__(self, p12_path, p12_password, p12_buffer=None, production=True, request_timeout=2.0, proxy=None,
+                 validate=True, pool_size=10, keep_alive=30, endpoint=None, rate_limiter=None,
+                 scheduler=None, transport=None, capture=None, certificate_source=None, reload_interval=60,
+                 expiry_warning=30, adaptive_timeout=None, shadow=None, profiler=None, health_monitor=None):
+        """
+        :param validate: (boolean) Validate requests against the FURS schema before they are signed and sent.
+                                   Default: True
+        :param pool_size: (int) How many connections to FURS server to keep open for reuse
+        :param keep_alive: (float) Seconds after the last request for which an open connection is considered warm
+        :param endpoint: (string) Override FURS server URL, e.g. to use a local simulator
+        :param rate_limiter: (RateLimiter) Limit requests per certificate and path. Default: None, not limited
+        :param scheduler: (PriorityScheduler) Share request slots between live invoices and background work.
+                                              Default: None, requests are sent as they come
+        :param transport: (Transport) Backend sending the requests, see furs_fiscal.transport. Default:
+                                      RequestsTransport
+        :param capture: (TrafficCapture) Record requests for replay with furs-fiscal-replay. Default: None
+        :param certificate_source: (CertificateSource) Load the certificate from this source instead of p12_path,
+                                                       p12_password and p12_buffer
+        :param reload_interval: (float) Seconds between checks for a rotated certificate. None disables reloading
+        :param expiry_warning: (int) Log a warning when the certificate expires in fewer days than this
+        :param adaptive_timeout: (AdaptiveTimeout) Derive timeouts from observed latency instead of using
+                                                   request_timeout for every request. Default: None
+        :param shadow: (ShadowMirror) Send a copy of every request to the FURS test server in the background and
+                                      compare the outcomes. Default: None
+        :param profiler: (SlowRequestProfiler) Sample stacks of requests in flight and keep profiles of slow ones.
+                                               Default: None
+        :param health_monitor: (HealthMonitor) Answer is_server_accessible from a shared, cached echo result.
+                                               Default: None, every call sends an echo request
+        """
         self.connector = Connector(p12_path=p12_path,
                                    p12_password=p12_password,
                                    p12_buffer=p12_buffer,
                                    production=production,
                                    request_timeout=request_timeout,
-                                   proxy=proxy)
+                                   proxy=proxy,
+                                   pool_size=pool_size,
+                                   keep_alive=keep_alive,
+                                   endpoint=endpoint,
+                                   rate_limiter=rate_limiter,
+                                   transport=transport,
+                                   capture=capture,
+                                   certificate_source=certificate_source,
+                                   reload_interval=reload_interval,
+                                   expiry_warning=expiry_warning,
+                                   profiler=profiler,
+                                   adaptive_timeout=adaptive_timeout)
+        self.validate = validate
+        self.scheduler = scheduler
+        self.adaptive_timeout = adaptive_timeout
+        self.shadow = shadow
+        self.profiler = profiler
+        self.health_monitor = health_monitor
+        if health_monitor is not None and health_monitor.connector is None:
+            health_monitor.connector = self.connector
 
     def is_server_accessible(self):
         """
         Check if FURS server is accessible. Will return False if server responds with anything else
         than HTTP Code: 200 or if the request timeouts.
 
+        With a health monitor the answer comes from its cache and any failure of the echo request counts as
+        not accessible.
+
         :return: (boolean) True for ok, False if there was a problem accessing server.
         """
+        if self.health_monitor is not None:
+            return self.health_monitor.is_accessible()
+
         try:
             return self.connector.send_echo().status_code == codes.ok
         except Timeout as e:
             return False
 
-    def _send_request(self, path, data):
+    def _send_request(self, path, data, priority=PRIORITY_INTERACTIVE, time_limit=None):
         """
         Sends request to the FURS Server and decodes response.
 
         :param path: (string) Server path
         :param data: (dict) Data to be sent
+        :param priority: (string) Scheduler priority class, one of furs_fiscal.scheduler PRIORITY_* constants
+        :param time_limit: (float) Seconds the caller can wait in total, including time waiting for the rate
+                                   limiter and the scheduler. Timeouts are shortened to fit. Default: None, no limit
         :return: (dict) Received response
 
         :raises:
+            ValidationException: If data does not conform to the FURS schema
             ConnectionTimedOutException: If connection timed out
             ConnectionException: If FURS responded with status code different than 200
             FURSException: If server responded with error
         """
+        with profiling.call(self.profiler, 'send_request'):
+            with profiling.phase(self.profiler, 'validate'):
+                if self.validate:
+                    validation.validate(data)
+
+            if self.shadow is None:
+                return self._exchange(path, data, priority, time_limit)
+
+            started = time.perf_counter()
+            try:
+                server_response = self._exchange(path, data, priority, time_limit)
+            except Exception as e:
+                self.shadow.mirror(path, data, e, time.perf_counter() - started)
+                raise
+
+            self.shadow.mirror(path, data, server_response, time.perf_counter() - started)
+            return server_response
+
+    def _exchange(self, path, data, priority, time_limit):
+        """
+        Send validated data and decode the response, see _send_request.
+        """
+        started = time.monotonic()
         try:
-            response = self.connector.post(path=path, json=data)
+            # the token is taken before the scheduler slot, a request waiting for the rate limit must not hold a
+            # slot other requests could use
+            self.connector.acquire_rate_limit(path, timeout=time_limit)
+
+            if self.scheduler is None:
+                response = self._post(path, data, started, time_limit)
+            else:
+                slot_timeout = started + time_limit - time.monotonic() if time_limit is not None else None
+                with self.scheduler.slot(priority, timeout=slot_timeout):
+                    response = self._post(path, data, started, time_limit)
 
             if response.status_code == codes.ok:
-                # TODO - we should verify server signature!
-                server_response = jwt.decode(response.json()['token'], options={"verify_signature": False})
+                with profiling.phase(self.profiler, 'decode'):
+                    # TODO - we should verify server signature!
+                    server_response = jwt.decode(response.json()['token'], options={"verify_signature": False})
                 return self._check_for_errors(server_response)
             else:
                 raise ConnectionException(code=response.status_code,
@@ -59,6 +152,24 @@ class FURSBaseAPI(object):
         except Timeout as e:
             raise ConnectionTimedOutException(e)
 
+    def _post(self, path, data, started, time_limit):
+        """
+        Post data with timeouts from adaptive_timeout and time_limit. Latency is recorded by the connector.
+        """
+        timeout = None
+        if self.adaptive_timeout is not None:
+            timeout = self.adaptive_timeout.timeouts(path, self.connector.request_timeout)
+
+        if time_limit is not None:
+            remaining = started + time_limit - time.monotonic()
+            if remaining <= 0:
+                raise Timeout("Time limit of %.2f s exceeded before the request was sent" % time_limit)
+            connect, read = timeout or (self.connector.request_timeout, self.connector.request_timeout)
+            timeout = (min(connect, remaining), min(read, remaining))
+
+        with profiling.phase(self.profiler, 'post'):
+            return self.connector.post(path=path, json=data, timeout=timeout, rate_limit=False)
+
     def _check_for_errors(self, server_response):
         """
         Check if server response contains FURS Error message and raise FURSException if it does
@@ -74,10 +185,23 @@ class FURSBaseAPI(object):
 
         return server_response
 
-    def _sign(self, content, algorithm=hashes.SHA256()):
-        return self.connector.p12.key.sign(data=bytes(content, 'utf-8'),
-                                           padding=padding.PSS(
-                                                mgf=padding.MGF1(hashes.SHA256()),
-                                                salt_length=padding.PSS.MAX_LENGTH
-                                            ),
-                                           algorithm=algorithm)
+    def _sign(self, content, algorithm=hashes.SHA256(), deterministic=False, key=None):
+        """
+        Sign content with the client private key.
+
+        :param content: (string) content to sign
+        :param algorithm: hash algorithm. Default: SHA256
+        :param deterministic: (boolean) Use PKCS#1 v1.5 padding, which always yields the same signature for the
+                                        same content, instead of PSS with a random salt. Default: False
+        :param key: private key to sign with. Default: key of the current certificate
+        :return: (bytes) signature
+        """
+        if deterministic:
+            signature_padding = padding.PKCS1v15()
+        else:
+            signature_padding = padding.PSS(mgf=padding.MGF1(hashes.SHA256()),
+                                            salt_length=padding.PSS.MAX_LENGTH)
+
+        if key is None:
+            key = self.connector.p12.key
+        return key.sign(data=bytes(content, 'utf-8'), padding=signature_padding, algorithm=algorithm)
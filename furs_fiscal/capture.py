@@ -0,0 +1,123 @@
+import hashlib
+import hmac
+import json
+import os
+import threading
+
+from furs_fiscal import forksafe
+
+
+# ZOI written instead of the real one, replay calculates it again with its own certificate
+REDACTED_ZOI = '0' * 32
+
+
+class TrafficCapture(object):
+    """
+    TrafficCapture records requests sent to FURS, so a day of traffic can later be replayed with furs-fiscal-replay.
+
+    Every request is written as one JSON line with its arrival time, path, unsigned payload and the response status
+    and time. The signed token is never written - it carries the certificate signature and is rebuilt on replay.
+
+    With redact (the default) personal data and signatures are removed from invoices before they are written:
+    OperatorTaxNumber and CustomerVATNumber are replaced by pseudonyms and ProtectedID (ZOI) by REDACTED_ZOI.
+    Pseudonyms are keyed hashes, so the same operator or customer gets the same pseudonym throughout a capture and
+    the traffic keeps its shape, but the real numbers can not be recovered without the key. Amounts, dates,
+    premise, device and invoice numbers and the issuer tax number are kept.
+
+    Usage:
+        capture = TrafficCapture('traffic.jsonl')
+        api = FURSInvoiceAPI(p12_path, p12_password, capture=capture)
+    """
+    def __init__(self, path, redact=True, key=None):
+        """
+        :param path: (string) File the requests are appended to
+        :param redact: (boolean) Pseudonymise operator and customer tax numbers and remove ZOI
+        :param key: (bytes) Key for the pseudonyms, the same key gives the same pseudonyms in different captures.
+                            Default: None, random key for this capture
+        """
+        self.path = path
+        self.redact = redact
+        self._key = key if key is not None else os.urandom(32)
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+        forksafe.register(self)
+
+    def record(self, path, payload, started, elapsed, status=None, error=None):
+        """
+        Record a single request.
+
+        :param path: (string) Endpoint path
+        :param payload: (dict) Request payload before signing
+        :param started: (float) time.time() when the request was made
+        :param elapsed: (float) Seconds until the response arrived
+        :param status: (int) HTTP status code of the response, None if there was no response
+        :param error: (Exception) Exception raised instead of a response
+        """
+        if self.redact:
+            payload = self._redact(payload)
+
+        record = {
+            'time': started,
+            'path': path,
+            'payload': payload,
+            'status': status,
+            'elapsed': elapsed,
+        }
+        if error is not None:
+            record['error'] = type(error).__name__
+
+        # Decimal amounts are written as strings
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line)
+                self._file.flush()
+
+    def _redact(self, payload):
+        """
+        :return: (dict) payload with pseudonymised tax numbers and without ZOI, payload itself is not changed
+        """
+        request = payload.get('InvoiceRequest')
+        if request is None:
+            return payload
+
+        kind = 'Invoice' if 'Invoice' in request else 'SalesBookInvoice'
+        # copies only down to the invoice, the rest of the payload is shared
+        invoice = dict(request[kind])
+        payload = dict(payload, InvoiceRequest=dict(request, **{kind: invoice}))
+
+        if 'ProtectedID' in invoice:
+            invoice['ProtectedID'] = REDACTED_ZOI
+        if 'OperatorTaxNumber' in invoice:
+            # a valid tax number, so replayed requests pass validation
+            invoice['OperatorTaxNumber'] = 10000000 + self._pseudonym(invoice['OperatorTaxNumber']) % 90000000
+        if 'CustomerVATNumber' in invoice:
+            invoice['CustomerVATNumber'] = 'X%015d' % (self._pseudonym(invoice['CustomerVATNumber']) % 10 ** 15)
+        return payload
+
+    def _pseudonym(self, value):
+        return int(hmac.new(self._key, str(value).encode('utf-8'), hashlib.sha256).hexdigest(), 16)
+
+    def _after_fork(self):
+        # lines are appended with O_APPEND, so processes sharing the file do not overwrite each other
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def load_capture(path):
+    """
+    Read requests recorded by TrafficCapture.
+
+    :param path: (string) Capture file
+    :return: (list) records (dicts with time, path, payload, status, elapsed) ordered by time
+    """
+    with open(path) as capture:
+        records = [json.loads(line) for line in capture if line.strip()]
+
+    return sorted(records, key=lambda record: record['time'])
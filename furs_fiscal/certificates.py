@@ -0,0 +1,209 @@
+import datetime
+import hashlib
+import os
+import tempfile
+import threading
+import weakref
+
+from OpenSSL import crypto
+from OpenSSL.crypto import X509
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.serialization.pkcs12 import load_pkcs12
+
+
+class CertificateSource(object):
+    """
+    Base class for places a .p12 certificate is loaded from. Connector asks the source whether it has changed
+    and loads it again, so a rotated certificate is picked up without recreating the API objects.
+    """
+    def __init__(self, p12_password):
+        """
+        :param p12_password: (string) Password for the .p12 file
+        """
+        self.p12_password = p12_password
+
+    def load(self):
+        """
+        :return: PKCS12KeyAndCertificates loaded from the source
+        """
+        raise NotImplementedError()
+
+    def changed(self):
+        """
+        :return: (boolean) True if the source holds a different certificate than the last one loaded
+        """
+        return False
+
+    def _parse(self, p12_buffer):
+        return load_pkcs12(p12_buffer, password=bytes(self.p12_password, 'utf-8'))
+
+
+class FileCertificateSource(CertificateSource):
+    """
+    Certificate in a .p12 file. The file is considered changed when its size, modification time or inode change,
+    so it should be replaced atomically, e.g. written to a temporary file and renamed.
+    """
+    def __init__(self, p12_path, p12_password):
+        """
+        :param p12_path: (string) Path to the .p12 file
+        :param p12_password: (string) Password for the .p12 file
+        """
+        CertificateSource.__init__(self, p12_password)
+        self.p12_path = p12_path
+        self._loaded_stat = None
+
+    def load(self):
+        stat = FileCertificateSource._stat(self.p12_path)
+        with open(self.p12_path, 'rb') as p12_file:
+            p12 = self._parse(p12_file.read())
+        self._loaded_stat = stat
+        return p12
+
+    def changed(self):
+        try:
+            return FileCertificateSource._stat(self.p12_path) != self._loaded_stat
+        except FileNotFoundError:
+            # file is being replaced, check again later
+            return False
+
+    @staticmethod
+    def _stat(path):
+        stat = os.stat(path)
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class BufferCertificateSource(CertificateSource):
+    """
+    Certificate held in memory, e.g. read from a database or a secret store. Pass a callable as p12_buffer to have
+    it called on every check for a new certificate.
+    """
+    def __init__(self, p12_buffer, p12_password):
+        """
+        :param p12_buffer: (bytes) Buffer of the .p12 file, or a callable returning it
+        :param p12_password: (string) Password for the .p12 file
+        """
+        CertificateSource.__init__(self, p12_password)
+        self.p12_buffer = p12_buffer
+        self._loaded_digest = None
+        self._fetched = None
+
+    def load(self):
+        p12_buffer = self._fetched if self._fetched is not None else self._fetch()
+        self._fetched = None
+        p12 = self._parse(p12_buffer)
+        self._loaded_digest = hashlib.sha256(p12_buffer).digest()
+        return p12
+
+    def changed(self):
+        if not callable(self.p12_buffer):
+            return False
+
+        p12_buffer = self._fetch()
+        if hashlib.sha256(p12_buffer).digest() == self._loaded_digest:
+            return False
+
+        # keep it for load, so the provider is not called twice
+        self._fetched = p12_buffer
+        return True
+
+    def _fetch(self):
+        return self.p12_buffer() if callable(self.p12_buffer) else self.p12_buffer
+
+
+class CertificateBundle(object):
+    """
+    Key, certificate and PEM files of one loaded certificate.
+
+    Requests hold a reference to the bundle while they use it. When a new certificate is loaded the old bundle is
+    released by its connector and its PEM files are removed once the last request using it has finished.
+
+    PEM files belong to the process which wrote them and are only removed by it, when it releases the bundle or
+    exits. Forked children write their own bundle from the same key and certificate, see Connector._after_fork.
+    """
+    def __init__(self, p12, on_close=None):
+        """
+        :param p12: PKCS12KeyAndCertificates
+        :param on_close: (callable) Called with (cert_path, key_path) after the bundle is no longer used
+        """
+        self.p12 = p12
+        self.key = p12.key
+        self.certificate = p12.cert.certificate
+        self.serial = str(self.certificate.serial_number)
+        self.jws_header = {
+            'alg': 'RS256',
+            'subject_name': self.certificate.subject.rfc4514_string(),
+            'issuer_name': self.certificate.issuer.rfc4514_string(),
+            'serial': self.certificate.serial_number
+        }
+
+        self._on_close = on_close
+        self._lock = threading.Lock()
+        # the connector holding the bundle owns the first reference
+        self._references = 1
+
+        # requests library requires string path to PKey and Cert - therefore we save those into
+        # temporary files on the file system
+        self.cert_path = CertificateBundle._write_temp_file(
+            crypto.dump_certificate(crypto.FILETYPE_PEM, X509.from_cryptography(self.certificate)))
+        self.key_path = CertificateBundle._write_temp_file(
+            self.key.private_bytes(encoding=serialization.Encoding.PEM,
+                                   format=serialization.PrivateFormat.TraditionalOpenSSL,
+                                   encryption_algorithm=serialization.NoEncryption()))
+        # removes the files on release, or at exit if the bundle was never released
+        self._finalizer = weakref.finalize(self, _remove_files, self.cert, os.getpid())
+
+    @property
+    def cert(self):
+        """
+        :return: (tuple) Paths to the certificate and private key PEM files
+        """
+        return self.cert_path, self.key_path
+
+    @property
+    def not_valid_after(self):
+        """
+        :return: (datetime) Certificate expiry time in UTC
+        """
+        if hasattr(self.certificate, 'not_valid_after_utc'):
+            return self.certificate.not_valid_after_utc
+        # cryptography < 42
+        return self.certificate.not_valid_after.replace(tzinfo=datetime.timezone.utc)
+
+    def expires_in(self, now=None):
+        """
+        :return: (timedelta) Time until the certificate expires, negative if it already has
+        """
+        return self.not_valid_after - (now or datetime.datetime.now(datetime.timezone.utc))
+
+    def acquire(self):
+        with self._lock:
+            self._references += 1
+
+    def release(self):
+        with self._lock:
+            self._references -= 1
+            if self._references > 0:
+                return
+
+        self._finalizer()
+
+        if self._on_close is not None:
+            self._on_close(self.cert)
+
+    @staticmethod
+    def _write_temp_file(content):
+        temp_file = tempfile.NamedTemporaryFile(delete=False)
+        with temp_file:
+            temp_file.write(content)
+        return temp_file.name
+
+
+def _remove_files(paths, owner_pid):
+    if os.getpid() != owner_pid:
+        return
+
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
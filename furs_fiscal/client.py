@@ -0,0 +1,173 @@
+import http.client
+import inspect
+import select
+import socket
+import threading
+import time
+
+from furs_fiscal import protocol
+from furs_fiscal.api import FURSBusinessPremiseAPI, FURSInvoiceAPI
+
+
+# safe to send twice, retried once when the daemon closed the connection under the request
+IDEMPOTENT_METHODS = frozenset(('calculate_zoi', 'prepare_printable', 'is_server_accessible'))
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout):
+        http.client.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class FURSDaemonClient(object):
+    """
+    Thin client for the fiscalization daemon (see furs_fiscal.daemon). It has the same methods and raises the same
+    exceptions as FURSInvoiceAPI and FURSBusinessPremiseAPI, but the work is done by the daemon.
+
+    Each thread keeps its own connection to the daemon open. A connection idle for longer than idle_timeout, or
+    already closed by the daemon, is replaced before a request is sent. Invoice and premise requests are never sent
+    twice: if the connection breaks while one is in flight, the socket error is raised, since the daemon may have
+    reported the invoice to FURS already - send it again with subsequent_submit=True.
+    """
+    def __init__(self, socket_path=None, host='127.0.0.1', port=8089, timeout=10.0, idle_timeout=4.0):
+        """
+        :param socket_path: (string) Unix socket of the daemon. If not set, host and port are used
+        :param host: (string) Daemon address
+        :param port: (int) Daemon port
+        :param timeout: (float) How long to wait for the daemon. Should be longer than the daemon FURS timeout
+        :param idle_timeout: (float) Reconnect instead of reusing a connection idle for this many seconds. Should be
+                                     shorter than the 5 seconds after which the daemon closes idle connections
+        """
+        self.socket_path = socket_path
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and (time.monotonic() - self._local.used > self.idle_timeout or
+                                       FURSDaemonClient._closed_by_peer(connection)):
+            self._drop_connection()
+            connection = None
+
+        if connection is None:
+            if self.socket_path:
+                connection = _UnixHTTPConnection(self.socket_path, self.timeout)
+            else:
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.connection = connection
+            self._local.used = time.monotonic()
+        return connection
+
+    @staticmethod
+    def _closed_by_peer(connection):
+        # an idle connection has nothing to read, unless the daemon closed it
+        return connection.sock is not None and bool(select.select([connection.sock], [], [], 0)[0])
+
+    def _drop_connection(self):
+        self._local.connection.close()
+        self._local.connection = None
+
+    def _request(self, http_method, path, body=None, retry=True):
+        """
+        :param retry: (boolean) Send the request again on a new connection if the daemon closed the connection
+                                under it. Only for requests which are safe to repeat
+        :return: decoded result
+
+        :raises
+            ConnectionError - connection to the daemon broke and the request was not repeated
+        """
+        headers = {'Content-Type': 'application/json; charset=UTF-8'} if body is not None else {}
+
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request(http_method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                content = response.read()
+                break
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self._drop_connection()
+                if attempt or not retry:
+                    raise
+            except Exception:
+                # e.g. a timeout, the response could still arrive on this connection
+                self._drop_connection()
+                raise
+
+        self._local.used = time.monotonic()
+        if response.getheader('Connection', '').lower() == 'close':
+            self._drop_connection()
+
+        data = protocol.loads(content)
+        if 'error' in data:
+            raise protocol.decode_error(data['error'])
+
+        return data['result']
+
+    def _call(self, method, **kwargs):
+        return self._request('POST', '/' + method, body=protocol.dumps(kwargs), retry=method in IDEMPOTENT_METHODS)
+
+    def _call_api(self, function, args, kwargs):
+        """
+        Call the daemon method named after an API function, with arguments checked against its signature.
+        """
+        arguments = inspect.signature(function).bind(None, *args, **kwargs).arguments
+        arguments.pop('self')
+        return self._call(function.__name__, **arguments)
+
+    def stats(self):
+        """
+        :return: (dict) daemon counters - in-flight requests, calls per method and connector stats
+        """
+        return self._request('GET', '/stats')
+
+    def health(self):
+        """
+        :return: (dict) FURS server health cached by the daemon, see HealthMonitor.status
+        """
+        return self._request('GET', '/health')
+
+    def calculate_zoi(self, tax_number, issued_date, invoice_number, business_premise_id, electronic_device_id,
+                      invoice_amount):
+        return self._call('calculate_zoi', tax_number=tax_number, issued_date=issued_date,
+                          invoice_number=invoice_number, business_premise_id=business_premise_id,
+                          electronic_device_id=electronic_device_id, invoice_amount=invoice_amount)
+
+    def prepare_printable(self, tax_number, zoi, issued_date, timezone='Europe/Ljubljana'):
+        return self._call('prepare_printable', tax_number=tax_number, zoi=zoi, issued_date=issued_date,
+                          timezone=timezone)
+
+    def get_invoice_eor(self, *args, **kwargs):
+        """
+        See FURSInvoiceAPI.get_invoice_eor, takes the same arguments
+        """
+        return self._call_api(FURSInvoiceAPI.get_invoice_eor, args, kwargs)
+
+    def get_sales_book_invoice_eor(self, *args, **kwargs):
+        """
+        See FURSInvoiceAPI.get_sales_book_invoice_eor, takes the same arguments
+        """
+        return self._call_api(FURSInvoiceAPI.get_sales_book_invoice_eor, args, kwargs)
+
+    def register_immovable_business_premise(self, *args, **kwargs):
+        """
+        See FURSBusinessPremiseAPI.register_immovable_business_premise, takes the same arguments
+        """
+        return self._call_api(FURSBusinessPremiseAPI.register_immovable_business_premise, args, kwargs)
+
+    def register_movable_business_premise(self, *args, **kwargs):
+        """
+        See FURSBusinessPremiseAPI.register_movable_business_premise, takes the same arguments
+        """
+        return self._call_api(FURSBusinessPremiseAPI.register_movable_business_premise, args, kwargs)
+
+    def is_server_accessible(self):
+        return self._call('is_server_accessible')
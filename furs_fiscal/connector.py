@@ -1,11 +1,16 @@
-import tempfile
+import datetime
+import logging
+import threading
+import time
+import weakref
 import requests
 import jwt
 
-from OpenSSL import crypto
-from OpenSSL.crypto import X509
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.serialization.pkcs12 import load_pkcs12
+from requests.exceptions import Timeout
+
+from furs_fiscal import forksafe, profiling
+from furs_fiscal.certificates import BufferCertificateSource, CertificateBundle, FileCertificateSource
+from furs_fiscal.transport import RequestsTransport
 
 
 requests.packages.urllib3.disable_warnings()
@@ -13,6 +18,8 @@ requests.packages.urllib3.disable_warnings()
 FURS_TEST_ENDPOINT = 'https://blagajne-test.fu.gov.si:9002'
 FURS_PRODUCTION_ENDPOINT = 'https://blagajne.fu.gov.si:9003'
 
+logger = logging.getLogger(__name__)
+
 # TODO - we should add all the certificates to trusted CA's to make this work.
 # TODO - for now we'll just keep it to verify=False...
 # FURS_TEST_CERT = os.path.join(os.path.dirname(__file__), 'certs/test-tls.cer')
@@ -24,7 +31,10 @@ class Connector(object):
     Connector performs all the communication with the FURS server.
 
     """
-    def __init__(self, p12_path, p12_password, p12_buffer=None, production=True, request_timeout=2, proxy=None):
+    def __init__(self, p12_path, p12_password, p12_buffer=None, production=True, request_timeout=2, proxy=None,
+                 pool_size=10, keep_alive=30, endpoint=None, rate_limiter=None, transport=None,
+                 capture=None, certificate_source=None, reload_interval=60, expiry_warning=30, profiler=None,
+                 adaptive_timeout=None):
         """
         Initializes and loads certs to memory.
 
@@ -34,53 +44,177 @@ class Connector(object):
         :param production: (boolean) Should we use FURS Production server of Test server
         :param request_timeout: (float) How long should we wait for the request to timeout
         :param proxy: (dict) Specify proxy details if you need one, for example: {"http": "http://localhost:3128", "https": "http://localhost:3128"}
+        :param pool_size: (int) How many connections to FURS server to keep open for reuse
+        :param keep_alive: (float) Seconds after the last request for which an open connection is considered warm
+        :param endpoint: (string) Override FURS server URL, e.g. to use a local simulator
+        :param rate_limiter: (RateLimiter) Limit requests per certificate and path. Default: None, not limited
+        :param transport: (Transport) Backend sending the requests, see furs_fiscal.transport. Default:
+                                      RequestsTransport with pool_size and proxy
+        :param capture: (TrafficCapture) Record every request sent with post. Default: None, nothing is recorded
+        :param certificate_source: (CertificateSource) Where to load the certificate from, used instead of p12_path,
+                                                       p12_password and p12_buffer
+        :param reload_interval: (float) Seconds between checks for a rotated certificate, done by a background
+                                        thread. None disables reloading
+        :param expiry_warning: (int) Log a warning when the certificate expires in fewer days than this
+        :param profiler: (SlowRequestProfiler) Time phases of post for profiles of slow requests. Default: None
+        :param adaptive_timeout: (AdaptiveTimeout) Record latency of every request sent with post. Default: None
         :return: None
         """
         self.p12_path = p12_path
         self.p12_buffer = p12_buffer
-        self.endpoint = FURS_PRODUCTION_ENDPOINT if production else FURS_TEST_ENDPOINT
+        if endpoint:
+            self.endpoint = endpoint.rstrip('/')
+        else:
+            self.endpoint = FURS_PRODUCTION_ENDPOINT if production else FURS_TEST_ENDPOINT
         # self.cert = FURS_PRODUCTION_CERT if production else FURS_TEST_CERT
 
-        self.p12 = None
-        self.cert_temp = None
-        self.pkey_temp = None
-
         self.request_timeout = request_timeout
 
         self.proxy = proxy
+        self.rate_limiter = rate_limiter
+        self.capture = capture
+        self.profiler = profiler
+        self.adaptive_timeout = adaptive_timeout
+
+        self.transport = transport if transport is not None else RequestsTransport(pool_size=pool_size, proxy=proxy)
+        self.keep_alive = keep_alive
+
+        self._last_activity = None
+        self._stats_lock = threading.Lock()
+        self.stats = {'cold_requests': 0, 'warm_requests': 0, 'echo_requests': 0}
+
+        if certificate_source is None:
+            if p12_buffer is not None:
+                certificate_source = BufferCertificateSource(p12_buffer, p12_password)
+            else:
+                certificate_source = FileCertificateSource(p12_path, p12_password)
+        self.certificate_source = certificate_source
+        self.reload_interval = reload_interval
+        self.expiry_warning = datetime.timedelta(days=expiry_warning)
+
+        self._certificate_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._expiry_warned = None
+        self._certificate = None
+        self._stop_watching = threading.Event()
+        self._watcher = None
 
-        # self.furs_cert = open(self.cert, 'rt').read()
         # load certificate...
-        self._load_p12(p12_password)
+        self.reload_certificate()
+        if reload_interval is not None:
+            self._start_watcher()
 
-    def _load_p12(self, p12_password):
+        forksafe.register(self)
+
+    @property
+    def certificate(self):
+        """
+        :return: (CertificateBundle) Certificate currently used for new requests
         """
-        Load .p12 cert to memory
+        return self._certificate
 
-        :param p12_password: (string) password for the .p12 file
-        :return: None
+    @property
+    def p12(self):
+        return self._certificate.p12
+
+    def reload_certificate(self):
         """
-        if self.p12_buffer is None:
-            self.p12_buffer = open(self.p12_path, 'rb').read()
-        self.p12 = load_pkcs12(self.p12_buffer, password=bytes(p12_password, 'utf-8'))
-        self._store_temp_files()
+        Load the certificate from the certificate source and use it for new requests. Requests already in progress
+        finish with the previous certificate, whose PEM files are removed afterwards.
 
-    def _store_temp_files(self):
+        :return: (CertificateBundle) the new certificate
         """
-        Requests library requires string path to PKey and Cert - therefore we save those into
-        temporary files on the file system.
+        certificate = CertificateBundle(self.certificate_source.load(), on_close=self.transport.discard_certificate)
 
-        :return: None
+        with self._certificate_lock:
+            previous, self._certificate = self._certificate, certificate
+        if previous is not None:
+            previous.release()
+            logger.info("Reloaded certificate, serial %s replaced by %s", previous.serial, certificate.serial)
+
+        self._warn_expiry(certificate)
+
+        return certificate
+
+    def close(self):
         """
-        self.cert_temp = tempfile.NamedTemporaryFile(delete=False)
-        self.cert_temp.write(crypto.dump_certificate(crypto.FILETYPE_PEM, X509.from_cryptography(self.p12.cert.certificate)))
-        self.cert_temp.flush()
+        Stop checking for a rotated certificate, close connections and remove PEM files of the certificate.
+        """
+        self._stop_watching.set()
+        with self._certificate_lock:
+            certificate, self._certificate = self._certificate, None
+        if certificate is not None:
+            certificate.release()
+        self.transport.close()
+
+    def _after_fork(self):
+        """
+        Reset state shared with the parent process. The loaded certificate is reused, but written to PEM files of
+        this process - the parent removes its own files when it loads a rotated certificate.
+        """
+        self._stats_lock = threading.Lock()
+        self._certificate_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self.stats = dict((kind, 0) for kind in self.stats)
+        self._last_activity = None
+        # the watcher thread does not exist in the child, it is started again by the first request
+        self._stop_watching = threading.Event()
+        self._watcher = None
+
+        self.transport.reset()
+        if self._certificate is not None:
+            # the parent's bundle is dropped without releasing it, its files are only ever removed by the parent
+            self._certificate = CertificateBundle(self._certificate.p12, on_close=self.transport.discard_certificate)
+
+    def _acquire_certificate(self):
+        """
+        Take a reference to the current certificate. The reference must be released when the request is done.
+        Rotated certificates are loaded by the watcher thread, requests never wait for it.
+
+        :return: (CertificateBundle)
+        """
+        if self._watcher is None and self.reload_interval is not None:
+            self._start_watcher()
+
+        with self._certificate_lock:
+            certificate = self._certificate
+            certificate.acquire()
+        return certificate
+
+    def _start_watcher(self):
+        with self._reload_lock:
+            if self._watcher is not None:
+                return
+            # the thread only holds a weak reference, so an API object which is not closed can still be collected
+            self._watcher = threading.Thread(target=_watch_certificate,
+                                             args=(weakref.ref(self), self._stop_watching, self.reload_interval),
+                                             name='furs-certificate-watcher', daemon=True)
+            self._watcher.start()
 
-        self.pkey_temp = tempfile.NamedTemporaryFile(delete=False)
-        self.pkey_temp.write(self.p12.key.private_bytes(encoding=serialization.Encoding.PEM,
-                                                        format=serialization.PrivateFormat.TraditionalOpenSSL,
-                                                        encryption_algorithm=serialization.NoEncryption()))
-        self.pkey_temp.flush()
+    def _check_certificate(self):
+        with self._reload_lock:
+            try:
+                if self.certificate_source.changed():
+                    self.reload_certificate()
+                else:
+                    self._warn_expiry(self._certificate)
+            except Exception:
+                logger.exception("Reloading certificate failed, using the previous one")
+
+    def _warn_expiry(self, certificate):
+        # at most once a day per certificate
+        today = datetime.date.today()
+        if self._expiry_warned == (certificate.serial, today):
+            return
+
+        expires_in = certificate.expires_in()
+        if expires_in < self.expiry_warning:
+            self._expiry_warned = (certificate.serial, today)
+            if expires_in.total_seconds() < 0:
+                logger.warning("Certificate %s expired on %s", certificate.serial, certificate.not_valid_after)
+            else:
+                logger.warning("Certificate %s expires on %s, in %d days", certificate.serial,
+                               certificate.not_valid_after, expires_in.days)
 
     def _get_jws_header(self):
         """
@@ -88,50 +222,97 @@ class Connector(object):
 
         :return: (dict) JWS header
         """
-        jws_header = {
-            'alg': 'RS256',
-            'subject_name': self.p12.cert.certificate.subject.rfc4514_string(),
-            'issuer_name': self.p12.cert.certificate.issuer.rfc4514_string(),
-            'serial': self.p12.cert.certificate.serial_number
-        }
-
-        return jws_header
+        return dict(self._certificate.jws_header)
 
-    def _jwt_sign(self, header, payload, algorithm='RS256'):
+    def _jwt_sign(self, header, payload, algorithm='RS256', key=None):
         """
         Perform JWT signature of the header and payload.
 
         :param header: (dict) JWS header dictionary
         :param payload: (dict) content to sign
         :param algorithm: (string) which algorithm to use. Default: 'RS256'
+        :param key: private key to sign with. Default: key of the current certificate
         :return: (string) Signed base64 encoded content
         """
         return jwt.encode(payload,
-                          key=self.p12.key,
+                          key=key if key is not None else self._certificate.key,
                           headers=header,
                           algorithm=algorithm)
 
-    def post(self, path, json):
+    def acquire_rate_limit(self, path, timeout=None):
+        """
+        Wait for a rate limiter token for path and the current certificate. Does nothing without a rate limiter.
+
+        :param path: (string) path to the endpoint e.g 'v1/cash_registers/invoices'
+        :param timeout: (float) How long to wait, never longer than max_wait of the rate limiter. Default: max_wait
+
+        :raises
+            RateLimitTimeoutException - rate limit did not allow the request within the allowed wait time
+        """
+        if self.rate_limiter is not None:
+            if timeout is not None:
+                timeout = min(timeout, self.rate_limiter.max_wait)
+            with profiling.phase(self.profiler, 'rate_limit'):
+                self.rate_limiter.acquire(key=self._certificate.serial, path=path, timeout=timeout)
+
+    def post(self, path, json, timeout=None, rate_limit=True):
         """
         Perform POST request to the FURS server for a given path endpoint. This wrapper will
         prepare JWS header and sign the message according to the JWT specification.
 
         :param path: (string) path to the endpoint e.g 'v1/cash_registers/invoices'
         :param json: (dict) data to send
+        :param timeout: (float or tuple) timeout, or connect and read timeouts. Default: request_timeout
+        :param rate_limit: (boolean) Wait for a rate limiter token. False when the caller already took one with
+                                     acquire_rate_limit
         :return: response object
+
+        :raises
+            RateLimitTimeoutException - rate limit did not allow the request within the allowed wait time
         """
-        data = {
-            'token': self._jwt_sign(header=self._get_jws_header(),
-                                    payload=json)
-        }
+        started = time.time()
+        with profiling.phase(self.profiler, 'certificate'):
+            certificate = self._acquire_certificate()
+        try:
+            if rate_limit and self.rate_limiter is not None:
+                with profiling.phase(self.profiler, 'rate_limit'):
+                    self.rate_limiter.acquire(key=certificate.serial, path=path)
 
-        return requests.post(url='%s/%s' % (self.endpoint, path),
-                             json=data,
-                             cert=(self.cert_temp.name, self.pkey_temp.name),
-                             verify=False,
-                             headers=self._prepare_headers(),
-                             timeout=self.request_timeout,
-                             proxies=self.proxy)
+            with profiling.phase(self.profiler, 'sign'):
+                data = {
+                    'token': self._jwt_sign(header=certificate.jws_header,
+                                            payload=json,
+                                            key=certificate.key)
+                }
+
+            self._count_request('warm_requests' if self.is_warm() else 'cold_requests')
+
+            sent = time.perf_counter()
+            try:
+                with profiling.phase(self.profiler, 'transport'):
+                    response = self.transport.post(url='%s/%s' % (self.endpoint, path),
+                                                   json=data,
+                                                   headers=self._prepare_headers(),
+                                                   timeout=timeout if timeout is not None else self.request_timeout,
+                                                   cert=certificate.cert)
+            except Exception as e:
+                elapsed = time.perf_counter() - sent
+                if self.adaptive_timeout is not None and isinstance(e, Timeout):
+                    self.adaptive_timeout.record(path, elapsed, timed_out=True)
+                if self.capture is not None:
+                    self.capture.record(path, json, started, elapsed, error=e)
+                raise
+        finally:
+            certificate.release()
+        elapsed = time.perf_counter() - sent
+        self._last_activity = time.monotonic()
+
+        if self.adaptive_timeout is not None:
+            self.adaptive_timeout.record(path, elapsed)
+        if self.capture is not None:
+            self.capture.record(path, json, started, elapsed, status=response.status_code)
+
+        return response
 
     def send_echo(self, message='ping'):
         """
@@ -146,13 +327,33 @@ class Connector(object):
             'EchoRequest': message,
         }
 
-        return requests.post(url='%s/%s' % (self.endpoint, 'v1/cash_registers/echo'),
-                             json=data,
-                             cert=(self.cert_temp.name, self.pkey_temp.name),
-                             verify=False,
-                             headers=self._prepare_headers(),
-                             timeout=self.request_timeout,
-                             proxies=self.proxy)
+        self._count_request('echo_requests')
+
+        certificate = self._acquire_certificate()
+        try:
+            response = self.transport.post(url='%s/%s' % (self.endpoint, 'v1/cash_registers/echo'),
+                                           json=data,
+                                           headers=self._prepare_headers(),
+                                           timeout=self.request_timeout,
+                                           cert=certificate.cert)
+        finally:
+            certificate.release()
+        self._last_activity = time.monotonic()
+
+        return response
+
+    def is_warm(self):
+        """
+        Connection is considered warm if there was a request to the FURS server within the keep alive period,
+        so that an open connection and TLS session can be reused.
+
+        :return: (boolean) True if connection is warm
+        """
+        return self._last_activity is not None and time.monotonic() - self._last_activity < self.keep_alive
+
+    def _count_request(self, kind):
+        with self._stats_lock:
+            self.stats[kind] += 1
 
     def _prepare_headers(self):
         """
@@ -161,3 +362,12 @@ class Connector(object):
         :return: (dict) request header
         """
         return {'Content-Type': 'application/json; charset=UTF-8'}
+
+
+def _watch_certificate(connector_ref, stop, interval):
+    while not stop.wait(interval):
+        connector = connector_ref()
+        if connector is None:
+            return
+        connector._check_certificate()
+        del connector
@@ -0,0 +1,259 @@
+"""
+Fiscalization daemon - a long running process that loads the certificate once and serves ZOI, EOR and business
+premise calls to many local POS processes over a Unix socket or HTTP. All clients share one connection pool and
+one signing key. Use furs_fiscal.client.FURSDaemonClient to talk to it.
+
+Start it with the console script:
+
+    FURS_P12_PASSWORD=secret furs-fiscal-daemon --p12 my_cert.p12 --socket /run/furs-fiscal.sock
+"""
+import argparse
+import inspect
+import os
+import signal
+import socket
+import sys
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+
+from furs_fiscal import protocol
+from furs_fiscal.api import FURSInvoiceAPI, FURSBusinessPremiseAPI
+from furs_fiscal.exceptions import ConnectionException, ConnectionTimedOutException, FURSException, \
+    ValidationException
+from furs_fiscal.health import HealthMonitor
+from furs_fiscal.scheduler import PriorityScheduler
+from furs_fiscal.timeouts import AdaptiveTimeout
+
+
+# methods of FiscalAPI that clients may call
+METHODS = frozenset([
+    'calculate_zoi',
+    'prepare_printable',
+    'get_invoice_eor',
+    'get_sales_book_invoice_eor',
+    'register_immovable_business_premise',
+    'register_movable_business_premise',
+    'is_server_accessible',
+])
+
+# exception -> HTTP status code
+ERROR_STATUS = (
+    (ValidationException, 400),
+    (FURSException, 422),
+    (ConnectionException, 502),
+    (ConnectionTimedOutException, 504),
+)
+
+
+class FiscalAPI(FURSInvoiceAPI, FURSBusinessPremiseAPI):
+    """
+    Invoice and business premise API on a single connector. FURSInvoiceAPI comes first in the MRO, so
+    invoice methods keep using its message builders; premise methods call their own builders explicitly.
+    """
+    pass
+
+
+class _DaemonRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # idle keep-alive connections are closed after this many seconds, so shutdown does not wait for them
+    timeout = 5
+
+    def do_GET(self):
+        path = self.path.strip('/')
+        if path == 'stats':
+            self._respond(200, {'result': self.server.get_stats()})
+        elif path == 'health' and self.server.api.health_monitor is not None:
+            # 503 when FURS is not accessible, so load balancers and monitoring can use the status code alone
+            accessible = self.server.api.health_monitor.is_accessible()
+            self._respond(200 if accessible else 503, {'result': self.server.api.health_monitor.status()})
+        else:
+            self._respond(404, {'error': {'type': 'NotFound', 'message': self.path}})
+
+    def do_POST(self):
+        method = self.path.strip('/')
+        length = int(self.headers.get('Content-Length', 0))
+        content = self.rfile.read(length)
+
+        if method not in METHODS:
+            self._respond(404, {'error': {'type': 'NotFound', 'message': method}})
+            return
+
+        self.server.request_started(method)
+        try:
+            kwargs = protocol.loads(content) if content else {}
+            try:
+                self.server.signatures[method].bind(**kwargs)
+            except TypeError as e:
+                # only arguments not matching the method are the client's fault, a TypeError raised inside is a bug
+                status, response = 400, {'error': protocol.encode_error(e)}
+            else:
+                result = getattr(self.server.api, method)(**kwargs)
+                status, response = 200, {'result': result}
+        except Exception as e:
+            status = next((code for kind, code in ERROR_STATUS if isinstance(e, kind)), 500)
+            response = {'error': protocol.encode_error(e)}
+        finally:
+            self.server.request_finished(method)
+
+        self._respond(status, response)
+
+    def _respond(self, status, response):
+        content = protocol.dumps(response)
+        if self.server.stopping:
+            self.close_connection = True
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(content)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _TCPDaemonRequestHandler(_DaemonRequestHandler):
+    # headers and body are written separately, without TCP_NODELAY every response waits for a delayed ACK
+    disable_nagle_algorithm = True
+
+
+class _DaemonMixIn(object):
+    # wait for request threads in server_close, so in-flight work is drained on shutdown
+    daemon_threads = False
+    block_on_close = True
+
+    def _init_daemon(self, api):
+        self.api = api
+        self.stopping = False
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._calls = dict((method, 0) for method in METHODS)
+        self.signatures = dict((method, inspect.signature(getattr(api, method))) for method in METHODS)
+
+    def request_started(self, method):
+        with self._stats_lock:
+            self._in_flight += 1
+            self._calls[method] += 1
+
+    def request_finished(self, method):
+        with self._stats_lock:
+            self._in_flight -= 1
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = {
+                'in_flight': self._in_flight,
+                'calls': dict(self._calls),
+                'connector': dict(self.api.connector.stats),
+            }
+        if self.api.scheduler is not None:
+            stats['scheduler'] = self.api.scheduler.stats()
+        if self.api.adaptive_timeout is not None:
+            stats['timeouts'] = self.api.adaptive_timeout.stats()
+        if self.api.shadow is not None:
+            stats['shadow'] = self.api.shadow.stats()
+        if self.api.profiler is not None:
+            stats['profiler'] = self.api.profiler.stats()
+        if self.api.health_monitor is not None:
+            stats['health'] = self.api.health_monitor.status()
+        return stats
+
+    def stop(self):
+        """
+        Stop accepting requests and wait for in-flight requests to finish.
+        """
+        self.stopping = True
+        self.shutdown()
+        self.server_close()
+
+
+class HTTPDaemonServer(_DaemonMixIn, ThreadingHTTPServer):
+    def __init__(self, api, host='127.0.0.1', port=8089):
+        ThreadingHTTPServer.__init__(self, (host, port), _TCPDaemonRequestHandler)
+        self._init_daemon(api)
+
+
+class UnixDaemonServer(_DaemonMixIn, ThreadingMixIn, UnixStreamServer):
+    def __init__(self, api, socket_path):
+        if os.path.exists(socket_path):
+            # remove stale socket left by a previous run, but never steal a socket from a running daemon
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+                raise OSError("Another daemon is listening on %s" % socket_path)
+            except ConnectionRefusedError:
+                os.unlink(socket_path)
+            finally:
+                probe.close()
+
+        UnixStreamServer.__init__(self, socket_path, _DaemonRequestHandler)
+        self._init_daemon(api)
+        self.socket_path = socket_path
+
+    def server_close(self):
+        UnixStreamServer.server_close(self)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='furs-fiscal-daemon',
+                                     description='Serve FURS fiscalization to local processes.')
+    parser.add_argument('--p12', required=True, help='path to the .p12 certificate')
+    parser.add_argument('--password-env', default='FURS_P12_PASSWORD',
+                        help='environment variable holding the .p12 password (default: FURS_P12_PASSWORD)')
+    parser.add_argument('--test', action='store_true', help='use FURS test server')
+    parser.add_argument('--endpoint', help='override FURS server URL')
+    parser.add_argument('--timeout', type=float, default=2.0, help='FURS request timeout in seconds')
+    parser.add_argument('--pool-size', type=int, default=10, help='connections to FURS to keep open')
+    parser.add_argument('--max-concurrency', type=int,
+                        help='schedule requests by priority, sending at most this many to FURS at once')
+    parser.add_argument('--adaptive-timeout', action='store_true',
+                        help='derive timeouts from observed FURS latency, --timeout becomes the upper limit')
+    parser.add_argument('--health-ttl', type=float, default=5.0,
+                        help='seconds to reuse the result of an echo for is_server_accessible, 0 disables caching '
+                             '(default: 5)')
+    parser.add_argument('--socket', help='listen on this Unix socket path')
+    parser.add_argument('--host', default='127.0.0.1', help='listen on this address (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8089, help='listen on this port (default: 8089)')
+    args = parser.parse_args(argv)
+
+    password = os.environ.get(args.password_env)
+    if password is None:
+        parser.error("environment variable %s is not set" % args.password_env)
+
+    api = FiscalAPI(p12_path=args.p12,
+                    p12_password=password,
+                    production=not args.test,
+                    request_timeout=args.timeout,
+                    pool_size=args.pool_size,
+                    endpoint=args.endpoint,
+                    scheduler=PriorityScheduler(max_concurrency=args.max_concurrency) if args.max_concurrency else None,
+                    adaptive_timeout=AdaptiveTimeout(max_timeout=args.timeout) if args.adaptive_timeout else None,
+                    health_monitor=HealthMonitor(ttl=args.health_ttl) if args.health_ttl > 0 else None)
+
+    if args.socket:
+        server = UnixDaemonServer(api, args.socket)
+    else:
+        server = HTTPDaemonServer(api, host=args.host, port=args.port)
+
+    stop = threading.Event()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signal_number, lambda *_: stop.set())
+
+    thread = threading.Thread(target=server.serve_forever, name='furs-fiscal-daemon')
+    thread.start()
+    sys.stderr.write("furs-fiscal-daemon listening on %s\n" % (args.socket or '%s:%d' % (args.host, args.port)))
+
+    stop.wait()
+    sys.stderr.write("furs-fiscal-daemon shutting down\n")
+    server.stop()
+    thread.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -22,6 +22,14 @@ class ConnectionTimedOutException(Exception):
     pass
 
 
+class RateLimitTimeoutException(ConnectionTimedOutException):
+    """
+    RateLimitTimeoutException will be thrown if the request could not be sent within the allowed wait time
+    because of the configured rate limit
+    """
+    pass
+
+
 class ConnectionException(Exception):
     """
     Connection Exception will be thrown if the server responds with anything else than status code 200
@@ -34,3 +42,19 @@ class ConnectionException(Exception):
 
     def __str__(self):
         return repr("[Code: %s]%s" % (self.code, self.message))
+
+
+class ValidationException(Exception):
+    """
+    Validation Exception will be thrown if the request does not conform to the FURS schema. It is raised
+    locally, before the request is signed and sent to the FURS server.
+
+    ValidationException contains a list of SchemaError tuples (path, message) describing what is wrong.
+    """
+    def __init__(self, errors):
+        self.errors = errors
+
+        super(ValidationException, self).__init__(errors)
+
+    def __str__(self):
+        return repr('; '.join("%s: %s" % (error.path, error.message) for error in self.errors))
@@ -0,0 +1,31 @@
+"""
+Support for pre-fork servers (gunicorn, uwsgi) which create the API objects in the master process and fork
+workers from it.
+
+Objects registered here have their _after_fork method called in the child process right after a fork. It
+replaces locks which might have been held by a thread of the parent and drops connections shared with the parent.
+Key material that was already loaded stays in memory, shared with the parent until it is written to.
+"""
+import os
+import weakref
+
+
+_instances = weakref.WeakSet()
+
+
+def register(instance):
+    """
+    Call instance._after_fork() in child processes forked after this call.
+
+    :param instance: object with an _after_fork method, only a weak reference to it is kept
+    """
+    _instances.add(instance)
+
+
+def _after_fork_in_child():
+    for instance in list(_instances):
+        instance._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,173 @@
+import threading
+import time
+
+from requests import codes
+
+from furs_fiscal import forksafe
+
+
+class HealthMonitor(object):
+    """
+    HealthMonitor answers whether the FURS server is accessible from a cached echo result, so that many terminals
+    asking at the same time cause a single echo request and do not wait for it.
+
+    A result is fresh for ttl seconds. When it is older, the cached result is returned right away and an echo is
+    sent in the background. Only the very first check waits for the echo; concurrent callers wait for the same one.
+    With start() the result is refreshed every interval seconds, by default twice per ttl, so callers get a result
+    younger than ttl as long as an echo takes less than half of ttl.
+
+    Usage:
+        monitor = HealthMonitor(ttl=5.0)
+        api = FURSInvoiceAPI(p12_path, p12_password, health_monitor=monitor)
+        ...
+        api.is_server_accessible()
+        monitor.status()['since_success']
+
+    A monitor can be shared by API objects using the same endpoint.
+    """
+    def __init__(self, connector=None, ttl=5.0, interval=None):
+        """
+        :param connector: (Connector) Connector sending the echo requests. Default: None, set by the first
+                                      FURSBaseAPI the monitor is passed to
+        :param ttl: (float) Seconds for which an echo result is used without sending another echo
+        :param interval: (float) Seconds between echo requests after start(). Default: ttl / 2
+        """
+        self.connector = connector
+        self.ttl = ttl
+        self.interval = interval
+
+        self._condition = threading.Condition()
+        self._refreshing = False
+        self._accessible = None
+        self._latency = None
+        self._error = None
+        self._checked = None
+        self._last_success = None
+        self._counts = dict.fromkeys(('checks', 'echoes', 'coalesced'), 0)
+
+        self._stop = threading.Event()
+        self._thread = None
+
+        forksafe.register(self)
+
+    def is_accessible(self):
+        """
+        Check if FURS server is accessible, from cache when possible.
+
+        :return: (boolean) True if the last echo got HTTP 200, False if it failed or timed out
+        """
+        with self._condition:
+            self._counts['checks'] += 1
+            if self._checked is None:
+                first = True
+            else:
+                first = False
+                if time.monotonic() - self._checked >= self.ttl and not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._echo, name='furs-health-monitor', daemon=True).start()
+                return self._accessible
+
+        if first:
+            return self.refresh()
+
+    def refresh(self):
+        """
+        Send an echo request now and wait for it. If one is already in progress, wait for that one instead.
+
+        :return: (boolean) True if the server is accessible
+        """
+        with self._condition:
+            if self._refreshing:
+                self._counts['coalesced'] += 1
+                self._condition.wait_for(lambda: not self._refreshing)
+                return self._accessible
+            self._refreshing = True
+
+        self._echo()
+        with self._condition:
+            return self._accessible
+
+    def status(self):
+        """
+        :return: (dict) accessible, latency of the last echo, age of the result and time since the last successful
+                        echo in seconds (None if unknown), error of the last echo, and checks, echoes and coalesced
+                        (checks which waited for an echo already in progress) counts
+        """
+        with self._condition:
+            now = time.monotonic()
+            status = {
+                'accessible': self._accessible,
+                'latency': self._latency,
+                'age': now - self._checked if self._checked is not None else None,
+                'since_success': now - self._last_success if self._last_success is not None else None,
+                'error': self._error,
+            }
+            status.update(self._counts)
+            return status
+
+    def start(self):
+        """
+        Refresh the result in a background thread every interval seconds. First echo is sent immediately.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='furs-health-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop refreshing in the background.
+
+        :param timeout: (float) How long to wait for the thread, None waits until it finishes
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.interval if self.interval is not None else self.ttl / 2)
+
+    def _echo(self):
+        # called with _refreshing set, which is cleared here whatever happens
+        accessible = False
+        error = None
+        started = time.perf_counter()
+        try:
+            response = self.connector.send_echo()
+            accessible = response.status_code == codes.ok
+            if not accessible:
+                error = 'HTTP %s' % response.status_code
+        except Exception as e:
+            error = '%s: %s' % (type(e).__name__, e)
+        finally:
+            latency = time.perf_counter() - started
+            with self._condition:
+                now = time.monotonic()
+                self._accessible = accessible
+                self._latency = latency
+                self._error = error
+                self._checked = now
+                if accessible:
+                    self._last_success = now
+                self._counts['echoes'] += 1
+                self._refreshing = False
+                self._condition.notify_all()
+
+    def _after_fork(self):
+        # an echo or the refresh thread running in the parent does not exist in the child
+        self._condition = threading.Condition()
+        self._refreshing = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
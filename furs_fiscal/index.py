@@ -0,0 +1,270 @@
+import datetime
+import json
+import os
+import threading
+
+from collections import namedtuple
+from decimal import Decimal
+
+from furs_fiscal.listeners import InvoiceListener
+
+
+IndexedInvoice = namedtuple('IndexedInvoice', ['business_premise_id', 'electronic_device_id', 'invoice_number',
+                                               'issued_date', 'invoice_amount', 'zoi', 'eor'])
+
+IndexedSalesBookInvoice = namedtuple('IndexedSalesBookInvoice', ['business_premise_id', 'set_number',
+                                                                 'serial_number', 'invoice_number', 'issued_date',
+                                                                 'invoice_amount', 'eor'])
+
+
+class InvoiceIndex(InvoiceListener):
+    """
+    InvoiceIndex remembers issued invoices, so that storno and return invoices can be built from the original
+    invoice number alone, without going back to the database for its premise, device and issue date.
+
+    Usage:
+        index = InvoiceIndex(path='invoices.jsonl', business_premise_id='BP101', electronic_device_id='B1')
+        api = FURSInvoiceAPI(p12_path, p12_password, listeners=[index])
+        ...
+        eor = api.get_invoice_eor(zoi=zoi, ..., **index.storno_kwargs('11'))
+    """
+    def __init__(self, path=None, business_premise_id=None, electronic_device_id=None):
+        """
+        :param path: (string) Journal file. Every indexed invoice is appended to it and the index is rebuilt from
+                              it on start. Default: None, index is kept in memory only
+        :param business_premise_id: (string) Premise used for lookups that do not specify one
+        :param electronic_device_id: (string) Electronic device used for lookups that do not specify one
+        """
+        self.path = path
+        self.business_premise_id = business_premise_id
+        self.electronic_device_id = electronic_device_id
+
+        self._invoices = {}
+        self._sales_book_invoices = {}
+        # issue date -> list of invoice keys
+        self._days = {}
+        # keys of invoices referenced by an issued negative invoice
+        self._cancelled = set()
+        self._lock = threading.Lock()
+        self._journal = None
+
+        if path is not None:
+            if os.path.exists(path):
+                self._load(path)
+            self._journal = open(path, 'a')
+
+    def invoice_issued(self, message, eor):
+        request = message['InvoiceRequest']
+        if 'Invoice' in request:
+            invoice = request['Invoice']
+            identifier = invoice['InvoiceIdentifier']
+            self.add(business_premise_id=identifier['BusinessPremiseID'],
+                     electronic_device_id=identifier['ElectronicDeviceID'],
+                     invoice_number=identifier['InvoiceNumber'],
+                     issued_date=datetime.datetime.strptime(invoice['IssueDateTime'], "%Y-%m-%dT%H:%M:%SZ"),
+                     invoice_amount=invoice['InvoiceAmount'],
+                     zoi=invoice['ProtectedID'],
+                     eor=eor)
+            if Decimal(str(invoice['InvoiceAmount'])) < 0:
+                for reference in invoice.get('ReferenceInvoice', []):
+                    identifier = reference['ReferenceInvoiceIdentifier']
+                    self.add_cancelled(business_premise_id=identifier['BusinessPremiseID'],
+                                       electronic_device_id=identifier['ElectronicDeviceID'],
+                                       invoice_number=identifier['InvoiceNumber'])
+        else:
+            invoice = request['SalesBookInvoice']
+            identifier = invoice['SalesBookIdentifier']
+            self.add_sales_book(business_premise_id=invoice['BusinessPremiseID'],
+                                set_number=identifier['SetNumber'],
+                                serial_number=identifier['SerialNumber'],
+                                invoice_number=identifier['InvoiceNumber'],
+                                issued_date=datetime.datetime.strptime(invoice['IssueDate'], "%Y-%m-%d").date(),
+                                invoice_amount=invoice['InvoiceAmount'],
+                                eor=eor)
+
+    def add(self, business_premise_id, electronic_device_id, invoice_number, issued_date, invoice_amount, zoi, eor):
+        """
+        Add an issued invoice to the index.
+        """
+        invoice = IndexedInvoice(str(business_premise_id), str(electronic_device_id), str(invoice_number),
+                                 issued_date, invoice_amount, zoi, eor)
+        with self._lock:
+            self._add(invoice)
+            self._write('invoice', invoice)
+
+    def add_cancelled(self, business_premise_id, electronic_device_id, invoice_number):
+        """
+        Record that a storno or return was issued for an invoice, so storno_kwargs_for_day skips it. Done
+        automatically for negative invoices issued through the API.
+        """
+        key = (str(business_premise_id), str(electronic_device_id), str(invoice_number))
+        with self._lock:
+            self._cancelled.add(key)
+            if self._journal is not None:
+                self._journal.write(json.dumps(['cancelled'] + list(key)) + '\n')
+                self._journal.flush()
+
+    def is_cancelled(self, invoice_number, business_premise_id=None, electronic_device_id=None):
+        """
+        :return: (boolean) True if a storno or return referencing the invoice was issued
+        """
+        return (str(business_premise_id or self.business_premise_id),
+                str(electronic_device_id or self.electronic_device_id),
+                str(invoice_number)) in self._cancelled
+
+    def add_sales_book(self, business_premise_id, set_number, serial_number, invoice_number, issued_date,
+                       invoice_amount, eor):
+        """
+        Add an issued sales book invoice to the index.
+        """
+        invoice = IndexedSalesBookInvoice(str(business_premise_id), str(set_number), str(serial_number),
+                                          str(invoice_number), issued_date, invoice_amount, eor)
+        with self._lock:
+            self._sales_book_invoices[invoice[:4]] = invoice
+            self._write('sales_book', invoice)
+
+    def get(self, invoice_number, business_premise_id=None, electronic_device_id=None):
+        """
+        Find an issued invoice.
+
+        :param invoice_number: (string) Invoice number
+        :param business_premise_id: (string) Premise ID. Default: premise given to the constructor
+        :param electronic_device_id: (string) Electronic device ID. Default: device given to the constructor
+        :return: (IndexedInvoice) invoice or None if it is not in the index
+        """
+        return self._invoices.get((str(business_premise_id or self.business_premise_id),
+                                   str(electronic_device_id or self.electronic_device_id),
+                                   str(invoice_number)))
+
+    def get_sales_book(self, invoice_number, set_number, serial_number, business_premise_id=None):
+        """
+        Find an issued sales book invoice.
+
+        :return: (IndexedSalesBookInvoice) invoice or None if it is not in the index
+        """
+        return self._sales_book_invoices.get((str(business_premise_id or self.business_premise_id),
+                                              str(set_number), str(serial_number), str(invoice_number)))
+
+    def issued_on(self, date):
+        """
+        :param date: (date) Issue date
+        :return: (list) IndexedInvoice objects issued on that day, in the order they were added
+        """
+        return [self._invoices[key] for key in self._days.get(date, [])]
+
+    def reference_kwargs(self, invoice_number, business_premise_id=None, electronic_device_id=None):
+        """
+        Build reference_invoice_* arguments of FURSInvoiceAPI.get_invoice_eor for an invoice referencing an
+        issued invoice, e.g. a partial return.
+
+        :return: (dict) keyword arguments for get_invoice_eor
+
+        :raises
+            KeyError - invoice is not in the index
+        """
+        invoice = self.get(invoice_number, business_premise_id, electronic_device_id)
+        if invoice is None:
+            raise KeyError("Invoice %s is not in the index" % invoice_number)
+
+        return InvoiceIndex._reference_kwargs(invoice)
+
+    def storno_kwargs(self, invoice_number, business_premise_id=None, electronic_device_id=None):
+        """
+        Same as reference_kwargs, with negative invoice_amount of the original invoice added.
+
+        :return: (dict) keyword arguments for get_invoice_eor
+
+        :raises
+            KeyError - invoice is not in the index
+        """
+        invoice = self.get(invoice_number, business_premise_id, electronic_device_id)
+        if invoice is None:
+            raise KeyError("Invoice %s is not in the index" % invoice_number)
+
+        return InvoiceIndex._storno_kwargs(invoice)
+
+    def storno_kwargs_for_day(self, date):
+        """
+        Storno arguments for every invoice issued on a given day, e.g. to cancel a whole day of invoices.
+        Invoices with negative amounts (stornos and returns themselves) and invoices which already have a storno
+        or return are skipped, so the call can be repeated after a partial failure.
+
+        :param date: (date) Issue date
+        :return: (list) keyword arguments for get_invoice_eor, one dict per invoice
+        """
+        return [InvoiceIndex._storno_kwargs(invoice) for invoice in self.issued_on(date)
+                if invoice.invoice_amount >= 0 and invoice[:3] not in self._cancelled]
+
+    def sales_book_reference_kwargs(self, invoice_number, set_number, serial_number, business_premise_id=None):
+        """
+        Build reference_sales_book_* arguments of FURSInvoiceAPI.get_sales_book_invoice_eor.
+
+        :return: (dict) keyword arguments for get_sales_book_invoice_eor
+
+        :raises
+            KeyError - invoice is not in the index
+        """
+        invoice = self.get_sales_book(invoice_number, set_number, serial_number, business_premise_id)
+        if invoice is None:
+            raise KeyError("Sales book invoice %s is not in the index" % invoice_number)
+
+        return {
+            'reference_sales_book_number': invoice.invoice_number,
+            'reference_sales_book_set_number': invoice.set_number,
+            'reference_sales_book_serial_number': invoice.serial_number,
+            'reference_sales_book_issued_date': invoice.issued_date,
+        }
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    @staticmethod
+    def _reference_kwargs(invoice):
+        return {
+            'reference_invoice_number': invoice.invoice_number,
+            'reference_invoice_business_premise_id': invoice.business_premise_id,
+            'reference_invoice_electronic_device_id': invoice.electronic_device_id,
+            'reference_invoice_issued_date': invoice.issued_date,
+        }
+
+    @staticmethod
+    def _storno_kwargs(invoice):
+        kwargs = InvoiceIndex._reference_kwargs(invoice)
+        kwargs['invoice_amount'] = -invoice.invoice_amount
+        return kwargs
+
+    def _add(self, invoice):
+        key = invoice[:3]
+        if key not in self._invoices:
+            self._days.setdefault(invoice.issued_date.date(), []).append(key)
+        self._invoices[key] = invoice
+
+    def _write(self, kind, invoice):
+        if self._journal is None:
+            return
+
+        record = list(invoice)
+        record[invoice._fields.index('issued_date')] = invoice.issued_date.isoformat()
+        # Decimal amounts are written as strings and restored in _load
+        self._journal.write(json.dumps([kind] + record, default=str) + '\n')
+        self._journal.flush()
+
+    def _load(self, path):
+        with open(path) as journal:
+            for line in journal:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record[0] == 'invoice':
+                    record[4] = datetime.datetime.fromisoformat(record[4])
+                    record[5] = Decimal(record[5]) if isinstance(record[5], str) else record[5]
+                    self._add(IndexedInvoice(*record[1:]))
+                elif record[0] == 'cancelled':
+                    self._cancelled.add(tuple(record[1:]))
+                else:
+                    record[5] = datetime.date.fromisoformat(record[5])
+                    record[6] = Decimal(record[6]) if isinstance(record[6], str) else record[6]
+                    invoice = IndexedSalesBookInvoice(*record[1:])
+                    self._sales_book_invoices[invoice[:4]] = invoice
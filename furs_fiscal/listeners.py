@@ -0,0 +1,22 @@
+class InvoiceListener(object):
+    """
+    Base class for objects passed to FURSInvoiceAPI(listeners=[...]). Listeners are called synchronously after
+    FURS answers, so they should be fast. Exceptions raised by listeners are logged and otherwise ignored.
+    """
+    def invoice_issued(self, message, eor):
+        """
+        Called after FURS returned EOR for an invoice or sales book invoice.
+
+        :param message: (dict) InvoiceRequest message that was sent
+        :param eor: (string) EOR returned by FURS
+        """
+        pass
+
+    def invoice_failed(self, message, exception):
+        """
+        Called when an invoice could not be fiscalized.
+
+        :param message: (dict) InvoiceRequest message that was sent
+        :param exception: (Exception) exception that will be raised to the caller
+        """
+        pass
@@ -0,0 +1,590 @@
+"""
+Rendering of the invoice Data Record (see FURSInvoiceAPI.prepare_printable) into printable barcodes.
+
+The Data Record is always a 60 digit numeric string, so the encoders here only implement what is needed
+for it: QR Code (numeric mode, versions 1-6) and Code 128 (code set C). All encoding tables are computed
+once at import time and function pattern templates are cached per QR version, so rendering a receipt
+costs only the data placement and masking.
+
+PDF417 is not rendered on the host - printers supporting ESC/POS render it natively from the command
+returned by escpos_pdf417(), which is also the fastest option for QR and Code 128 on such printers.
+pdf417_matrix() and the image renderers raise an error instead of producing a PNG, SVG or raster image of it;
+print QR Code or Code 128 when an image is needed.
+"""
+import re
+import struct
+import zlib
+
+from functools import lru_cache
+
+
+# ---------------------------------------------------------------------------------------------------------------
+# Code 128
+# ---------------------------------------------------------------------------------------------------------------
+
+CODE128_PATTERNS = (
+    '212222', '222122', '222221', '121223', '121322', '131222', '122213', '122312', '132212', '221213',
+    '221312', '231212', '112232', '122132', '122231', '113222', '123122', '123221', '223211', '221132',
+    '221231', '213212', '223112', '312131', '311222', '321122', '321221', '312212', '322112', '322211',
+    '212123', '212321', '232121', '111323', '131123', '131321', '112313', '132113', '132311', '211313',
+    '231113', '231311', '112133', '112331', '132131', '113123', '113321', '133121', '313121', '211331',
+    '231131', '213113', '213311', '213131', '311123', '311321', '331121', '312113', '312311', '332111',
+    '314111', '221411', '431111', '111224', '111422', '121124', '121421', '141122', '141221', '112214',
+    '112412', '122114', '122411', '142112', '142211', '241211', '221114', '413111', '241112', '134111',
+    '111242', '121142', '121241', '114212', '124112', '124211', '411212', '421112', '421211', '212141',
+    '214121', '412121', '111143', '111341', '131141', '114113', '114311', '411113', '411311', '113141',
+    '114131', '311141', '411131', '211412', '211214', '211232', '2331112',
+)
+
+CODE128_START_C = 105
+CODE128_STOP = 106
+
+
+def _widths_to_modules(widths):
+    modules = []
+    dark = True
+    for width in widths:
+        modules.extend([dark] * int(width))
+        dark = not dark
+    return tuple(modules)
+
+
+_CODE128_MODULES = tuple(_widths_to_modules(pattern) for pattern in CODE128_PATTERNS)
+
+
+def code128_modules(data):
+    """
+    Encode numeric data with Code 128 code set C.
+
+    :param data: (string) Even number of digits, e.g. the Data Record
+    :return: (list) One row of modules, True for a dark bar
+    """
+    if not data.isdigit() or len(data) % 2:
+        raise ValueError("Code 128 code set C requires an even number of digits")
+
+    values = [int(data[i:i + 2]) for i in range(0, len(data), 2)]
+    checksum = (CODE128_START_C + sum(i * value for i, value in enumerate(values, 1))) % 103
+
+    modules = list(_CODE128_MODULES[CODE128_START_C])
+    for value in values:
+        modules.extend(_CODE128_MODULES[value])
+    modules.extend(_CODE128_MODULES[checksum])
+    modules.extend(_CODE128_MODULES[CODE128_STOP])
+
+    return modules
+
+
+def code128_matrix(data, height=40):
+    """
+    Encode numeric data with Code 128 as a module matrix, ready for the renderers in this module.
+
+    :param data: (string) Even number of digits
+    :param height: (int) Bar height in modules
+    :return: (list) List of rows, all rows are the same list object
+    """
+    row = code128_modules(data)
+    return [row] * height
+
+
+# ---------------------------------------------------------------------------------------------------------------
+# QR Code
+# ---------------------------------------------------------------------------------------------------------------
+
+# error correction level -> format bits
+QR_ERROR_CORRECTION = {'L': 1, 'M': 0, 'Q': 3, 'H': 2}
+
+# (version, level) -> (ec codewords per block, ((block count, data codewords per block), ...))
+QR_BLOCKS = {
+    (1, 'L'): (7, ((1, 19),)), (1, 'M'): (10, ((1, 16),)), (1, 'Q'): (13, ((1, 13),)), (1, 'H'): (17, ((1, 9),)),
+    (2, 'L'): (10, ((1, 34),)), (2, 'M'): (16, ((1, 28),)), (2, 'Q'): (22, ((1, 22),)), (2, 'H'): (28, ((1, 16),)),
+    (3, 'L'): (15, ((1, 55),)), (3, 'M'): (26, ((1, 44),)), (3, 'Q'): (18, ((2, 17),)), (3, 'H'): (22, ((2, 13),)),
+    (4, 'L'): (20, ((1, 80),)), (4, 'M'): (18, ((2, 32),)), (4, 'Q'): (26, ((2, 24),)), (4, 'H'): (16, ((4, 9),)),
+    (5, 'L'): (26, ((1, 108),)), (5, 'M'): (24, ((2, 43),)),
+    (5, 'Q'): (18, ((2, 15), (2, 16))), (5, 'H'): (22, ((2, 11), (2, 12))),
+    (6, 'L'): (18, ((2, 68),)), (6, 'M'): (16, ((4, 27),)), (6, 'Q'): (24, ((4, 19),)), (6, 'H'): (28, ((4, 15),)),
+}
+
+QR_ALIGNMENT_POSITIONS = {1: (), 2: (6, 18), 3: (6, 22), 4: (6, 26), 5: (6, 30), 6: (6, 34)}
+
+QR_MAX_VERSION = 6
+
+_GF_EXP = [0] * 512
+_GF_LOG = [0] * 256
+
+
+def _init_galois_field():
+    value = 1
+    for i in range(255):
+        _GF_EXP[i] = value
+        _GF_LOG[value] = i
+        value <<= 1
+        if value & 0x100:
+            value ^= 0x11D
+    for i in range(255, 512):
+        _GF_EXP[i] = _GF_EXP[i - 255]
+
+
+_init_galois_field()
+
+
+@lru_cache(maxsize=None)
+def _rs_generator(degree):
+    generator = [1]
+    for i in range(degree):
+        result = [0] * (len(generator) + 1)
+        for j, coefficient in enumerate(generator):
+            result[j] ^= coefficient
+            if coefficient:
+                result[j + 1] ^= _GF_EXP[_GF_LOG[coefficient] + i]
+        generator = result
+    return tuple(_GF_LOG[coefficient] for coefficient in generator[1:])
+
+
+def _rs_remainder(data, degree):
+    generator = _rs_generator(degree)
+    remainder = [0] * degree
+    for byte in data:
+        factor = byte ^ remainder[0]
+        del remainder[0]
+        remainder.append(0)
+        if factor:
+            log_factor = _GF_LOG[factor]
+            for i, log_coefficient in enumerate(generator):
+                remainder[i] ^= _GF_EXP[log_coefficient + log_factor]
+    return remainder
+
+
+def _qr_data_capacity(version, level):
+    return sum(count * size for count, size in QR_BLOCKS[(version, level)][1])
+
+
+def _qr_numeric_bits(length):
+    return 4 + 10 + (length // 3) * 10 + (0, 4, 7)[length % 3]
+
+
+def _qr_encode_data(data, version, level):
+    bits = [(0b0001, 4), (len(data), 10)]
+    for i in range(0, len(data), 3):
+        chunk = data[i:i + 3]
+        bits.append((int(chunk), len(chunk) * 3 + 1))
+
+    capacity = _qr_data_capacity(version, level) * 8
+    accumulator = 0
+    length = 0
+    for value, size in bits:
+        accumulator = (accumulator << size) | value
+        length += size
+
+    terminator = min(4, capacity - length)
+    accumulator <<= terminator
+    length += terminator
+    padding = -length % 8
+    accumulator <<= padding
+    length += padding
+
+    codewords = list(accumulator.to_bytes(length // 8, 'big'))
+    pad = 0xEC
+    while len(codewords) < capacity // 8:
+        codewords.append(pad)
+        pad ^= 0xEC ^ 0x11
+
+    return codewords
+
+
+def _qr_interleave(codewords, version, level):
+    ec_length, groups = QR_BLOCKS[(version, level)]
+
+    blocks = []
+    offset = 0
+    for count, size in groups:
+        for _ in range(count):
+            block = codewords[offset:offset + size]
+            blocks.append((block, _rs_remainder(block, ec_length)))
+            offset += size
+
+    result = []
+    for i in range(max(len(block) for block, _ in blocks)):
+        for block, _ in blocks:
+            if i < len(block):
+                result.append(block[i])
+    for i in range(ec_length):
+        for _, ec in blocks:
+            result.append(ec[i])
+
+    return result
+
+
+@lru_cache(maxsize=None)
+def _qr_template(version):
+    """
+    Build function patterns for a given version, the zig-zag order of data module coordinates and the values
+    of all mask patterns in that order.
+    """
+    size = version * 4 + 17
+    modules = [[False] * size for _ in range(size)]
+    function = [[False] * size for _ in range(size)]
+
+    def put(x, y, dark):
+        modules[y][x] = dark
+        function[y][x] = True
+
+    for i in range(size):
+        put(6, i, i % 2 == 0)
+        put(i, 6, i % 2 == 0)
+
+    for cx, cy in ((3, 3), (size - 4, 3), (3, size - 4)):
+        for dy in range(-4, 5):
+            for dx in range(-4, 5):
+                x, y = cx + dx, cy + dy
+                if 0 <= x < size and 0 <= y < size:
+                    put(x, y, max(abs(dx), abs(dy)) not in (2, 4))
+
+    positions = QR_ALIGNMENT_POSITIONS[version]
+    last = len(positions) - 1
+    for i, cx in enumerate(positions):
+        for j, cy in enumerate(positions):
+            if (i, j) in ((0, 0), (0, last), (last, 0)):
+                continue
+            for dy in range(-2, 3):
+                for dx in range(-2, 3):
+                    put(cx + dx, cy + dy, max(abs(dx), abs(dy)) != 1)
+
+    # reserve format information area, real bits are drawn after masking
+    for i in range(9):
+        function[i][8] = function[8][i] = True
+    for i in range(8):
+        function[8][size - 1 - i] = function[size - 1 - i][8] = True
+    put(8, size - 8, True)
+
+    order = []
+    right = size - 1
+    while right >= 1:
+        if right == 6:
+            right = 5
+        upward = ((right + 1) & 2) == 0
+        for vertical in range(size):
+            y = size - 1 - vertical if upward else vertical
+            for x in (right, right - 1):
+                if not function[y][x]:
+                    order.append((x, y))
+        right -= 2
+
+    masks = tuple(tuple(mask(x, y) for x, y in order) for mask in _QR_MASKS)
+
+    return tuple(tuple(row) for row in modules), tuple(order), masks
+
+
+_QR_MASKS = (
+    lambda x, y: (x + y) % 2 == 0,
+    lambda x, y: y % 2 == 0,
+    lambda x, y: x % 3 == 0,
+    lambda x, y: (x + y) % 3 == 0,
+    lambda x, y: (x // 3 + y // 2) % 2 == 0,
+    lambda x, y: x * y % 2 + x * y % 3 == 0,
+    lambda x, y: (x * y % 2 + x * y % 3) % 2 == 0,
+    lambda x, y: ((x + y) % 2 + x * y % 3) % 2 == 0,
+)
+
+
+def _qr_format_bits(level, mask):
+    data = QR_ERROR_CORRECTION[level] << 3 | mask
+    remainder = data
+    for _ in range(10):
+        remainder = (remainder << 1) ^ ((remainder >> 9) * 0x537)
+    return (data << 10 | remainder) ^ 0x5412
+
+
+def _qr_draw_format(modules, level, mask):
+    size = len(modules)
+    bits = _qr_format_bits(level, mask)
+
+    def bit(i):
+        return (bits >> i) & 1 == 1
+
+    for i in range(6):
+        modules[i][8] = bit(i)
+    modules[7][8] = bit(6)
+    modules[8][8] = bit(7)
+    modules[8][7] = bit(8)
+    for i in range(9, 15):
+        modules[8][14 - i] = bit(i)
+
+    for i in range(8):
+        modules[8][size - 1 - i] = bit(i)
+    for i in range(8, 15):
+        modules[size - 15 + i][8] = bit(i)
+
+
+_QR_RUNS = re.compile(r'0{5,}|1{5,}')
+
+
+def _qr_penalty(modules):
+    size = len(modules)
+    penalty = 0
+
+    lines = [''.join('1' if dark else '0' for dark in row) for row in modules]
+    lines += [''.join(column) for column in zip(*lines)]
+    for line in lines:
+        for run in _QR_RUNS.finditer(line):
+            penalty += run.end() - run.start() - 2
+        penalty += 40 * (line.count('10111010000') + line.count('00001011101'))
+
+    # 2x2 blocks of the same color, compared as bit masks of adjacent rows
+    full = (1 << (size - 1)) - 1
+    rows = [int(line, 2) for line in lines[:size]]
+    for row, next_row in zip(rows, rows[1:]):
+        same = ~(row ^ next_row) & ~(row ^ (row >> 1)) & ~(next_row ^ (next_row >> 1))
+        penalty += 3 * bin(same & full).count('1')
+
+    dark = sum(line.count('1') for line in lines[:size])
+    penalty += abs(dark * 20 - size * size * 10) // (size * size) * 10
+
+    return penalty
+
+
+def qr_matrix(data, error_correction='M', mask=None):
+    """
+    Encode numeric data as a QR Code in numeric mode. The smallest version that fits the data is used.
+
+    :param data: (string) Digits to encode, e.g. the Data Record
+    :param error_correction: (string) Error correction level, one of 'L', 'M', 'Q' or 'H'. Default is 'M'
+    :param mask: (int) Force mask pattern 0-7. Default None picks the mask with the lowest penalty
+    :return: (list) List of rows, True for a dark module
+    """
+    if not data.isdigit():
+        raise ValueError("Only numeric data can be encoded")
+    if error_correction not in QR_ERROR_CORRECTION:
+        raise ValueError("Unknown error correction level: %s" % error_correction)
+
+    for version in range(1, QR_MAX_VERSION + 1):
+        if _qr_numeric_bits(len(data)) <= _qr_data_capacity(version, error_correction) * 8:
+            break
+    else:
+        raise ValueError("Data is too long to be encoded")
+
+    codewords = _qr_interleave(_qr_encode_data(data, version, error_correction), version, error_correction)
+    template, order, masks = _qr_template(version)
+
+    data_bits = [(codeword >> (7 - i)) & 1 == 1 for codeword in codewords for i in range(8)]
+    data_bits.extend([False] * (len(order) - len(data_bits)))
+
+    best = None
+    for candidate in (range(8) if mask is None else (mask,)):
+        modules = [list(row) for row in template]
+        for (x, y), dark, masked in zip(order, data_bits, masks[candidate]):
+            modules[y][x] = dark != masked
+        _qr_draw_format(modules, error_correction, candidate)
+
+        if mask is not None:
+            return modules
+
+        penalty = _qr_penalty(modules)
+        if best is None or penalty < best[0]:
+            best = (penalty, modules)
+
+    return best[1]
+
+
+# ---------------------------------------------------------------------------------------------------------------
+# PDF417
+# ---------------------------------------------------------------------------------------------------------------
+
+PDF417_IMAGE_UNSUPPORTED = "PDF417 can not be rendered as an image, only by the printer from escpos_pdf417(); " \
+                           "use qr_matrix() or code128_matrix() for PNG, SVG or raster output"
+
+
+def pdf417_matrix(data, *args, **kwargs):
+    """
+    PDF417 module matrices are not available - the symbol is only printed natively with escpos_pdf417().
+
+    :param data: (string) Data Record
+    :raises NotImplementedError: always
+    """
+    raise NotImplementedError(PDF417_IMAGE_UNSUPPORTED)
+
+
+# ---------------------------------------------------------------------------------------------------------------
+# Output formats
+# ---------------------------------------------------------------------------------------------------------------
+
+def _check_matrix(matrix):
+    # an ESC/POS command (e.g. from escpos_pdf417) passed instead of a module matrix
+    if isinstance(matrix, (bytes, bytearray)):
+        raise TypeError(PDF417_IMAGE_UNSUPPORTED if b'\x1d(k\x03\x000' in matrix else
+                        "Expected a module matrix, got an ESC/POS command which only the printer can render")
+
+
+def _scaled_rows(matrix, scale, quiet_zone):
+    _check_matrix(matrix)
+    width = len(matrix[0])
+    blank = [False] * ((width + 2 * quiet_zone) * scale)
+    margin = [False] * (quiet_zone * scale)
+
+    rows = [blank] * (quiet_zone * scale)
+    cache = {}
+    for row in matrix:
+        key = id(row)
+        if key not in cache:
+            scaled = list(margin)
+            for dark in row:
+                scaled.extend([dark] * scale)
+            scaled.extend(margin)
+            cache[key] = scaled
+        rows.extend([cache[key]] * scale)
+    rows.extend([blank] * (quiet_zone * scale))
+
+    return rows
+
+
+def _pack_row(row):
+    padded = row + [False] * (-len(row) % 8)
+    packed = bytearray(len(padded) // 8)
+    for i in range(len(packed)):
+        byte = 0
+        for dark in padded[i * 8:i * 8 + 8]:
+            byte = (byte << 1) | dark
+        packed[i] = byte
+    return bytes(packed)
+
+
+def to_escpos_raster(matrix, scale=4, quiet_zone=0):
+    """
+    Render a module matrix as an ESC/POS raster bit image (GS v 0).
+
+    :param matrix: (list) Module matrix as returned by qr_matrix or code128_matrix
+    :param scale: (int) Printer dots per module
+    :param quiet_zone: (int) Blank modules around the symbol
+    :return: (bytes) ESC/POS command
+    """
+    rows = _scaled_rows(matrix, scale, quiet_zone)
+    packed = {}
+    data = bytearray()
+    for row in rows:
+        key = id(row)
+        if key not in packed:
+            packed[key] = _pack_row(row)
+        data += packed[key]
+
+    width_bytes = (len(rows[0]) + 7) // 8
+    return b'\x1dv0\x00' + struct.pack('<HH', width_bytes, len(rows)) + bytes(data)
+
+
+def to_png(matrix, scale=4, quiet_zone=4):
+    """
+    Render a module matrix as a black and white PNG image.
+
+    :param matrix: (list) Module matrix as returned by qr_matrix or code128_matrix
+    :param scale: (int) Pixels per module
+    :param quiet_zone: (int) Blank modules around the symbol
+    :return: (bytes) PNG file content
+    """
+    rows = _scaled_rows(matrix, scale, quiet_zone)
+    packed = {}
+    raw = bytearray()
+    for row in rows:
+        key = id(row)
+        if key not in packed:
+            # PNG grayscale 1-bit uses 1 for white
+            packed[key] = b'\x00' + bytes(255 - byte for byte in _pack_row(row))
+        raw += packed[key]
+
+    def chunk(kind, content):
+        return struct.pack('>I', len(content)) + kind + content + \
+            struct.pack('>I', zlib.crc32(kind + content) & 0xFFFFFFFF)
+
+    header = struct.pack('>IIBBBBB', len(rows[0]), len(rows), 1, 0, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(bytes(raw))) + \
+        chunk(b'IEND', b'')
+
+
+def to_svg(matrix, module_size=4, quiet_zone=4):
+    """
+    Render a module matrix as a SVG image. Horizontal runs of dark modules are merged into single path segments.
+
+    :param matrix: (list) Module matrix as returned by qr_matrix or code128_matrix
+    :param module_size: (int) Size of the module in SVG user units
+    :param quiet_zone: (int) Blank modules around the symbol
+    :return: (string) SVG document
+    """
+    _check_matrix(matrix)
+    width = len(matrix[0]) + 2 * quiet_zone
+    height = len(matrix) + 2 * quiet_zone
+
+    path = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < len(row):
+            if row[x]:
+                start = x
+                while x < len(row) and row[x]:
+                    x += 1
+                path.append('M%d %dh%dv1h-%dz' % (start + quiet_zone, y + quiet_zone, x - start, x - start))
+            else:
+                x += 1
+
+    return ('<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" viewBox="0 0 %d %d" '
+            'shape-rendering="crispEdges"><rect width="100%%" height="100%%" fill="#fff"/>'
+            '<path fill="#000" d="%s"/></svg>') % (width * module_size, height * module_size,
+                                                   width, height, ''.join(path))
+
+
+# ---------------------------------------------------------------------------------------------------------------
+# ESC/POS native barcode commands
+# ---------------------------------------------------------------------------------------------------------------
+
+def escpos_qr(data, error_correction='M', module_size=4):
+    """
+    ESC/POS command (GS ( k) which makes the printer render the QR Code itself.
+
+    :param data: (string) Data Record
+    :param error_correction: (string) Error correction level, one of 'L', 'M', 'Q' or 'H'. Default is 'M'
+    :param module_size: (int) Module size in dots, 1-16
+    :return: (bytes) ESC/POS command
+    """
+    payload = data.encode('ascii')
+    return b''.join([
+        b'\x1d(k\x04\x001A2\x00',
+        b'\x1d(k\x03\x001C' + bytes([module_size]),
+        b'\x1d(k\x03\x001E' + bytes([48 + 'LMQH'.index(error_correction)]),
+        b'\x1d(k' + struct.pack('<H', len(payload) + 3) + b'1P0' + payload,
+        b'\x1d(k\x03\x001Q0',
+    ])
+
+
+def escpos_pdf417(data, columns=0, module_width=2, row_height=3, error_correction=1):
+    """
+    ESC/POS command (GS ( k) which makes the printer render the PDF417 symbol itself.
+
+    :param data: (string) Data Record
+    :param columns: (int) Number of data columns, 0 for automatic
+    :param module_width: (int) Module width in dots, 2-8
+    :param row_height: (int) Row height as a multiple of the module width, 2-8
+    :param error_correction: (int) Error correction level 0-8
+    :return: (bytes) ESC/POS command
+    """
+    payload = data.encode('ascii')
+    return b''.join([
+        b'\x1d(k\x03\x000A' + bytes([columns]),
+        b'\x1d(k\x03\x000C' + bytes([module_width]),
+        b'\x1d(k\x03\x000D' + bytes([row_height]),
+        b'\x1d(k\x04\x000E0' + bytes([48 + error_correction]),
+        b'\x1d(k' + struct.pack('<H', len(payload) + 3) + b'0P0' + payload,
+        b'\x1d(k\x03\x000Q0',
+    ])
+
+
+def escpos_code128(data, height=80, module_width=2):
+    """
+    ESC/POS command (GS k) which makes the printer render the Code 128 symbol (code set C) itself.
+
+    :param data: (string) Even number of digits
+    :param height: (int) Bar height in dots
+    :param module_width: (int) Module width in dots, 2-6
+    :return: (bytes) ESC/POS command
+    """
+    if not data.isdigit() or len(data) % 2:
+        raise ValueError("Code 128 code set C requires an even number of digits")
+
+    payload = b'{C' + bytes(int(data[i:i + 2]) for i in range(0, len(data), 2))
+    return b'\x1dh' + bytes([height]) + b'\x1dw' + bytes([module_width]) + \
+        b'\x1dkI' + bytes([len(payload)]) + payload
@@ -0,0 +1,285 @@
+"""
+Profiling of slow requests.
+
+While a profiled call is in flight a background thread takes stack samples of its thread with
+sys._current_frames(). Phases of the call (validation, signing, transport...) are timed exactly and become the root
+frames of the samples. When the call took longer than the threshold its samples are written in the folded stack
+format read by flamegraph.pl, speedscope and similar tools; otherwise they are thrown away. Calls that finish before
+sample_after are never sampled, so fast calls only pay for timing their phases.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+
+from collections import deque
+
+from furs_fiscal import forksafe
+
+
+logger = logging.getLogger(__name__)
+
+
+class _NullContext(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+def call(profiler, name):
+    """
+    Profile a call, e.g. `with profiling.call(self.profiler, 'send_request'):`. Inside another profiled call it
+    is a phase of that call.
+
+    :param profiler: (SlowRequestProfiler) Profiler or None
+    :param name: (string) Name of the call
+    """
+    if profiler is None:
+        return _NULL_CONTEXT
+    return _Call(profiler, name)
+
+
+def phase(profiler, name):
+    """
+    Time a phase of the profiled call in progress on this thread. Does nothing outside of a profiled call.
+
+    :param profiler: (SlowRequestProfiler) Profiler or None
+    :param name: (string) Name of the phase
+    """
+    if profiler is None:
+        return _NULL_CONTEXT
+    return _Phase(profiler, name)
+
+
+class _ActiveCall(object):
+
+    def __init__(self, name, depth):
+        self.name = name
+        self.depth = depth
+        self.started = time.perf_counter()
+        self.phases = []
+        self.phase_times = {}
+        self.samples = {}
+
+
+class _Call(object):
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.phase = None
+
+    def __enter__(self):
+        if self.profiler._current() is not None:
+            self.phase = _Phase(self.profiler, self.name)
+            return self.phase.__enter__()
+
+        # frames above the caller are not part of the profile
+        depth = 0
+        frame = sys._getframe(1)
+        while frame is not None:
+            depth += 1
+            frame = frame.f_back
+        self.profiler._begin(_ActiveCall(self.name, depth))
+        return self
+
+    def __exit__(self, *args):
+        if self.phase is not None:
+            return self.phase.__exit__(*args)
+        self.profiler._end()
+        return False
+
+
+class _Phase(object):
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.active = None
+
+    def __enter__(self):
+        self.active = self.profiler._current()
+        if self.active is not None:
+            self.active.phases.append(self.name)
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        active = self.active
+        if active is not None:
+            path = ';'.join(active.phases)
+            active.phase_times[path] = active.phase_times.get(path, 0.0) + time.perf_counter() - self.started
+            active.phases.pop()
+        return False
+
+
+class SlowRequestProfiler(object):
+    """
+    SlowRequestProfiler samples stacks of requests in flight and keeps profiles of those slower than threshold.
+
+    Usage:
+        profiler = SlowRequestProfiler(threshold=1.0, directory='/var/log/furs/profiles')
+        api = FURSInvoiceAPI(p12_path, p12_password, profiler=profiler)
+        ...
+        profiler.profiles()[-1]['phases']
+
+    Profiled calls are FURSBaseAPI._send_request with phases validate, rate_limit, post (certificate, sign,
+    transport) and decode, and FURSInvoiceAPI.calculate_zoi with phase sign. Time outside of phases, e.g. waiting
+    for the scheduler, is left at the root of the profile.
+    """
+    def __init__(self, threshold=1.0, interval=0.005, sample_after=0.05, directory=None, keep=20, max_depth=64):
+        """
+        :param threshold: (float) Keep profiles of calls that took longer than this, in seconds
+        :param interval: (float) Seconds between stack samples
+        :param sample_after: (float) Start sampling a call after it ran this long
+        :param directory: (string) Write each slow profile to a .folded file in this directory. Default: None,
+                                   profiles are only kept in memory
+        :param keep: (int) How many recent slow profiles profiles() returns
+        :param max_depth: (int) Innermost stack frames kept per sample
+        """
+        self.threshold = threshold
+        self.interval = interval
+        self.sample_after = sample_after
+        self.directory = directory
+        self.max_depth = max_depth
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._active = {}
+        self._thread = None
+        self._profiles = deque(maxlen=keep)
+        self._counts = dict.fromkeys(('calls', 'slow', 'samples'), 0)
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+        forksafe.register(self)
+
+    def profiles(self):
+        """
+        :return: (list) recent slow profiles, dicts with name, time, elapsed, phases (phase path -> seconds) and
+                        folded (list of folded stack lines)
+        """
+        with self._lock:
+            return list(self._profiles)
+
+    def stats(self):
+        """
+        :return: (dict) profiled calls, slow calls and stack samples taken
+        """
+        with self._lock:
+            return dict(self._counts)
+
+    def _current(self):
+        return self._active.get(threading.get_ident())
+
+    def _begin(self, active):
+        with self._lock:
+            self._active[threading.get_ident()] = active
+            self._counts['calls'] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name='furs-profiler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _end(self):
+        with self._lock:
+            active = self._active.pop(threading.get_ident())
+        elapsed = time.perf_counter() - active.started
+        if elapsed < self.threshold:
+            return
+
+        profile = {
+            'name': active.name,
+            'time': time.time(),
+            'elapsed': elapsed,
+            'phases': active.phase_times,
+            'folded': ['%s %d' % (';'.join((active.name,) + phases + frames), count)
+                       for (phases, frames), count in sorted(active.samples.items())],
+        }
+        with self._lock:
+            self._counts['slow'] += 1
+            self._profiles.append(profile)
+
+        logger.warning("Slow %s took %.3f s: %s", active.name, elapsed,
+                       ', '.join('%s %.3f s' % (path, seconds) for path, seconds in sorted(active.phase_times.items())))
+        if self.directory is not None:
+            self._write(profile)
+
+    def _write(self, profile):
+        path = os.path.join(self.directory, '%s-%d-%d.folded' % (profile['name'], int(profile['time'] * 1000),
+                                                                threading.get_ident()))
+        try:
+            with open(path, 'w') as folded:
+                for line in profile['folded']:
+                    folded.write(line + '\n')
+        except OSError:
+            logger.exception("Writing profile %s failed", path)
+
+    def _sample(self):
+        while True:
+            self._wake.clear()
+            with self._lock:
+                now = time.perf_counter()
+                due = [(ident, active) for ident, active in self._active.items()
+                       if now - active.started >= self.sample_after]
+                if due:
+                    wait = 0
+                elif self._active:
+                    wait = min(active.started for active in self._active.values()) + self.sample_after - now
+                else:
+                    wait = None
+
+            if wait is None:
+                self._wake.wait()
+                continue
+            if wait > 0:
+                # calls starting later are due later, so nothing needs sampling until the oldest call is due
+                self._wake.wait(wait)
+                continue
+
+            # frames are taken and walked outside the lock, so calls starting and ending do not wait for it
+            frames = sys._current_frames()
+            samples = []
+            for ident, active in due:
+                frame = frames.get(ident)
+                if frame is not None:
+                    samples.append((ident, active, (tuple(active.phases), self._stack(frame, active.depth))))
+            del frames, frame
+
+            with self._lock:
+                for ident, active, key in samples:
+                    # a call that ended meanwhile may already be building its profile
+                    if self._active.get(ident) is active:
+                        active.samples[key] = active.samples.get(key, 0) + 1
+                        self._counts['samples'] += 1
+
+            time.sleep(self.interval)
+
+    def _stack(self, frame, depth):
+        """
+        :return: (tuple) frame names from the profiled call inwards, outermost first
+        """
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        # stack holds the frames innermost first, the last depth - 1 of them are above the profiled function
+        stack = stack[:len(stack) - depth + 1]
+        stack.reverse()
+        return tuple(stack[-self.max_depth:])
+
+    def _after_fork(self):
+        # the sampling thread does not exist in the child, it is started again by the first profiled call
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._active = {}
+        self._thread = None
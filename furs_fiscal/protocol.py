@@ -0,0 +1,94 @@
+"""
+Wire format shared by the fiscalization daemon (furs_fiscal.daemon) and its client (furs_fiscal.client).
+
+Arguments are sent as JSON. Values JSON can not represent losslessly are tagged: Decimal amounts keep their
+exact string form (it is part of the ZOI input), datetimes keep their timezone and TaxesPerSeller objects are
+sent as their attributes.
+"""
+import datetime
+import json
+
+from decimal import Decimal
+
+from furs_fiscal.api import TaxesPerSeller
+from furs_fiscal.exceptions import ConnectionException, ConnectionTimedOutException, FURSException, \
+    RateLimitTimeoutException, ValidationException
+from furs_fiscal.validation import SchemaError
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return {'__decimal__': str(value)}
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'__date__': value.isoformat()}
+    if isinstance(value, TaxesPerSeller):
+        return {'__taxes_per_seller__': value.__dict__}
+    raise TypeError("Object of type %s is not JSON serializable" % type(value).__name__)
+
+
+def _object_hook(value):
+    if len(value) == 1:
+        if '__decimal__' in value:
+            return Decimal(value['__decimal__'])
+        if '__datetime__' in value:
+            return datetime.datetime.fromisoformat(value['__datetime__'])
+        if '__date__' in value:
+            return datetime.date.fromisoformat(value['__date__'])
+        if '__taxes_per_seller__' in value:
+            attributes = dict(value['__taxes_per_seller__'])
+            vat_amounts = attributes.pop('vat_amounts', [])
+            taxes_per_seller = TaxesPerSeller(**attributes)
+            taxes_per_seller.vat_amounts = vat_amounts
+            return taxes_per_seller
+    return value
+
+
+def dumps(value):
+    return json.dumps(value, default=_default).encode('utf-8')
+
+
+def loads(content):
+    return json.loads(content, object_hook=_object_hook)
+
+
+# exceptions the client raises again with the same type
+ERROR_TYPES = (FURSException, ConnectionException, RateLimitTimeoutException, ConnectionTimedOutException,
+               ValidationException)
+
+
+def encode_error(exception):
+    """
+    :param exception: (Exception) exception raised by the API
+    :return: (dict) error description to send to the client. Subclasses of known exceptions are sent as the most
+                    specific known class, so the client can still catch them
+    """
+    kind = next((cls for cls in type(exception).__mro__ if cls in ERROR_TYPES), type(exception))
+    error = {'type': kind.__name__, 'message': str(exception)}
+    if isinstance(exception, (FURSException, ConnectionException)):
+        # ConnectionException keeps its code wrapped in a tuple
+        error['code'] = exception.code[0] if isinstance(exception.code, tuple) else exception.code
+        error['message'] = exception.message
+    elif isinstance(exception, ValidationException):
+        error['errors'] = [list(schema_error) for schema_error in exception.errors]
+    return error
+
+
+def decode_error(error):
+    """
+    :param error: (dict) error description received from the daemon
+    :return: (Exception) exception of the same type as raised by the API
+    """
+    kind = error.get('type')
+    if kind == 'FURSException':
+        return FURSException(code=error.get('code'), message=error.get('message'))
+    if kind == 'ConnectionException':
+        return ConnectionException(code=error.get('code'), message=error.get('message'))
+    if kind == 'RateLimitTimeoutException':
+        return RateLimitTimeoutException(error.get('message'))
+    if kind == 'ConnectionTimedOutException':
+        return ConnectionTimedOutException(error.get('message'))
+    if kind == 'ValidationException':
+        return ValidationException([SchemaError(*schema_error) for schema_error in error.get('errors', [])])
+    return Exception("%s: %s" % (kind, error.get('message')))
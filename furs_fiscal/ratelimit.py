@@ -0,0 +1,255 @@
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from furs_fiscal import forksafe
+from furs_fiscal.exceptions import RateLimitTimeoutException
+
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter(object):
+    """
+    Token bucket rate limiter for requests to FURS, with one bucket per certificate and endpoint path.
+
+    Without state_path buckets are shared by all threads in the process. With state_path buckets and limits are
+    kept in a file, so all processes on the host using the same file share them - e.g. a backlog replay in one
+    process and live cashier traffic in another. Access is serialized with flock on state_path + '.lock' and the
+    state file is replaced atomically, so a crash never leaves it half written.
+
+    Usage:
+        limiter = RateLimiter(limits={INVOICE_ISSUE_PATH: (20, 40)}, state_path='/run/furs-fiscal.limits')
+        api = FURSInvoiceAPI(p12_path, p12_password, rate_limiter=limiter)
+    """
+    def __init__(self, limits=None, default_limit=None, state_path=None, max_wait=5.0):
+        """
+        :param limits: (dict) path -> (rate, burst), rate is in requests per second, burst is bucket size. With
+                              state_path, limits already present in the file (e.g. adjusted at runtime by another
+                              process) are kept
+        :param default_limit: (tuple) (rate, burst) for paths without a limit. Default: None, not limited
+        :param state_path: (string) File holding shared state. Default: None, state is kept in this process
+        :param max_wait: (float) How long callers wait for a token by default before giving up
+        """
+        self.default_limit = default_limit
+        self.state_path = state_path
+        self.max_wait = max_wait
+
+        self._lock = threading.Lock()
+        self._state = {'limits': {}, 'buckets': {}}
+        self._lock_file = None
+        # (file identity, limits) of the state file last read or written, lets unlimited paths skip the lock
+        self._known_limits = None
+
+        if state_path is not None:
+            self._lock_file = RateLimiter._open(state_path + '.lock')
+
+        with self._locked_state() as state:
+            for path, limit in (limits or {}).items():
+                if state_path is None or path not in state['limits']:
+                    state['limits'][path] = list(limit)
+
+        forksafe.register(self)
+
+    def set_limit(self, path, rate, burst=None):
+        """
+        Change the limit for a path. With state_path the change is visible to all processes sharing the file.
+
+        :param path: (string) endpoint path, e.g. INVOICE_ISSUE_PATH
+        :param rate: (float) requests per second, None removes the limit
+        :param burst: (int) bucket size. Default: one second worth of requests
+        """
+        with self._locked_state() as state:
+            if rate is None:
+                state['limits'].pop(path, None)
+            else:
+                state['limits'][path] = [rate, burst if burst is not None else max(1, rate)]
+
+    def get_limits(self):
+        """
+        :return: (dict) path -> [rate, burst]
+        """
+        locked_state = self._locked_state()
+        with locked_state as state:
+            locked_state.changed = False
+            return dict(state['limits'])
+
+    def acquire(self, key, path, timeout=None):
+        """
+        Take a token from the bucket for key and path, waiting until one is available.
+
+        :param key: (string) certificate identifier
+        :param path: (string) endpoint path
+        :param timeout: (float) How long to wait. Default: max_wait
+        :return: (float) seconds spent waiting
+
+        :raises
+            RateLimitTimeoutException - no token became available in time
+        """
+        start = time.monotonic()
+        deadline = start + (self.max_wait if timeout is None else timeout)
+
+        while True:
+            wait = self._take(key, path)
+            if wait <= 0:
+                return time.monotonic() - start
+
+            remaining = deadline - time.monotonic()
+            if wait > remaining:
+                raise RateLimitTimeoutException("Rate limit for %s exceeded, waited %.2f s" %
+                                                (path, time.monotonic() - start))
+            time.sleep(wait)
+
+    def _take(self, key, path):
+        """
+        :return: (float) 0 if a token was taken, otherwise seconds until the next token is available
+        """
+        if self._unlimited(path):
+            return 0
+
+        locked_state = self._locked_state()
+        with locked_state as state:
+            limit = state['limits'].get(path, self.default_limit)
+            if limit is None:
+                locked_state.changed = False
+                return 0
+            rate, burst = limit
+
+            # wall clock time, monotonic clocks are not comparable between processes
+            now = time.time()
+            bucket_key = '%s %s' % (key, path)
+            tokens, updated = state['buckets'].get(bucket_key, (burst, now))
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+
+            if tokens >= 1:
+                state['buckets'][bucket_key] = (tokens - 1, now)
+                return 0
+
+            # below one token the bucket never reaches burst, refilling it later from the stored state is the same
+            locked_state.changed = False
+            return (1 - tokens) / rate
+
+    def _unlimited(self, path):
+        """
+        :return: (boolean) True if path is known to have no limit, checked without locking or reading the state
+        """
+        if self.default_limit is not None:
+            return False
+        if self.state_path is None:
+            return path not in self._state['limits']
+
+        known_limits = self._known_limits
+        if known_limits is None or path in known_limits[1]:
+            return False
+        try:
+            # replaced atomically on every change, a different file means limits may have changed
+            return RateLimiter._identity(os.stat(self.state_path)) == known_limits[0]
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def _identity(stat):
+        return stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _locked_state(self):
+        return _LockedState(self)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        if self._lock_file is not None:
+            # flock locks belong to the open file, which is shared with the parent after fork - open it again so
+            # the processes exclude each other
+            self._lock_file.close()
+            self._lock_file = RateLimiter._open(self.state_path + '.lock')
+
+    @staticmethod
+    def _open(path):
+        return os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o600), 'r+')
+
+    def _read_state(self):
+        identity = None
+        try:
+            with open(self.state_path) as state_file:
+                identity = RateLimiter._identity(os.fstat(state_file.fileno()))
+                content = state_file.read()
+        except FileNotFoundError:
+            content = ''
+
+        try:
+            state = json.loads(content) if content else {}
+        except ValueError:
+            # buckets refill on their own, losing them is better than failing every request
+            logger.warning("Rate limiter state %s is corrupt, starting with empty state", self.state_path)
+            state = {}
+        if not isinstance(state, dict):
+            state = {}
+        state.setdefault('limits', {})
+        state.setdefault('buckets', {})
+        self._known_limits = (identity, set(state['limits'])) if identity is not None else None
+        return state
+
+    def _write_state(self):
+        directory = os.path.dirname(os.path.abspath(self.state_path))
+        descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.ratelimit-')
+        try:
+            with os.fdopen(descriptor, 'w') as state_file:
+                json.dump(self._state, state_file)
+                state_file.flush()
+                identity = RateLimiter._identity(os.fstat(state_file.fileno()))
+            os.chmod(temp_path, 0o600)
+            os.replace(temp_path, self.state_path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+        self._known_limits = (identity, set(self._state['limits']))
+
+    def close(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+class _LockedState(object):
+    """
+    Context manager holding the thread lock and, with a state file, an exclusive flock on the lock file. The state
+    is read on enter and written back on exit, unless changed was set to False.
+    """
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.changed = True
+
+    def __enter__(self):
+        limiter = self.limiter
+        limiter._lock.acquire()
+        lock_file = limiter._lock_file
+        if lock_file is None:
+            return limiter._state
+
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                limiter._state = limiter._read_state()
+            except BaseException:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                raise
+        except BaseException:
+            # __exit__ is not called when __enter__ fails, neither lock may stay held
+            limiter._lock.release()
+            raise
+        return limiter._state
+
+    def __exit__(self, *args):
+        lock_file = self.limiter._lock_file
+        try:
+            if lock_file is not None:
+                try:
+                    if self.changed:
+                        self.limiter._write_state()
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            self.limiter._lock.release()
@@ -0,0 +1,203 @@
+"""
+Replay traffic recorded with TrafficCapture against a local FURS simulator, to see how the library holds up under
+a real day's traffic shape at higher speed.
+
+Requests are sent open-loop: each one starts at its recorded time divided by speed, whether or not earlier
+requests have finished, and latency is measured from that scheduled time. Invoices go through FURSInvoiceAPI
+with ZOI, validation, signing and the transport, like live traffic.
+
+    FURS_P12_PASSWORD=secret furs-fiscal-replay traffic.jsonl --p12 my_cert.p12 --speed 20
+"""
+import argparse
+import copy
+import math
+import os
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from furs_fiscal.api import FURSInvoiceAPI
+from furs_fiscal.capture import load_capture
+from furs_fiscal.scheduler import PRIORITY_ADMIN, PRIORITY_BULK, PRIORITY_INTERACTIVE, PRIORITY_SUBSEQUENT
+from furs_fiscal.simulator import SimulatorServer
+from furs_fiscal.transport import LoopbackTransport
+
+
+class Replay(object):
+    """
+    Replay recorded requests through an API object.
+
+    Usage:
+        replay = Replay(api, load_capture('traffic.jsonl'), speed=20)
+        result = replay.run()
+    """
+    def __init__(self, api, records, speed=1.0, workers=64):
+        """
+        :param api: (FURSInvoiceAPI) API sending the requests
+        :param records: (list) Records from load_capture
+        :param speed: (float) How many times faster than recorded to send the requests
+        :param workers: (int) How many requests may be in progress at the same time
+        """
+        self.api = api
+        self.records = records
+        self.speed = speed
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self._latencies = []
+        self._errors = {}
+
+    def run(self):
+        """
+        Send all requests and wait for them to finish.
+
+        :return: (dict) requests, errors (exception name -> count), duration, offered_rate and throughput in
+                        requests per second, max_dispatch_lag and latency percentiles in seconds
+        """
+        if not self.records:
+            raise ValueError("Nothing to replay")
+
+        first = self.records[0]['time']
+        max_lag = 0.0
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            start = time.perf_counter()
+            for record in self.records:
+                scheduled = start + (record['time'] - first) / self.speed
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                max_lag = max(max_lag, time.perf_counter() - scheduled)
+                executor.submit(self._send, record, scheduled)
+        duration = time.perf_counter() - start
+
+        span = (self.records[-1]['time'] - first) / self.speed
+        latencies = sorted(self._latencies)
+
+        return {
+            'requests': len(self.records),
+            'errors': dict(self._errors),
+            'duration': duration,
+            'offered_rate': len(self.records) / span if span > 0 else None,
+            'throughput': len(latencies) / duration,
+            'max_dispatch_lag': max_lag,
+            'latency': dict((name, percentile(latencies, value)) for name, value in (('p50', 50), ('p90', 90),
+                                                                                     ('p99', 99), ('p99.9', 99.9),
+                                                                                     ('max', 100))),
+        }
+
+    def _send(self, record, scheduled):
+        try:
+            self._replay_request(record)
+        except Exception as e:
+            with self._lock:
+                self._errors[type(e).__name__] = self._errors.get(type(e).__name__, 0) + 1
+            return
+
+        latency = time.perf_counter() - scheduled
+        with self._lock:
+            self._latencies.append(latency)
+
+    def _replay_request(self, record):
+        payload = copy.deepcopy(record['payload'])
+        if 'InvoiceRequest' not in payload:
+            self.api._send_request(path=record['path'], data=payload, priority=PRIORITY_ADMIN)
+            return
+
+        request = payload['InvoiceRequest']
+        request['Header'] = FURSInvoiceAPI._prepare_invoice_request_header()
+
+        if 'SalesBookInvoice' in request:
+            self.api._issue_invoice(payload, PRIORITY_BULK)
+            return
+
+        # the recorded ZOI was signed with the original certificate, calculate it again like a live checkout would
+        invoice = request['Invoice']
+        self.api._recalculate_zoi(invoice)
+
+        self.api._issue_invoice(payload, PRIORITY_SUBSEQUENT if invoice.get('SubsequentSubmit') else
+                                PRIORITY_INTERACTIVE)
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile.
+
+    :param values: (list) Sorted values
+    :param percent: (float) Percentile between 0 and 100
+    :return: value or None if values is empty
+    """
+    if not values:
+        return None
+    rank = max(1, int(math.ceil(percent / 100.0 * len(values))))
+    return values[min(rank, len(values)) - 1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='furs-fiscal-replay',
+                                     description='Replay captured FURS traffic against a local simulator.')
+    parser.add_argument('capture', help='file written by TrafficCapture')
+    parser.add_argument('--p12', required=True, help='path to the .p12 certificate')
+    parser.add_argument('--password-env', default='FURS_P12_PASSWORD',
+                        help='environment variable holding the .p12 password (default: FURS_P12_PASSWORD)')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed, e.g. 1 to 50 (default: 1)')
+    parser.add_argument('--workers', type=int, default=64, help='requests in progress at the same time')
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated FURS processing time in seconds')
+    parser.add_argument('--endpoint', help='send to this server instead of starting a simulator')
+    parser.add_argument('--loopback', action='store_true', help='call the simulator in-process, without HTTP')
+    parser.add_argument('--timeout', type=float, default=2.0, help='request timeout in seconds')
+    parser.add_argument('--pool-size', type=int, default=10, help='connections to keep open')
+    args = parser.parse_args(argv)
+
+    if args.speed <= 0:
+        parser.error("speed must be positive")
+
+    password = os.environ.get(args.password_env)
+    if password is None:
+        parser.error("environment variable %s is not set" % args.password_env)
+
+    records = load_capture(args.capture)
+    if not records:
+        parser.error("%s contains no requests" % args.capture)
+
+    simulator = None
+    endpoint = args.endpoint
+    transport = None
+    if args.loopback:
+        transport = LoopbackTransport()
+        transport.simulator.latency = args.latency
+    elif endpoint is None:
+        simulator = SimulatorServer(latency=args.latency)
+        simulator.start()
+        endpoint = simulator.endpoint
+
+    try:
+        api = FURSInvoiceAPI(p12_path=args.p12,
+                             p12_password=password,
+                             request_timeout=args.timeout,
+                             pool_size=args.pool_size,
+                             endpoint=endpoint,
+                             transport=transport)
+
+        result = Replay(api, records, speed=args.speed, workers=args.workers).run()
+    finally:
+        if simulator is not None:
+            simulator.stop()
+
+    sys.stdout.write("requests      %d\n" % result['requests'])
+    sys.stdout.write("errors        %s\n" % (', '.join('%s: %d' % error for error in sorted(result['errors'].items()))
+                                             or 0))
+    sys.stdout.write("duration      %.2f s\n" % result['duration'])
+    if result['offered_rate'] is not None:
+        sys.stdout.write("offered       %.1f req/s\n" % result['offered_rate'])
+    sys.stdout.write("throughput    %.1f req/s\n" % result['throughput'])
+    sys.stdout.write("dispatch lag  %.1f ms\n" % (result['max_dispatch_lag'] * 1000))
+    for name, value in result['latency'].items():
+        if value is not None:
+            sys.stdout.write("%-13s %.1f ms\n" % (name, value * 1000))
+
+
+if __name__ == '__main__':
+    main()
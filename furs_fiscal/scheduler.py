@@ -0,0 +1,206 @@
+import threading
+import time
+
+from contextlib import contextmanager
+
+from requests.exceptions import Timeout
+
+from furs_fiscal import forksafe
+
+
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_SUBSEQUENT = 'subsequent'
+PRIORITY_BULK = 'bulk'
+PRIORITY_ADMIN = 'admin'
+
+DEFAULT_WEIGHTS = {
+    PRIORITY_INTERACTIVE: 8,
+    PRIORITY_SUBSEQUENT: 3,
+    PRIORITY_ADMIN: 2,
+    PRIORITY_BULK: 1,
+}
+
+
+class _Ticket(object):
+    __slots__ = ('priority', 'finish', 'sequence', 'enqueued', 'granted')
+
+    def __init__(self, priority, finish, sequence, enqueued):
+        self.priority = priority
+        self.finish = finish
+        self.sequence = sequence
+        self.enqueued = enqueued
+        self.granted = False
+
+
+class PriorityScheduler(object):
+    """
+    PriorityScheduler shares a limited number of concurrent FURS requests between priority classes, so live
+    checkout requests are not stuck behind subsequent submits, sales book uploads or premise registrations.
+
+    Waiting requests are served with weighted fair queuing - each class gets a share of the request slots
+    proportional to its weight. When latency of interactive requests rises above the target, bulk requests
+    are admitted only to half of the slots until it recovers. Requests already sent are never interrupted.
+
+    Usage:
+        api = FURSInvoiceAPI(p12_path, p12_password, scheduler=PriorityScheduler(max_concurrency=4))
+    """
+    def __init__(self, max_concurrency=4, weights=None, interactive_latency_target=0.5, smoothing=0.2):
+        """
+        :param max_concurrency: (int) How many requests may be sent to FURS at the same time
+        :param weights: (dict) priority -> weight. Default: DEFAULT_WEIGHTS
+        :param interactive_latency_target: (float) Seconds of interactive latency (wait and request) above which
+                                                   bulk requests are held back
+        :param smoothing: (float) Weight of the latest sample in moving averages, between 0 and 1
+        """
+        self.max_concurrency = max_concurrency
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+        self.interactive_latency_target = interactive_latency_target
+        self.smoothing = smoothing
+
+        self._condition = threading.Condition()
+        self._queue = []
+        self._sequence = 0
+        self._virtual_time = 0.0
+        self._last_finish = dict((priority, 0.0) for priority in self.weights)
+        self._in_flight = dict((priority, 0) for priority in self.weights)
+        self._interactive_latency = 0.0
+        self._stats = dict((priority, {'completed': 0, 'wait_total': 0.0, 'wait_max': 0.0, 'wait_average': 0.0})
+                           for priority in self.weights)
+
+        forksafe.register(self)
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_INTERACTIVE, timeout=None):
+        """
+        Context manager which waits for a request slot for the given priority and holds it until exit.
+
+        :param priority: (string) one of PRIORITY_* constants
+        :param timeout: (float) Seconds to wait for the slot, see acquire. Default: None, wait as long as it takes
+        """
+        started = time.monotonic()
+        self.acquire(priority, timeout=timeout)
+        try:
+            yield
+        finally:
+            self.release(priority, started)
+
+    def acquire(self, priority, timeout=None):
+        """
+        Wait for a request slot. Every acquire must be followed by release.
+
+        :param priority: (string) one of PRIORITY_* constants
+        :param timeout: (float) Seconds to wait for the slot. Default: None, wait as long as it takes
+        :return: (float) seconds spent waiting
+
+        :raises
+            requests.exceptions.Timeout - no slot became free within timeout, the request was taken off the queue
+        """
+        if priority not in self.weights:
+            raise ValueError("Unknown priority: %s" % priority)
+
+        with self._condition:
+            enqueued = time.monotonic()
+            finish = max(self._virtual_time, self._last_finish[priority]) + 1.0 / self.weights[priority]
+            self._last_finish[priority] = finish
+            self._sequence += 1
+            ticket = _Ticket(priority, finish, self._sequence, enqueued)
+            self._queue.append(ticket)
+
+            self._dispatch()
+            deadline = enqueued + timeout if timeout is not None else None
+            try:
+                while not ticket.granted:
+                    if deadline is None:
+                        self._condition.wait()
+                        continue
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise Timeout("No %s request slot became free within %.2f s" % (priority, timeout))
+                    self._condition.wait(remaining)
+            except BaseException:
+                # timed out or interrupted, a ticket left in the queue would block the requests behind it
+                self._abandon(ticket)
+                raise
+
+            wait = time.monotonic() - enqueued
+            stats = self._stats[priority]
+            stats['wait_total'] += wait
+            stats['wait_max'] = max(stats['wait_max'], wait)
+            stats['wait_average'] += self.smoothing * (wait - stats['wait_average'])
+
+            return wait
+
+    def release(self, priority, started=None):
+        """
+        Release a request slot.
+
+        :param priority: (string) priority used in acquire
+        :param started: (float) time.monotonic() when the caller started waiting, used to track interactive latency
+        """
+        with self._condition:
+            self._in_flight[priority] -= 1
+            self._stats[priority]['completed'] += 1
+
+            if priority == PRIORITY_INTERACTIVE and started is not None:
+                latency = time.monotonic() - started
+                self._interactive_latency += self.smoothing * (latency - self._interactive_latency)
+
+            self._dispatch()
+
+    def stats(self):
+        """
+        :return: (dict) per priority: queued, in_flight, completed, wait_total, wait_max and wait_average (moving
+                        average of seconds spent waiting for a slot), plus interactive_latency moving average
+        """
+        with self._condition:
+            result = {}
+            for priority, stats in self._stats.items():
+                result[priority] = dict(stats,
+                                        queued=sum(1 for ticket in self._queue if ticket.priority == priority),
+                                        in_flight=self._in_flight[priority])
+            result['interactive_latency'] = self._interactive_latency
+            return result
+
+    def _after_fork(self):
+        # requests queued or in flight belong to threads of the parent process
+        self._condition = threading.Condition()
+        self._queue = []
+        self._in_flight = dict((priority, 0) for priority in self.weights)
+
+    def _abandon(self, ticket):
+        """
+        Withdraw a ticket whose caller stopped waiting, or give back its slot if it was granted meanwhile. Must hold
+        the condition.
+        """
+        if ticket.granted:
+            self._in_flight[ticket.priority] -= 1
+        else:
+            self._queue.remove(ticket)
+        self._dispatch()
+
+    def _bulk_limit(self):
+        if self._interactive_latency > self.interactive_latency_target:
+            return max(1, self.max_concurrency // 2)
+        return self.max_concurrency
+
+    def _dispatch(self):
+        """
+        Grant free slots to queued tickets with the lowest virtual finish time. Must hold the condition.
+        """
+        granted = False
+        while self._queue and sum(self._in_flight.values()) < self.max_concurrency:
+            bulk_allowed = self._in_flight[PRIORITY_BULK] < self._bulk_limit() if PRIORITY_BULK in self.weights \
+                else True
+            candidates = [ticket for ticket in self._queue if ticket.priority != PRIORITY_BULK or bulk_allowed]
+            if not candidates:
+                break
+
+            ticket = min(candidates, key=lambda candidate: (candidate.finish, candidate.sequence))
+            self._queue.remove(ticket)
+            self._virtual_time = max(self._virtual_time, ticket.finish - 1.0 / self.weights[ticket.priority])
+            self._in_flight[ticket.priority] += 1
+            ticket.granted = True
+            granted = True
+
+        if granted:
+            self._condition.notify_all()
@@ -0,0 +1,359 @@
+"""
+Gap and duplicate detection in invoice numbering.
+
+Invoice numbers of every electronic device (or premise, with central numbering) and of every sales book set must
+run without gaps and without repeating. Each sequence is kept as a sorted list of runs of consecutive numbers, so
+a device that issued a million invoices in order takes a single run, and the next invoice only extends the last
+run. The runs are small enough to save the whole state to a JSON file every few seconds.
+"""
+import atexit
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import weakref
+
+from collections import deque
+
+from furs_fiscal import forksafe
+from furs_fiscal.listeners import InvoiceListener
+
+
+logger = logging.getLogger(__name__)
+
+RESULT_FIRST = 'first'
+RESULT_NEXT = 'next'
+RESULT_GAP = 'gap'
+RESULT_FILLED = 'filled'
+RESULT_DUPLICATE = 'duplicate'
+RESULT_INVALID = 'invalid'
+
+KIND_INVOICE = 'invoice'
+KIND_SALES_BOOK = 'sales_book'
+
+STATE_VERSION = 1
+
+
+class NumberRuns(object):
+    """
+    Set of integers stored as sorted runs of consecutive numbers.
+    """
+    def __init__(self, runs=()):
+        self.starts = [start for start, _ in runs]
+        self.ends = [end for _, end in runs]
+        self.duplicates = {}
+
+    def add(self, number):
+        """
+        :param number: (int) Number to add
+        :return: (string) one of RESULT_FIRST, RESULT_NEXT, RESULT_GAP, RESULT_FILLED, RESULT_DUPLICATE
+        """
+        ends = self.ends
+        if not ends:
+            self.starts.append(number)
+            ends.append(number)
+            return RESULT_FIRST
+
+        last = ends[-1]
+        if number == last + 1:
+            ends[-1] = number
+            return RESULT_NEXT
+        if number > last:
+            self.starts.append(number)
+            ends.append(number)
+            return RESULT_GAP
+
+        # out of order, find the run starting at or before the number
+        index = bisect.bisect_right(self.starts, number) - 1
+        if index >= 0 and number <= ends[index]:
+            self.duplicates[number] = self.duplicates.get(number, 1) + 1
+            return RESULT_DUPLICATE
+
+        joins_previous = index >= 0 and ends[index] == number - 1
+        joins_next = self.starts[index + 1] == number + 1
+        if joins_previous and joins_next:
+            ends[index] = ends[index + 1]
+            del self.starts[index + 1]
+            del ends[index + 1]
+        elif joins_previous:
+            ends[index] = number
+        elif joins_next:
+            self.starts[index + 1] = number
+        else:
+            self.starts.insert(index + 1, number)
+            ends.insert(index + 1, number)
+        return RESULT_FILLED
+
+    def gaps(self, first_number=None):
+        """
+        :param first_number: (int) Number the sequence should start with. Default: None, the lowest number seen
+        :return: (list) (first, last) missing number ranges
+        """
+        gaps = []
+        if first_number is not None and self.starts and self.starts[0] > first_number:
+            gaps.append((first_number, self.starts[0] - 1))
+        for end, start in zip(self.ends, self.starts[1:]):
+            gaps.append((end + 1, start - 1))
+        return gaps
+
+    def runs(self):
+        return list(zip(self.starts, self.ends))
+
+    def __contains__(self, number):
+        index = bisect.bisect_right(self.starts, number) - 1
+        return index >= 0 and number <= self.ends[index]
+
+    def __len__(self):
+        return sum(end - start + 1 for start, end in zip(self.starts, self.ends))
+
+
+class SequenceTracker(InvoiceListener):
+    """
+    SequenceTracker follows invoice numbers of every device and sales book set and reports gaps and duplicates as
+    invoices are issued, instead of searching for them in the database afterwards.
+
+    Usage:
+        tracker = SequenceTracker('/var/lib/furs/sequences.json')
+        api = FURSInvoiceAPI(p12_path, p12_password, listeners=[tracker])
+        ...
+        tracker.gaps()
+        tracker.duplicates()
+
+    Sequences are identified by a key tuple - (KIND_INVOICE, premise, device), (KIND_INVOICE, premise) with
+    central numbering, or (KIND_SALES_BOOK, premise, set number, serial number) - with the issue year appended
+    when yearly is True. Invoices issued before the tracker was used can be added with add_invoice and
+    add_sales_book_invoice.
+
+    Invoices issued concurrently often arrive slightly out of order, so a gap is only logged when it is still open
+    gap_grace seconds after it appeared. gaps() reports every gap open right now. Changed state is saved at exit.
+
+    With a pre-fork server every worker has its own tracker after the fork, so each of them should save to its
+    own path.
+    """
+    def __init__(self, path=None, first_number=None, yearly=False, save_interval=10.0, gap_grace=5.0):
+        """
+        :param path: (string) JSON file the state is saved to and loaded from on start. Default: None, state is
+                              kept in memory only
+        :param first_number: (int) Number every sequence starts with, so missing first invoices are reported too.
+                                   Default: None, a sequence starts with the lowest number seen
+        :param yearly: (boolean) Numbering starts again every year, the issue year is part of the sequence key
+        :param save_interval: (float) Save changed state at most this often, in seconds. 0 saves after every
+                                      invoice
+        :param gap_grace: (float) Seconds a gap has to stay open before it is logged
+        """
+        self.path = path
+        self.first_number = first_number
+        self.yearly = yearly
+        self.save_interval = save_interval
+        self.gap_grace = gap_grace
+
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._sequences = {}
+        self._invalid = 0
+        self._dirty = False
+        self._saved = time.monotonic()
+        # (deadline, key, first, last) of gaps to log if still open, deadlines only grow
+        self._pending_gaps = deque()
+
+        if path is not None and os.path.exists(path):
+            self._load(path)
+
+        atexit.register(_close_at_exit, weakref.ref(self))
+        forksafe.register(self)
+
+    def invoice_issued(self, message, eor):
+        request = message['InvoiceRequest']
+        if 'Invoice' in request:
+            invoice = request['Invoice']
+            identifier = invoice['InvoiceIdentifier']
+            self.add_invoice(business_premise_id=identifier['BusinessPremiseID'],
+                             electronic_device_id=identifier['ElectronicDeviceID'],
+                             invoice_number=identifier['InvoiceNumber'],
+                             year=invoice['IssueDateTime'][:4],
+                             central=invoice.get('NumberingStructure') == 'C')
+        else:
+            invoice = request['SalesBookInvoice']
+            identifier = invoice['SalesBookIdentifier']
+            self.add_sales_book_invoice(business_premise_id=invoice['BusinessPremiseID'],
+                                        set_number=identifier['SetNumber'],
+                                        serial_number=identifier['SerialNumber'],
+                                        invoice_number=identifier['InvoiceNumber'],
+                                        year=invoice['IssueDate'][:4])
+
+    def add_invoice(self, business_premise_id, electronic_device_id, invoice_number, year=None, central=False):
+        """
+        Add an issued invoice.
+
+        :param business_premise_id: (string) Premise ID
+        :param electronic_device_id: (string) Electronic device ID, ignored with central numbering
+        :param invoice_number: (string) Invoice number
+        :param year: (int) Issue year, only used when yearly is True
+        :param central: (boolean) Invoice is numbered centrally for the whole premise
+        :return: (string) RESULT_* constant
+        """
+        if central:
+            key = (KIND_INVOICE, str(business_premise_id))
+        else:
+            key = (KIND_INVOICE, str(business_premise_id), str(electronic_device_id))
+        return self._add(key, invoice_number, year)
+
+    def add_sales_book_invoice(self, business_premise_id, set_number, serial_number, invoice_number, year=None):
+        """
+        Add an issued sales book invoice.
+
+        :return: (string) RESULT_* constant
+        """
+        key = (KIND_SALES_BOOK, str(business_premise_id), str(set_number), str(serial_number))
+        return self._add(key, invoice_number, year)
+
+    def gaps(self):
+        """
+        :return: (dict) sequence key -> list of (first, last) missing number ranges, only sequences with gaps
+        """
+        with self._lock:
+            result = {}
+            for key, runs in self._sequences.items():
+                gaps = runs.gaps(self.first_number)
+                if gaps:
+                    result[key] = gaps
+            return result
+
+    def duplicates(self):
+        """
+        :return: (dict) sequence key -> {number: times issued}, only sequences with duplicates
+        """
+        with self._lock:
+            return dict((key, dict(runs.duplicates)) for key, runs in self._sequences.items() if runs.duplicates)
+
+    def stats(self):
+        """
+        :return: (dict) sequences, runs, missing and duplicate numbers, and invalid (non numeric) invoice numbers
+        """
+        with self._lock:
+            sequences = list(self._sequences.values())
+            return {
+                'sequences': len(sequences),
+                'runs': sum(len(runs.starts) for runs in sequences),
+                'missing': sum(last - first + 1 for runs in sequences for first, last in runs.gaps(self.first_number)),
+                'duplicates': sum(count - 1 for runs in sequences for count in runs.duplicates.values()),
+                'invalid': self._invalid,
+            }
+
+    def save(self):
+        """
+        Write the state to path. The file is replaced atomically, a crash leaves the previous state.
+        """
+        if self.path is None:
+            return
+
+        with self._save_lock:
+            self._save()
+
+    def _save(self):
+        with self._lock:
+            state = {
+                'version': STATE_VERSION,
+                'invalid': self._invalid,
+                'sequences': [{'key': list(key),
+                               'runs': runs.runs(),
+                               'duplicates': sorted(runs.duplicates.items())}
+                              for key, runs in self._sequences.items()],
+            }
+            self._dirty = False
+            self._saved = time.monotonic()
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.sequences-')
+        try:
+            with os.fdopen(descriptor, 'w') as state_file:
+                json.dump(state, state_file, separators=(',', ':'))
+            os.replace(temp_path, self.path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+    def close(self):
+        """
+        Log gaps still waiting for gap_grace and save changed state. Called at exit.
+        """
+        self._log_open_gaps(None)
+        if self._dirty:
+            self.save()
+
+    def _add(self, key, invoice_number, year):
+        if self.yearly:
+            key += (str(year),)
+
+        try:
+            number = int(invoice_number)
+        except (TypeError, ValueError):
+            with self._lock:
+                self._invalid += 1
+            logger.warning("Invoice number %r of %s is not a number", invoice_number, '/'.join(key))
+            return RESULT_INVALID
+
+        now = time.monotonic()
+        with self._lock:
+            runs = self._sequences.get(key)
+            if runs is None:
+                runs = self._sequences[key] = NumberRuns()
+            last = runs.ends[-1] if runs.ends else None
+            result = runs.add(number)
+            if result == RESULT_GAP:
+                self._pending_gaps.append((now + self.gap_grace, key, last + 1, number - 1))
+            self._dirty = True
+            save = self.path is not None and now - self._saved >= self.save_interval
+
+        if result == RESULT_DUPLICATE:
+            logger.warning("Invoice number %d of %s was issued again", number, '/'.join(key))
+        if self._pending_gaps and self._pending_gaps[0][0] <= now:
+            self._log_open_gaps(now)
+
+        if save:
+            self.save()
+        return result
+
+    def _log_open_gaps(self, now):
+        """
+        Log the parts of pending gaps which are still open, for gaps older than gap_grace or all of them if now is
+        None.
+        """
+        missing = []
+        with self._lock:
+            while self._pending_gaps and (now is None or self._pending_gaps[0][0] <= now):
+                _, key, first, last = self._pending_gaps.popleft()
+                for gap_first, gap_last in self._sequences[key].gaps():
+                    if gap_first <= last and gap_last >= first:
+                        missing.append((key, max(first, gap_first), min(last, gap_last)))
+
+        for key, first, last in missing:
+            if first == last:
+                logger.warning("Invoice number %d of %s is missing", first, '/'.join(key))
+            else:
+                logger.warning("Invoice numbers %d to %d of %s are missing", first, last, '/'.join(key))
+
+    def _load(self, path):
+        with open(path) as state_file:
+            state = json.load(state_file)
+        if state.get('version') != STATE_VERSION:
+            raise ValueError("Unsupported sequence state version %r in %s" % (state.get('version'), path))
+
+        self._invalid = state['invalid']
+        for sequence in state['sequences']:
+            runs = NumberRuns(sequence['runs'])
+            runs.duplicates = dict((number, count) for number, count in sequence['duplicates'])
+            self._sequences[tuple(sequence['key'])] = runs
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+
+def _close_at_exit(tracker_ref):
+    tracker = tracker_ref()
+    if tracker is not None:
+        tracker.close()
@@ -0,0 +1,224 @@
+"""
+Shadow mode: send a copy of production requests to the FURS test server and compare the outcomes.
+
+Production requests are put on a bounded queue after FURS answered them and a background thread sends them again
+through a second API object, signed with the test certificate. Production calls never wait for the shadow - when
+the queue is full the copy is dropped. Differences in outcome (EOR versus an error, or different error codes) are
+recorded, and latency of both paths is kept in histograms.
+"""
+import copy
+import json
+import logging
+import queue
+import threading
+import time
+
+from collections import deque
+
+from furs_fiscal import forksafe
+from furs_fiscal.api import FURSBusinessPremiseAPI, FURSInvoiceAPI
+from furs_fiscal.exceptions import ConnectionException, FURSException
+from furs_fiscal.scheduler import PRIORITY_BULK
+from furs_fiscal.timeouts import LatencyHistogram
+
+
+logger = logging.getLogger(__name__)
+
+OUTCOME_OK = 'ok'
+
+
+class ShadowMirror(object):
+    """
+    ShadowMirror mirrors requests of a production API to an API connected to the FURS test server.
+
+    Usage:
+        test_api = FURSInvoiceAPI(p12_path='test_cert.p12', p12_password='test_pass', production=False)
+        shadow = ShadowMirror(test_api, tax_number=10039856)
+        api = FURSInvoiceAPI(p12_path, p12_password, shadow=shadow)
+        ...
+        shadow.stats()
+        shadow.diffs()
+
+    Business premises used by mirrored invoices have to be registered on the test server with the test tax number.
+    """
+    def __init__(self, api, capacity=1000, tax_number=None, path=None, keep_diffs=100, window=300.0):
+        """
+        :param api: (FURSInvoiceAPI) API sending the copies, created with production=False and the test certificate
+        :param capacity: (int) How many requests may wait for the shadow thread. Further requests are dropped
+        :param tax_number: (int) Tax number of the test certificate, replaces the tax number of mirrored requests.
+                                 Default: None, tax number is not changed
+        :param path: (string) Append every difference to this file as a JSON line. Default: None
+        :param keep_diffs: (int) How many recent differences diffs() returns
+        :param window: (float) Seconds of latency history, see LatencyHistogram
+        """
+        self.api = api
+        self.capacity = capacity
+        self.tax_number = tax_number
+        self.path = path
+        self.window = window
+
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=capacity)
+        self._thread = None
+        self._file = open(path, 'a') if path is not None else None
+        self._diffs = deque(maxlen=keep_diffs)
+        self._counts = dict.fromkeys(('mirrored', 'dropped', 'matched', 'different', 'failed'), 0)
+        self._latency = {'production': LatencyHistogram(window=window), 'shadow': LatencyHistogram(window=window)}
+
+        forksafe.register(self)
+
+    def mirror(self, path, data, result, elapsed):
+        """
+        Queue a copy of a production request. Never blocks.
+
+        :param path: (string) Endpoint path
+        :param data: (dict) Request payload sent to production, copied so the caller may change it afterwards
+        :param result: (dict or Exception) Decoded production response, or the exception raised instead
+        :param elapsed: (float) Seconds the production request took
+        :return: (boolean) False if the copy was dropped
+        """
+        if self._thread is None:
+            self._start()
+
+        try:
+            # copied now, the caller may change data as soon as this returns - but not when it would be dropped
+            if self._queue.full():
+                raise queue.Full()
+            self._queue.put_nowait((path, copy.deepcopy(data), ShadowMirror._outcome(result), elapsed))
+        except queue.Full:
+            with self._lock:
+                self._counts['dropped'] += 1
+            return False
+        return True
+
+    def stats(self):
+        """
+        :return: (dict) mirrored, dropped, matched, different and failed (copy could not be prepared) counts,
+                        queued requests, and p50/p99 latency in seconds of production and shadow requests
+        """
+        with self._lock:
+            stats = dict(self._counts)
+            stats['queued'] = self._queue.qsize()
+            for name, histogram in self._latency.items():
+                stats[name] = {'p50': histogram.percentile(50), 'p99': histogram.percentile(99)}
+        return stats
+
+    def diffs(self):
+        """
+        :return: (list) recent differences, dicts with time, path, production and shadow outcome and latency
+        """
+        with self._lock:
+            return list(self._diffs)
+
+    def close(self, timeout=None):
+        """
+        Send requests still in the queue and stop the shadow thread.
+
+        :param timeout: (float) Seconds to wait for the queue to drain
+        """
+        thread = self._thread
+        if thread is not None:
+            self._queue.put(None, timeout=timeout)
+            thread.join(timeout)
+            self._thread = None
+
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='furs-shadow', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                self._send(*item)
+            except Exception:
+                logger.exception("Preparing shadow request failed")
+                with self._lock:
+                    self._counts['failed'] += 1
+
+    def _send(self, path, data, production, production_elapsed):
+        payload = self._prepare(data)
+
+        started = time.perf_counter()
+        try:
+            result = self.api._send_request(path=path, data=payload, priority=PRIORITY_BULK)
+        except Exception as e:
+            result = e
+        elapsed = time.perf_counter() - started
+        shadow = ShadowMirror._outcome(result)
+
+        with self._lock:
+            self._counts['mirrored'] += 1
+            self._latency['production'].record(production_elapsed)
+            self._latency['shadow'].record(elapsed)
+            if shadow == production:
+                self._counts['matched'] += 1
+                return
+
+            self._counts['different'] += 1
+            diff = {
+                'time': time.time(),
+                'path': path,
+                'production': production,
+                'shadow': shadow,
+                'production_elapsed': production_elapsed,
+                'shadow_elapsed': elapsed,
+            }
+            self._diffs.append(diff)
+            if self._file is not None:
+                self._file.write(json.dumps(diff) + '\n')
+                self._file.flush()
+
+        logger.info("Shadow request to %s returned %s, production returned %s", path, shadow, production)
+
+    def _prepare(self, payload):
+        """
+        Change a copied production payload to a new header, the test tax number and ZOI signed with the test
+        certificate.
+        """
+        if 'BusinessPremiseRequest' in payload:
+            request = payload['BusinessPremiseRequest']
+            request['Header'] = FURSBusinessPremiseAPI._prepare_business_premise_request_header()
+            if self.tax_number is not None:
+                request['BusinessPremise']['TaxNumber'] = self.tax_number
+            return payload
+
+        request = payload['InvoiceRequest']
+        request['Header'] = FURSInvoiceAPI._prepare_invoice_request_header()
+        if 'SalesBookInvoice' in request:
+            if self.tax_number is not None:
+                request['SalesBookInvoice']['TaxNumber'] = self.tax_number
+            return payload
+
+        invoice = request['Invoice']
+        if self.tax_number is not None:
+            invoice['TaxNumber'] = self.tax_number
+        self.api._recalculate_zoi(invoice)
+        return payload
+
+    @staticmethod
+    def _outcome(result):
+        """
+        :return: (string) OUTCOME_OK for a response, otherwise exception name with FURS error or HTTP status code
+        """
+        if not isinstance(result, Exception):
+            return OUTCOME_OK
+        if isinstance(result, (FURSException, ConnectionException)):
+            code = result.code[0] if isinstance(result.code, tuple) else result.code
+            return '%s %s' % (type(result).__name__, code)
+        return type(result).__name__
+
+    def _after_fork(self):
+        # the shadow thread does not exist in the child, it is started again by the first mirrored request
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=self.capacity)
+        self._thread = None
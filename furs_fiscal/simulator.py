@@ -0,0 +1,137 @@
+"""
+Local stand-in for the FURS server, for benchmarks and load tests.
+
+The simulator accepts the same requests as FURS and answers with well formed responses, but it does not verify
+signatures or the content of the requests. Responses are signed with a dummy HMAC key - the library does not
+verify FURS signatures (see FURSBaseAPI._send_request).
+"""
+import datetime
+import json
+import threading
+import time
+import uuid
+import jwt
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+ECHO_PATH = 'v1/cash_registers/echo'
+
+SIMULATOR_KEY = 'furs-simulator-response-signing-key'
+
+
+class FURSSimulator(object):
+    """
+    FURSSimulator builds FURS responses for requests, without any networking.
+    """
+    def __init__(self, latency=0.0):
+        """
+        :param latency: (float) Seconds to wait before answering, to simulate FURS processing time
+        """
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def handle(self, path, body):
+        """
+        Handle a single request.
+
+        :param path: (string) Request path, e.g. 'v1/cash_registers/invoices'
+        :param body: (dict) Decoded JSON request body
+        :return: (tuple) HTTP status code and response body (dict)
+        """
+        with self._lock:
+            self.requests += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        path = path.strip('/')
+        if path == ECHO_PATH:
+            return 200, {'EchoResponse': body.get('EchoRequest')}
+
+        try:
+            payload = jwt.decode(body['token'], options={'verify_signature': False})
+        except (KeyError, jwt.InvalidTokenError):
+            return 400, {'error': 'invalid token'}
+
+        header = {
+            'MessageID': str(uuid.uuid4()),
+            'DateTime': datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        if 'InvoiceRequest' in payload:
+            response = {'InvoiceResponse': {'Header': header, 'UniqueInvoiceID': str(uuid.uuid4())}}
+        elif 'BusinessPremiseRequest' in payload:
+            response = {'BusinessPremiseResponse': {'Header': header}}
+        else:
+            return 400, {'error': 'unknown request'}
+
+        return 200, {'token': jwt.encode(response, key=SIMULATOR_KEY, algorithm='HS256')}
+
+
+class _SimulatorRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, without TCP_NODELAY every response waits for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        status, response = self.server.simulator.handle(self.path, json.loads(self.rfile.read(length) or b'{}'))
+
+        content = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SimulatorServer(ThreadingHTTPServer):
+    """
+    Plain HTTP server around FURSSimulator. Pass its endpoint to FURSInvoiceAPI(endpoint=...).
+
+    Usage:
+        with SimulatorServer() as server:
+            api = FURSInvoiceAPI(p12_path, p12_password, endpoint=server.endpoint)
+    """
+    daemon_threads = True
+    # load tests open many connections at once, e.g. after a certificate reload
+    request_queue_size = 128
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        """
+        :param host: (string) Address to listen on
+        :param port: (int) Port to listen on, 0 picks a free port
+        :param latency: (float) Seconds to wait before answering
+        """
+        ThreadingHTTPServer.__init__(self, (host, port), _SimulatorRequestHandler)
+        self.simulator = FURSSimulator(latency=latency)
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        return 'http://%s:%d' % self.server_address[:2]
+
+    def start(self):
+        """
+        Serve requests in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name='furs-simulator', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,213 @@
+"""
+Adaptive request timeouts.
+
+Latency of every request is recorded in a histogram per endpoint path, and connect and read timeouts are derived
+from its recent percentiles - longer at peak hours when FURS is slow, shorter when it answers quickly. After a few
+timeouts in a row the minimum timeout is used until a request succeeds, so cashiers do not wait for the full
+timeout on every invoice during an outage. Every probe_interval seconds one request is sent with the default
+timeout instead, so a server which came back slower than the minimum timeout is noticed.
+"""
+import math
+import threading
+import time
+
+from furs_fiscal import forksafe
+
+
+# upper bounds of histogram buckets in seconds, from 1 ms to ~2 minutes, each 25% wider than the previous
+BUCKET_BOUNDS = tuple(0.001 * 1.25 ** index for index in range(54))
+
+_LOG_GROWTH = math.log(1.25)
+
+
+class LatencyHistogram(object):
+    """
+    Streaming latency histogram with logarithmic buckets. Only the current and the previous window are kept, so
+    percentiles follow recent latency.
+    """
+    def __init__(self, window=300.0):
+        """
+        :param window: (float) Seconds after which samples start to be forgotten. Percentiles cover between one and
+                               two windows of samples
+        """
+        self.window = window
+        self._current = [0] * len(BUCKET_BOUNDS)
+        self._previous = [0] * len(BUCKET_BOUNDS)
+        self._window_start = time.monotonic()
+
+    def record(self, seconds, now=None):
+        self._rotate(now)
+        if seconds <= BUCKET_BOUNDS[0]:
+            index = 0
+        else:
+            index = min(len(BUCKET_BOUNDS) - 1, int(math.ceil(math.log(seconds / BUCKET_BOUNDS[0]) / _LOG_GROWTH)))
+        self._current[index] += 1
+
+    def count(self, now=None):
+        self._rotate(now)
+        return sum(self._current) + sum(self._previous)
+
+    def percentile(self, percent, now=None):
+        """
+        :param percent: (float) Percentile between 0 and 100
+        :return: (float) Upper bound of the bucket holding the percentile, None if there are no samples
+        """
+        counts = self.buckets(now)
+        total = sum(count for _, count in counts)
+        if total == 0:
+            return None
+
+        rank = max(1, int(math.ceil(percent / 100.0 * total)))
+        for bound, count in counts:
+            rank -= count
+            if rank <= 0:
+                return bound
+        return counts[-1][0]
+
+    def buckets(self, now=None):
+        """
+        :return: (list) (upper bound, count) for every bucket with samples, in increasing order
+        """
+        self._rotate(now)
+        return [(bound, current + previous) for bound, current, previous in zip(BUCKET_BOUNDS, self._current,
+                                                                                 self._previous)
+                if current + previous]
+
+    def _rotate(self, now):
+        now = time.monotonic() if now is None else now
+        elapsed = now - self._window_start
+        if elapsed < self.window:
+            return
+
+        if elapsed < 2 * self.window:
+            self._previous = self._current
+        else:
+            self._previous = [0] * len(BUCKET_BOUNDS)
+        self._current = [0] * len(BUCKET_BOUNDS)
+        self._window_start = now
+
+
+class AdaptiveTimeout(object):
+    """
+    AdaptiveTimeout picks connect and read timeouts for each request from recent latency of its endpoint.
+
+    Usage:
+        api = FURSInvoiceAPI(p12_path, p12_password, adaptive_timeout=AdaptiveTimeout(max_timeout=5.0))
+        ...
+        api.adaptive_timeout.stats()
+    """
+    def __init__(self, percentile=99.0, multiplier=1.5, connect_percentile=50.0, connect_multiplier=3.0,
+                 min_timeout=0.5, max_timeout=10.0, min_samples=50, window=300.0, fail_fast_after=3,
+                 probe_interval=5.0):
+        """
+        :param percentile: (float) Latency percentile the read timeout is based on
+        :param multiplier: (float) Read timeout is the percentile multiplied by this
+        :param connect_percentile: (float) Latency percentile the connect timeout is based on. A new connection
+                                           takes a few round trips, so it is based on typical latency
+        :param connect_multiplier: (float) Connect timeout is the connect percentile multiplied by this
+        :param min_timeout: (float) Timeouts are never shorter than this
+        :param max_timeout: (float) Timeouts are never longer than this
+        :param min_samples: (int) Use the default timeout until an endpoint has this many recent samples
+        :param window: (float) Seconds of latency history, see LatencyHistogram
+        :param fail_fast_after: (int) Use min_timeout after this many timeouts in a row, until a request succeeds.
+                                      None disables it
+        :param probe_interval: (float) While min_timeout is used, let one request every this many seconds wait for
+                                       the default timeout
+        """
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.connect_percentile = connect_percentile
+        self.connect_multiplier = connect_multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+        self.window = window
+        self.fail_fast_after = fail_fast_after
+        self.probe_interval = probe_interval
+
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._timeouts_in_row = {}
+        self._timed_out = {}
+        self._next_probe = {}
+
+        forksafe.register(self)
+
+    def timeouts(self, path, default):
+        """
+        :param path: (string) Endpoint path
+        :param default: (float) Timeout used while there are not enough samples, and for probes
+        :return: (tuple) connect and read timeout in seconds
+        """
+        return self._timeouts(path, default, probe=True)
+
+    def _timeouts(self, path, default, probe):
+        with self._lock:
+            if self.fail_fast_after is not None and self._timeouts_in_row.get(path, 0) >= self.fail_fast_after:
+                now = time.monotonic()
+                if not probe or now < self._next_probe.get(path, 0):
+                    return self.min_timeout, self.min_timeout
+                # percentiles are dominated by requests cut short at min_timeout, the probe gets the default
+                self._next_probe[path] = now + self.probe_interval
+                return default, default
+
+            histogram = self._histograms.get(path)
+            if histogram is None or histogram.count() < self.min_samples:
+                return default, default
+
+            connect = histogram.percentile(self.connect_percentile) * self.connect_multiplier
+            read = histogram.percentile(self.percentile) * self.multiplier
+
+        return self._clamp(connect), self._clamp(read)
+
+    def record(self, path, seconds, timed_out=False):
+        """
+        Record latency of a request.
+
+        :param path: (string) Endpoint path
+        :param seconds: (float) Time until the response, or until the request timed out
+        :param timed_out: (boolean) The request timed out. Its time is recorded too, so a slower server raises
+                                    the timeouts
+        """
+        with self._lock:
+            histogram = self._histograms.get(path)
+            if histogram is None:
+                histogram = self._histograms[path] = LatencyHistogram(window=self.window)
+            histogram.record(seconds)
+
+            if timed_out:
+                in_row = self._timeouts_in_row[path] = self._timeouts_in_row.get(path, 0) + 1
+                self._timed_out[path] = self._timed_out.get(path, 0) + 1
+                if in_row == self.fail_fast_after:
+                    self._next_probe[path] = time.monotonic() + self.probe_interval
+            else:
+                self._timeouts_in_row[path] = 0
+
+    def stats(self):
+        """
+        :return: (dict) path -> count, timed_out, p50, p90, p99 (seconds), buckets (list of (upper bound, count))
+                                and current connect and read timeouts
+        """
+        with self._lock:
+            paths = list(self._histograms.items())
+
+        result = {}
+        for path, histogram in paths:
+            with self._lock:
+                stats = {
+                    'count': histogram.count(),
+                    'timed_out': self._timed_out.get(path, 0),
+                    'p50': histogram.percentile(50),
+                    'p90': histogram.percentile(90),
+                    'p99': histogram.percentile(99),
+                    'buckets': histogram.buckets(),
+                }
+            stats['timeouts'] = self._timeouts(path, None, probe=False)
+            result[path] = stats
+        return result
+
+    def _clamp(self, timeout):
+        return min(self.max_timeout, max(self.min_timeout, timeout))
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
@@ -0,0 +1,203 @@
+"""
+Transports send signed requests from Connector to the FURS server. A transport only moves bytes - signing, rate
+limiting and statistics stay in Connector, so backends can be swapped without changing behaviour:
+
+    RequestsTransport - requests.Session with a connection pool (default)
+    Urllib3Transport  - urllib3 PoolManager, skipping the requests layer
+    LoopbackTransport - calls FURSSimulator directly, without any networking
+
+Every transport returns an object with status_code, content, text and json() - a requests.Response or
+TransportResponse - and raises requests.exceptions.Timeout when the server does not answer in time.
+"""
+import json
+import requests
+import urllib3
+
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+
+from furs_fiscal.simulator import FURSSimulator
+
+
+class TransportResponse(object):
+    """
+    Minimal response returned by transports which do not use requests.
+    """
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class Transport(object):
+    """
+    Base class for transports.
+    """
+    def post(self, url, json, headers, timeout, cert):
+        """
+        Send a POST request.
+
+        :param url: (string) Full request URL
+        :param json: (dict) Request body
+        :param headers: (dict) Request headers
+        :param timeout: (float or tuple) How long to wait for the server, or a (connect, read) tuple
+        :param cert: (tuple) Paths to the client certificate and private key PEM files
+        :return: response object
+
+        :raises
+            requests.exceptions.Timeout - server did not answer in time
+            requests.exceptions.ConnectionError - server could not be reached
+        """
+        raise NotImplementedError()
+
+    def reset(self):
+        """
+        Forget open connections without closing them. Called in a forked child process, whose connections are
+        shared with the parent.
+        """
+        pass
+
+    def discard_certificate(self, cert):
+        """
+        Called when a client certificate is no longer used, e.g. after it was replaced by a new one.
+
+        :param cert: (tuple) Paths to the client certificate and private key PEM files
+        """
+        pass
+
+    def close(self):
+        """
+        Close open connections.
+        """
+        pass
+
+
+class RequestsTransport(Transport):
+    def __init__(self, pool_size=10, proxy=None):
+        """
+        :param pool_size: (int) How many connections to keep open for reuse
+        :param proxy: (dict) requests proxies, e.g. {"https": "http://localhost:3128"}
+        """
+        self.pool_size = pool_size
+        self.proxy = proxy
+        self.session = None
+        self.reset()
+
+    def reset(self):
+        self.session = requests.Session()
+        for prefix in ('https://', 'http://'):
+            self.session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size))
+
+    def post(self, url, json, headers, timeout, cert):
+        return self.session.post(url=url,
+                                 json=json,
+                                 cert=cert,
+                                 verify=False,
+                                 headers=headers,
+                                 timeout=timeout,
+                                 proxies=self.proxy)
+
+    def close(self):
+        self.session.close()
+
+
+class Urllib3Transport(Transport):
+    """
+    Sends requests with urllib3 directly. Compared to requests it skips session merging, environment proxy lookup
+    and response wrapping on every request.
+    """
+    def __init__(self, pool_size=10, proxy=None):
+        """
+        :param pool_size: (int) How many connections to keep open for reuse
+        :param proxy: (string) Proxy URL, e.g. "http://localhost:3128". Default: None, connect directly
+        """
+        self.pool_size = pool_size
+        self.proxy = proxy
+        # client certificate -> PoolManager
+        self._managers = {}
+
+    def post(self, url, json, headers, timeout, cert):
+        manager = self._managers.get(cert)
+        if manager is None:
+            manager = self._managers.setdefault(cert, self._create_manager(cert))
+
+        try:
+            response = manager.request('POST', url,
+                                       body=_dumps(json),
+                                       headers=headers,
+                                       timeout=Urllib3Transport._timeout(timeout),
+                                       retries=False,
+                                       redirect=False)
+        except urllib3.exceptions.NewConnectionError as e:
+            # subclass of ConnectTimeoutError in urllib3, but requests reports refused connections as ConnectionError
+            raise requests.exceptions.ConnectionError(e)
+        except urllib3.exceptions.TimeoutError as e:
+            raise requests.exceptions.Timeout(e)
+        except urllib3.exceptions.HTTPError as e:
+            raise requests.exceptions.ConnectionError(e)
+
+        return TransportResponse(response.status, response.data)
+
+    def reset(self):
+        self._managers = {}
+
+    def discard_certificate(self, cert):
+        manager = self._managers.pop(cert, None)
+        if manager is not None:
+            manager.clear()
+
+    def close(self):
+        for manager in self._managers.values():
+            manager.clear()
+        self._managers = {}
+
+    @staticmethod
+    def _timeout(timeout):
+        if isinstance(timeout, tuple):
+            return urllib3.Timeout(connect=timeout[0], read=timeout[1])
+        return urllib3.Timeout(connect=timeout, read=timeout)
+
+    def _create_manager(self, cert):
+        kwargs = dict(num_pools=2,
+                      maxsize=self.pool_size,
+                      cert_file=cert[0],
+                      key_file=cert[1],
+                      cert_reqs='CERT_NONE',
+                      assert_hostname=False)
+
+        if self.proxy:
+            return urllib3.ProxyManager(self.proxy, **kwargs)
+        return urllib3.PoolManager(**kwargs)
+
+
+class LoopbackTransport(Transport):
+    """
+    Passes requests straight to a FURSSimulator in the same process, for benchmarks and tests without network.
+    Request and response bodies still go through JSON, like they would over HTTP.
+
+    Usage:
+        api = FURSInvoiceAPI(p12_path, p12_password, transport=LoopbackTransport())
+    """
+    def __init__(self, simulator=None):
+        """
+        :param simulator: (FURSSimulator) Simulator answering the requests. Default: new FURSSimulator()
+        """
+        self.simulator = simulator if simulator is not None else FURSSimulator()
+
+    def post(self, url, json, headers, timeout, cert):
+        status, response = self.simulator.handle(urlsplit(url).path, _loads(_dumps(json)))
+        return TransportResponse(status, _dumps(response))
+
+
+def _dumps(data):
+    return json.dumps(data).encode('utf-8')
+
+
+def _loads(content):
+    return json.loads(content)
@@ -0,0 +1,319 @@
+"""
+Local validation of FURS request bodies.
+
+Schemas below are compiled once at import time into nested validator closures. A validator returns None when
+the value is valid, otherwise a list of (path, message) pairs, so a valid message is checked without building
+any paths or error objects.
+"""
+import re
+
+from collections import namedtuple
+from decimal import Decimal
+
+from furs_fiscal.exceptions import ValidationException
+
+
+SchemaError = namedtuple('SchemaError', ['path', 'message'])
+
+_MISSING = object()
+
+
+def _error(message):
+    return [((), message)]
+
+
+def _string(pattern=None, max_length=None, allow_int=False):
+    regex = re.compile(pattern) if pattern else None
+
+    def validate(value):
+        if allow_int and type(value) == int:
+            value = str(value)
+        if not isinstance(value, str):
+            return _error("expected string, got %s" % type(value).__name__)
+        if max_length is not None and len(value) > max_length:
+            return _error("longer than %d characters" % max_length)
+        if regex is not None and not regex.fullmatch(value):
+            return _error("%r does not match %s" % (value, pattern))
+        return None
+
+    return validate
+
+
+def _integer(min_value, max_value):
+    def validate(value):
+        if type(value) != int:
+            return _error("expected integer, got %s" % type(value).__name__)
+        if not min_value <= value <= max_value:
+            return _error("%d is not between %d and %d" % (value, min_value, max_value))
+        return None
+
+    return validate
+
+
+def _amount(decimals=2):
+    def validate(value):
+        if type(value) == int:
+            return None
+        if type(value) == float:
+            value = Decimal(repr(value))
+        elif not isinstance(value, Decimal):
+            return _error("expected number, got %s" % type(value).__name__)
+        if not value.is_finite():
+            return _error("%s is not a finite number" % value)
+        if value.as_tuple().exponent < -decimals and value != round(value, decimals):
+            return _error("%s has more than %d decimal places" % (value, decimals))
+        return None
+
+    return validate
+
+
+def _choice(*values):
+    allowed = frozenset(values)
+
+    def validate(value):
+        if value not in allowed:
+            return _error("%r is not one of %s" % (value, ', '.join(sorted(allowed))))
+        return None
+
+    return validate
+
+
+def _boolean(value):
+    if type(value) != bool:
+        return _error("expected boolean, got %s" % type(value).__name__)
+    return None
+
+
+def _list(item, min_items=0):
+    def validate(value):
+        if not isinstance(value, list):
+            return _error("expected list, got %s" % type(value).__name__)
+        if len(value) < min_items:
+            return _error("expected at least %d items" % min_items)
+        errors = None
+        for i, element in enumerate(value):
+            result = item(element)
+            if result:
+                errors = (errors or []) + [((i,) + path, message) for path, message in result]
+        return errors
+
+    return validate
+
+
+def _object(required=None, optional=None, one_of=None):
+    """
+    :param required: (dict) field name -> validator, field must be present and not None
+    :param optional: (dict) field name -> validator, checked only if present
+    :param one_of: (tuple) field names of which exactly one must be present
+    """
+    required = tuple((required or {}).items())
+    optional = tuple((optional or {}).items())
+
+    def validate(value):
+        if not isinstance(value, dict):
+            return _error("expected object, got %s" % type(value).__name__)
+        errors = None
+        for name, field in required:
+            field_value = value.get(name)
+            if field_value is None:
+                result = _error("required field is missing")
+            else:
+                result = field(field_value)
+            if result:
+                errors = (errors or []) + [((name,) + path, message) for path, message in result]
+        for name, field in optional:
+            field_value = value.get(name, _MISSING)
+            if field_value is not _MISSING:
+                result = field(field_value)
+                if result:
+                    errors = (errors or []) + [((name,) + path, message) for path, message in result]
+        if one_of and sum(1 for name in one_of if value.get(name) is not None) != 1:
+            errors = (errors or []) + [((), "exactly one of %s is required" % ', '.join(one_of))]
+        return errors
+
+    return validate
+
+
+TAX_NUMBER = _integer(10000000, 99999999)
+PREMISE_ID = _string(r'[0-9a-zA-Z]{1,20}')
+DEVICE_ID = _string(r'[0-9a-zA-Z]{1,20}')
+INVOICE_NUMBER = _string(r'[0-9]{1,20}', allow_int=True)
+AMOUNT = _amount(2)
+DATE = _string(r'\d{4}-\d{2}-\d{2}')
+DATE_TIME = _string(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z?')
+
+HEADER = _object(required={
+    'MessageID': _string(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'),
+    'DateTime': DATE_TIME,
+})
+
+TAXES_PER_SELLER = _object(optional={
+    'VAT': _list(_object(required={
+        'TaxRate': AMOUNT,
+        'TaxableAmount': AMOUNT,
+        'TaxAmount': AMOUNT,
+    })),
+    'NontaxableAmount': AMOUNT,
+    'ReverseVATTaxableAmount': AMOUNT,
+    'ExemptVATTaxableAmount': AMOUNT,
+    'OtherTaxesAmount': AMOUNT,
+    'SpecialTaxRulesAmount': AMOUNT,
+    'SellerTaxNumber': TAX_NUMBER,
+})
+
+REFERENCE_INVOICE = _object(required={
+    'ReferenceInvoiceIdentifier': _object(required={
+        'BusinessPremiseID': PREMISE_ID,
+        'ElectronicDeviceID': DEVICE_ID,
+        'InvoiceNumber': INVOICE_NUMBER,
+    }),
+    'ReferenceInvoiceIssueDateTime': DATE_TIME,
+})
+
+SALES_BOOK_IDENTIFIER = _object(required={
+    'InvoiceNumber': INVOICE_NUMBER,
+    'SetNumber': _string(r'[0-9]{2}'),
+    'SerialNumber': _string(r'.{12}'),
+})
+
+INVOICE_COMMON = {
+    'CustomerVATNumber': _string(max_length=20),
+    'ReturnsAmount': AMOUNT,
+    'ReferenceInvoice': _list(REFERENCE_INVOICE),
+    'SpecialNotes': _string(max_length=1000),
+}
+
+INVOICE_REQUEST = _object(required={
+    'InvoiceRequest': _object(required={
+        'Header': HEADER,
+    }, optional={
+        'Invoice': _object(required={
+            'TaxNumber': TAX_NUMBER,
+            'IssueDateTime': DATE_TIME,
+            'NumberingStructure': _choice('B', 'C'),
+            'InvoiceIdentifier': _object(required={
+                'BusinessPremiseID': PREMISE_ID,
+                'ElectronicDeviceID': DEVICE_ID,
+                'InvoiceNumber': INVOICE_NUMBER,
+            }),
+            'InvoiceAmount': AMOUNT,
+            'PaymentAmount': AMOUNT,
+            'ProtectedID': _string(r'[0-9a-fA-F]{32}'),
+            'TaxesPerSeller': _list(TAXES_PER_SELLER),
+        }, optional=dict(INVOICE_COMMON, **{
+            'OperatorTaxNumber': TAX_NUMBER,
+            'ForeignOperator': _boolean,
+            'SubsequentSubmit': _boolean,
+        })),
+        'SalesBookInvoice': _object(required={
+            'TaxNumber': TAX_NUMBER,
+            'IssueDate': DATE,
+            'SalesBookIdentifier': SALES_BOOK_IDENTIFIER,
+            'BusinessPremiseID': PREMISE_ID,
+            'InvoiceAmount': AMOUNT,
+            'PaymentAmount': AMOUNT,
+            'TaxesPerSeller': _list(TAXES_PER_SELLER),
+        }, optional=dict(INVOICE_COMMON, **{
+            'ReferenceSalesBook': _list(_object(required={
+                'ReferenceSalesBookIdentifier': SALES_BOOK_IDENTIFIER,
+                'ReferenceSalesBookIssueDate': _string(r'\d{4}-\d{2}-\d{2}(T[0-9:.+-]+)?'),
+            })),
+        })),
+    }, one_of=('Invoice', 'SalesBookInvoice')),
+})
+
+BUSINESS_PREMISE_REQUEST = _object(required={
+    'BusinessPremiseRequest': _object(required={
+        'Header': HEADER,
+        'BusinessPremise': _object(required={
+            'TaxNumber': TAX_NUMBER,
+            'BusinessPremiseID': PREMISE_ID,
+            'BPIdentifier': _object(optional={
+                'RealEstateBP': _object(required={
+                    'PropertyID': _object(required={
+                        'CadastralNumber': _integer(1, 9999),
+                        'BuildingNumber': _integer(1, 99999),
+                        'BuildingSectionNumber': _integer(1, 9999),
+                    }),
+                    'Address': _object(required={
+                        'Street': _string(max_length=100),
+                        'HouseNumber': _string(max_length=10),
+                        'Community': _string(max_length=100),
+                        'City': _string(max_length=40),
+                        'PostalCode': _string(r'[0-9]{4}'),
+                    }, optional={
+                        'HouseNumberAdditional': _string(max_length=10),
+                    }),
+                }),
+                'PremiseType': _choice('A', 'B', 'C'),
+            }, one_of=('RealEstateBP', 'PremiseType')),
+            'ValidityDate': DATE,
+            'SoftwareSupplier': _list(_object(optional={
+                'TaxNumber': TAX_NUMBER,
+                'NameForeign': _string(max_length=1000),
+            }, one_of=('TaxNumber', 'NameForeign')), min_items=1),
+            'SpecialNotes': _string(max_length=1000),
+        }, optional={
+            'ClosingTag': _choice('Z'),
+        }),
+    }),
+})
+
+SCHEMAS = {
+    'InvoiceRequest': INVOICE_REQUEST,
+    'BusinessPremiseRequest': BUSINESS_PREMISE_REQUEST,
+}
+
+
+def _format_path(path):
+    formatted = ''
+    for part in path:
+        if isinstance(part, int):
+            formatted += '[%d]' % part
+        else:
+            formatted += ('.' if formatted else '') + part
+    return formatted
+
+
+def get_errors(message):
+    """
+    Validate request body against the FURS schema.
+
+    :param message: (dict) InvoiceRequest or BusinessPremiseRequest body
+    :return: (list) List of SchemaError tuples, empty if message is valid
+    """
+    schema = None
+    if isinstance(message, dict) and len(message) == 1:
+        schema = SCHEMAS.get(next(iter(message)))
+    if schema is None:
+        return [SchemaError(path='', message="unknown message type, expected one of %s" % ', '.join(SCHEMAS))]
+
+    return [SchemaError(path=_format_path(path), message=error) for path, error in schema(message) or ()]
+
+
+def validate(message):
+    """
+    Validate request body against the FURS schema.
+
+    :param message: (dict) InvoiceRequest or BusinessPremiseRequest body
+    :return: None
+
+    :raises
+        ValidationException - message is not valid, errors are available in exception.errors
+    """
+    errors = get_errors(message)
+    if errors:
+        raise ValidationException(errors)
+
+
+def validate_many(messages):
+    """
+    Validate a batch of request bodies.
+
+    :param messages: (iterable) request bodies
+    :return: (generator) (index, errors) tuples for every invalid message
+    """
+    for i, message in enumerate(messages):
+        errors = get_errors(message)
+        if errors:
+            yield i, errors
@@ -0,0 +1,125 @@
+import datetime
+import threading
+
+from requests import codes
+
+
+class ConnectionWarmer(object):
+    """
+    ConnectionWarmer keeps connections to the FURS server open by sending echo requests in the background, so
+    that invoices issued after opening time or after idle periods do not pay for new TCP and TLS handshakes.
+
+    Usage:
+        warmer = ConnectionWarmer(api.connector, connections=2,
+                                  schedule=[(datetime.time(8, 0), datetime.time(20, 0))])
+        warmer.start()
+        ...
+        warmer.stop()
+
+    Cold vs. warm request counters are available in connector.stats.
+    """
+    def __init__(self, connector, connections=1, interval=20.0, schedule=None, ramp_up=900):
+        """
+        :param connector: (Connector) connector to keep warm
+        :param connections: (int) How many connections to keep open. Should not exceed connector pool_size
+        :param interval: (float) Seconds between warming rounds. Should be lower than the server keep alive period
+        :param schedule: (list) Opening hours as a list of (datetime.time, datetime.time) tuples in local time.
+                                None means connections are kept warm all the time
+        :param ramp_up: (int) Seconds before opening time at which warming starts
+        """
+        self.connector = connector
+        self.connections = connections
+        self.interval = interval
+        self.schedule = schedule
+        self.ramp_up = ramp_up
+
+        self.stats = {'rounds': 0, 'echo_success': 0, 'echo_failure': 0}
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+
+    def start(self):
+        """
+        Start warming in a background thread. First round runs immediately.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='furs-connection-warmer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop warming and wait for the background thread to finish the current round.
+
+        :param timeout: (float) How long to wait for the thread, None waits until it finishes
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def is_active(self, now=None):
+        """
+        Check if connections should be kept warm at given time according to the schedule.
+
+        :param now: (datetime) Local time to check. Default: current time
+        :return: (boolean) True if connections should be kept warm
+        """
+        if self.schedule is None:
+            return True
+
+        now = now or datetime.datetime.now()
+        ramp_up = datetime.timedelta(seconds=self.ramp_up)
+        for opening, closing in self.schedule:
+            # check today's and yesterday's windows so that ramp-up and windows can cross midnight
+            for day in (now.date(), now.date() - datetime.timedelta(days=1)):
+                start = datetime.datetime.combine(day, opening) - ramp_up
+                end = datetime.datetime.combine(day, closing)
+                if end <= start + ramp_up:
+                    end += datetime.timedelta(days=1)
+                if start <= now < end:
+                    return True
+
+        return False
+
+    def warm(self):
+        """
+        Open (or keep open) the configured number of connections by sending concurrent echo requests.
+        """
+        threads = [threading.Thread(target=self._echo) for _ in range(self.connections)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self._count('rounds')
+
+    def _echo(self):
+        try:
+            response = self.connector.send_echo()
+        except Exception:
+            self._count('echo_failure')
+            return
+
+        # an error response does not mean the server accepted our connection for reuse
+        self._count('echo_success' if response.status_code == codes.ok else 'echo_failure')
+
+    def _count(self, kind):
+        with self._stats_lock:
+            self.stats[kind] += 1
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.is_active():
+                self.warm()
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
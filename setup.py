@@ -12,6 +12,12 @@ setup(
     keywords=['FURS', 'fiscal', 'fiscal register', 'davcne blagajne'],
     classifiers=[],
     package_data={'furs_fiscal': ['certs/*.pem']},
+    entry_points={
+        'console_scripts': [
+            'furs-fiscal-daemon=furs_fiscal.daemon:main',
+            'furs-fiscal-replay=furs_fiscal.replay:main',
+        ],
+    },
     install_requires=[
         'pytz>=2017.2',
         'requests>=2.20.0',
@@ -0,0 +1,65 @@
+import unittest
+
+from decimal import Decimal
+
+from furs_fiscal.aggregation import (aggregate_taxes, to_cents, CATEGORY_EXEMPT, CATEGORY_NON_TAXABLE,
+                                     CATEGORY_VAT)
+
+
+class AggregateTaxesTest(unittest.TestCase):
+
+    def test_tax_rounded_once_per_group(self):
+        # each line alone would have 0.0044 of tax, rounded to 0.00
+        taxes_per_seller = aggregate_taxes(amounts=['0.02', '0.02', '0.02'], tax_rates=[22, 22, 22])
+        self.assertEqual(taxes_per_seller[0].vat_amounts,
+                         [{'TaxRate': 22.0, 'TaxableAmount': 0.06, 'TaxAmount': 0.01}])
+
+    def test_rounding_half_up(self):
+        # 0.25 * 22 % = 0.055
+        taxes_per_seller = aggregate_taxes(amounts=[Decimal('0.25')], tax_rates=[22])
+        self.assertEqual(taxes_per_seller[0].vat_amounts[0]['TaxAmount'], 0.06)
+        self.assertEqual(to_cents('0.005'), 1)
+        self.assertEqual(to_cents(2.675), 268)
+
+    def test_groups_per_rate(self):
+        taxes_per_seller = aggregate_taxes(amounts=[Decimal('10.00'), Decimal('4.99'), 5, Decimal('3.50')],
+                                           tax_rates=[22, 9.5, Decimal('22.00'), None],
+                                           categories=[CATEGORY_VAT, CATEGORY_VAT, CATEGORY_VAT, CATEGORY_EXEMPT])
+        self.assertEqual(len(taxes_per_seller), 1)
+        self.assertEqual(taxes_per_seller[0].vat_amounts, [
+            {'TaxRate': 22.0, 'TaxableAmount': 15.0, 'TaxAmount': 3.3},
+            {'TaxRate': 9.5, 'TaxableAmount': 4.99, 'TaxAmount': 0.47},
+        ])
+        self.assertEqual(taxes_per_seller[0].exempt_vat_taxable_amount, 3.5)
+
+    def test_amounts_include_vat(self):
+        taxes_per_seller = aggregate_taxes(amounts=['7.32', '4.88'], tax_rates=[22, 22], amounts_include_vat=True)
+        self.assertEqual(taxes_per_seller[0].vat_amounts,
+                         [{'TaxRate': 22.0, 'TaxableAmount': 10.0, 'TaxAmount': 2.2}])
+
+    def test_order_does_not_matter(self):
+        amounts = ['0.10', '0.20', '0.30', '1.99', '0.01']
+        rates = [22, 9.5, 22, 9.5, 22]
+        forward = aggregate_taxes(amounts=amounts, tax_rates=rates)
+        backward = aggregate_taxes(amounts=amounts[::-1], tax_rates=rates[::-1])
+        self.assertEqual(forward[0].vat_amounts, backward[0].vat_amounts)
+
+    def test_sellers(self):
+        taxes_per_seller = aggregate_taxes(amounts=[100, 200, 300], tax_rates=[22, 22, None],
+                                           sellers=[12345678, None, 12345678],
+                                           categories=[CATEGORY_VAT, CATEGORY_VAT, CATEGORY_NON_TAXABLE],
+                                           amounts_in_cents=True)
+        # invoice issuer first
+        self.assertEqual([seller.seller_tax_number for seller in taxes_per_seller], [None, 12345678])
+        self.assertEqual(taxes_per_seller[0].vat_amounts[0]['TaxableAmount'], 2.0)
+        self.assertEqual(taxes_per_seller[1].vat_amounts[0]['TaxAmount'], 0.22)
+        self.assertEqual(taxes_per_seller[1].non_taxable_amount, 3.0)
+
+    def test_errors(self):
+        self.assertRaises(ValueError, aggregate_taxes, amounts=[1, 2], tax_rates=[22])
+        self.assertRaises(ValueError, aggregate_taxes, amounts=[1], tax_rates=[None])
+        self.assertRaises(ValueError, aggregate_taxes, amounts=[1], categories=['UNKNOWN'])
+
+
+if __name__ == '__main__':
+    unittest.main()
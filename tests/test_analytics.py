@@ -0,0 +1,90 @@
+import datetime
+import shutil
+import tempfile
+import unittest
+
+from furs_fiscal.analytics import InvoiceColumnStore
+
+
+def _message(day, premise, device, amount, vat=(), exempt=None, seller=None, subsequent=False):
+    taxes = {'VAT': [{'TaxRate': rate, 'TaxableAmount': taxable, 'TaxAmount': tax} for rate, taxable, tax in vat]}
+    if exempt is not None:
+        taxes['ExemptVATTaxableAmount'] = exempt
+    if seller is not None:
+        taxes['SellerTaxNumber'] = seller
+    invoice = {
+        'IssueDateTime': '%sT12:00:00Z' % day.isoformat(),
+        'InvoiceIdentifier': {'BusinessPremiseID': premise, 'ElectronicDeviceID': device, 'InvoiceNumber': '1'},
+        'InvoiceAmount': amount,
+        'TaxesPerSeller': [taxes],
+    }
+    if subsequent:
+        invoice['SubsequentSubmit'] = True
+    return {'InvoiceRequest': {'Invoice': invoice}}
+
+
+class InvoiceColumnStoreTest(unittest.TestCase):
+
+    FIRST = datetime.date(2024, 1, 1)
+    SECOND = datetime.date(2024, 1, 2)
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+        self.store = InvoiceColumnStore(self.path)
+        self.addCleanup(self.store.close)
+        self.store.append(_message(self.FIRST, 'BP101', 'B1', 12.2, vat=[(22, 10, 2.2)]), eor='eor-1')
+        self.store.append(_message(self.FIRST, 'BP101', 'B2', 15.45, vat=[(22, 10, 2.2), (9.5, 2, 0.19)],
+                                   exempt=1.06, subsequent=True), eor='eor-2')
+        self.store.append(_message(self.FIRST, 'BP101', 'B1', 100, vat=[(22, 100, 22)]), failed=True)
+        self.store.append(_message(self.SECOND, 'BP102', 'B1', 1.22, vat=[(22, 1, 0.22)], seller=12345678),
+                          eor='eor-4')
+
+    def test_totals(self):
+        self.assertEqual(self.store.totals(by=('premise', 'device')), {
+            ('BP101', 'B1'): {'count': 1, 'amount': 12.2, 'failed': 1, 'subsequent': 0},
+            ('BP101', 'B2'): {'count': 1, 'amount': 15.45, 'failed': 0, 'subsequent': 1},
+            ('BP102', 'B1'): {'count': 1, 'amount': 1.22, 'failed': 0, 'subsequent': 0},
+        })
+        self.assertEqual(self.store.totals(by=()), {(): {'count': 3, 'amount': 28.87, 'failed': 1, 'subsequent': 1}})
+        self.assertEqual(self.store.totals(by=('day',), start=self.SECOND),
+                         {(self.SECOND,): {'count': 1, 'amount': 1.22, 'failed': 0, 'subsequent': 0}})
+        self.assertEqual(self.store.totals(end=self.FIRST), {})
+
+    def test_tax_totals(self):
+        # the failed invoice is not included
+        self.assertEqual(self.store.tax_totals(by=('rate',)), {
+            (22.0,): {'taxable': 21.0, 'tax': 4.62},
+            (9.5,): {'taxable': 2.0, 'tax': 0.19},
+            (0.0,): {'taxable': 1.06, 'tax': 0.0},
+        })
+        self.assertEqual(self.store.tax_totals(by=('category',)), {
+            ('VAT',): {'taxable': 23.0, 'tax': 4.81},
+            ('EXEMPT',): {'taxable': 1.06, 'tax': 0.0},
+        })
+        self.assertEqual(self.store.tax_totals(by=('seller', 'rate'), start=self.SECOND),
+                         {('12345678', 22.0): {'taxable': 1.0, 'tax': 0.22}})
+
+    def test_eors(self):
+        self.assertEqual(self.store.eors(), ['eor-1', 'eor-2', None, 'eor-4'])
+        self.assertEqual(self.store.eors(1, 3), ['eor-2', None])
+
+    def test_reopen_and_readonly(self):
+        reader = InvoiceColumnStore(self.path, readonly=True)
+        self.addCleanup(reader.close)
+        self.assertEqual(reader.totals(by=()), self.store.totals(by=()))
+        self.assertRaises(ValueError, reader.append, _message(self.FIRST, 'BP101', 'B1', 1))
+
+        self.store.close()
+        store = InvoiceColumnStore(self.path)
+        self.addCleanup(store.close)
+        store.append(_message(self.SECOND, 'BP102', 'B1', 1.22, vat=[(22, 1, 0.22)]), eor='eor-5')
+        self.assertEqual(store.totals(by=('premise',))[('BP102',)]['count'], 2)
+        self.assertEqual(store.eors(3), ['eor-4', 'eor-5'])
+        # the reader picks up strings added to the dictionary by the writer
+        self.assertEqual(reader.totals(by=('premise',))[('BP102',)]['amount'], 2.44)
+
+
+if __name__ == '__main__':
+    unittest.main()
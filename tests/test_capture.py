@@ -0,0 +1,88 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from furs_fiscal.api import FURSInvoiceAPI, TaxesPerSeller
+from furs_fiscal.capture import REDACTED_ZOI, TrafficCapture, load_capture
+from furs_fiscal.replay import Replay, percentile
+from furs_fiscal.simulator import FURSSimulator
+from furs_fiscal.transport import LoopbackTransport
+
+
+P12_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'demos', 'demo_podjetje.p12')
+P12_PASSWORD = 'Geslo123#'
+
+
+class CaptureReplayTest(unittest.TestCase):
+
+    INVOICES = 5
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'traffic.jsonl')
+
+    def _api(self, **kwargs):
+        api = FURSInvoiceAPI(p12_path=P12_PATH, p12_password=P12_PASSWORD, endpoint='https://localhost', **kwargs)
+        self.addCleanup(api.connector.close)
+        return api
+
+    def _capture_traffic(self, capture):
+        api = self._api(transport=LoopbackTransport(), capture=capture)
+        seller = TaxesPerSeller()
+        seller.add_vat_amount(tax_rate=22, tax_base=10, tax_amount=2.2)
+
+        for number in range(1, self.INVOICES + 1):
+            invoice = dict(tax_number=10039856, issued_date=datetime.datetime.now(), invoice_number=str(number),
+                           business_premise_id='BP101', electronic_device_id='B1', invoice_amount=12.2)
+            api.get_invoice_eor(zoi=api.calculate_zoi(**invoice), taxes_per_seller=[seller],
+                                operator_tax_number=12345678, customer_vat_number='SI87654321', **invoice)
+        capture.close()
+
+    def test_capture_then_replay(self):
+        self._capture_traffic(TrafficCapture(self.path))
+
+        records = load_capture(self.path)
+        self.assertEqual(len(records), self.INVOICES)
+        self.assertEqual([record['status'] for record in records], [200] * self.INVOICES)
+        self.assertEqual(records, sorted(records, key=lambda record: record['time']))
+
+        invoices = [record['payload']['InvoiceRequest']['Invoice'] for record in records]
+        self.assertEqual([invoice['InvoiceIdentifier']['InvoiceNumber'] for invoice in invoices],
+                         [str(number) for number in range(1, self.INVOICES + 1)])
+        for invoice in invoices:
+            self.assertEqual(invoice['ProtectedID'], REDACTED_ZOI)
+            self.assertNotEqual(invoice['OperatorTaxNumber'], 12345678)
+            self.assertNotEqual(invoice['CustomerVATNumber'], 'SI87654321')
+            self.assertEqual(invoice['TaxNumber'], 10039856)
+        # pseudonyms are stable within a capture
+        self.assertEqual(len(set(invoice['OperatorTaxNumber'] for invoice in invoices)), 1)
+
+        simulator = FURSSimulator()
+        result = Replay(self._api(transport=LoopbackTransport(simulator)), records, speed=100).run()
+
+        self.assertEqual(result['errors'], {})
+        self.assertEqual(result['requests'], self.INVOICES)
+        self.assertEqual(simulator.requests, self.INVOICES)
+        self.assertIsNotNone(result['latency']['max'])
+
+    def test_capture_without_redaction(self):
+        self._capture_traffic(TrafficCapture(self.path, redact=False))
+
+        invoice = load_capture(self.path)[-1]['payload']['InvoiceRequest']['Invoice']
+        self.assertNotEqual(invoice['ProtectedID'], REDACTED_ZOI)
+        self.assertEqual(invoice['OperatorTaxNumber'], 12345678)
+        self.assertEqual(invoice['CustomerVATNumber'], 'SI87654321')
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99.9), 100)
+        self.assertEqual(percentile([3], 0), 3)
+        self.assertIsNone(percentile([], 50))
+
+
+if __name__ == '__main__':
+    unittest.main()
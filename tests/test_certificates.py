@@ -0,0 +1,179 @@
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import BestAvailableEncryption, pkcs12
+from cryptography.x509.oid import NameOID
+
+from furs_fiscal.api import FURSInvoiceAPI, TaxesPerSeller
+from furs_fiscal.transport import LoopbackTransport
+
+
+P12_PASSWORD = 'Geslo123#'
+
+
+def _make_p12(serial):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'TEST %d' % serial)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (x509.CertificateBuilder()
+                   .subject_name(name)
+                   .issuer_name(name)
+                   .public_key(key.public_key())
+                   .serial_number(serial)
+                   .not_valid_before(now - datetime.timedelta(days=1))
+                   .not_valid_after(now + datetime.timedelta(days=365))
+                   .sign(key, hashes.SHA256()))
+    return pkcs12.serialize_key_and_certificates(b'test', key, certificate, None,
+                                                 BestAvailableEncryption(P12_PASSWORD.encode('utf-8')))
+
+
+class CertificateRotationTest(unittest.TestCase):
+
+    THREADS = 8
+    ROTATIONS = 5
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # PEM files of the bundles are written here, so leaks can be seen
+        self.pem_directory = os.path.join(self.directory, 'pem')
+        os.mkdir(self.pem_directory)
+        patcher = mock.patch.object(tempfile, 'tempdir', self.pem_directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        self.p12_path = os.path.join(self.directory, 'cert.p12')
+        self.p12s = [_make_p12(serial) for serial in (1001, 1002)]
+        self._write_p12(self.p12s[0])
+
+    def _write_p12(self, p12):
+        # atomically, as the README asks
+        temp_path = self.p12_path + '.new'
+        with open(temp_path, 'wb') as p12_file:
+            p12_file.write(p12)
+        os.replace(temp_path, self.p12_path)
+
+    def _api(self, **kwargs):
+        return FURSInvoiceAPI(p12_path=self.p12_path, p12_password=P12_PASSWORD, endpoint='https://localhost',
+                              transport=LoopbackTransport(), reload_interval=0.01, **kwargs)
+
+    def _wait_for_serial(self, api, serial):
+        deadline = time.monotonic() + 5
+        while api.connector.certificate.serial != serial:
+            self.assertLess(time.monotonic(), deadline, "certificate %s was not loaded" % serial)
+            time.sleep(0.005)
+
+    def test_rotation_under_load(self):
+        api = self._api()
+        seller = TaxesPerSeller()
+        seller.add_vat_amount(tax_rate=22, tax_base=10, tax_amount=2.2)
+
+        stop = threading.Event()
+        errors = []
+        issued = [0] * self.THREADS
+
+        def issue(index):
+            number = 0
+            while not stop.is_set():
+                number += 1
+                issued_date = datetime.datetime.now()
+                try:
+                    zoi = api.calculate_zoi(tax_number=10039856, issued_date=issued_date,
+                                            invoice_number=str(number), business_premise_id='BP101',
+                                            electronic_device_id='B%d' % index, invoice_amount=12.2)
+                    api.get_invoice_eor(zoi=zoi, tax_number=10039856, issued_date=issued_date,
+                                        invoice_number=str(number), business_premise_id='BP101',
+                                        electronic_device_id='B%d' % index, invoice_amount=12.2,
+                                        taxes_per_seller=[seller])
+                    issued[index] += 1
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=issue, args=(index,)) for index in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        try:
+            for rotation in range(1, self.ROTATIONS + 1):
+                time.sleep(0.05)
+                self._write_p12(self.p12s[rotation % 2])
+                self._wait_for_serial(api, str(1001 + rotation % 2))
+            time.sleep(0.05)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertTrue(all(issued))
+
+        # only the current certificate's files are left, and none after close
+        self.assertEqual(len(os.listdir(self.pem_directory)), 2)
+        api.connector.close()
+        self.assertEqual(os.listdir(self.pem_directory), [])
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "needs fork")
+    def test_fork_then_rotate(self):
+        api = self._api()
+        parent_files = api.connector.certificate.cert
+        ready_read, ready_write = os.pipe()
+        rotated_read, rotated_write = os.pipe()
+
+        pid = os.fork()
+        if pid == 0:
+            # child: exit code 0 only if its own files survive the rotation in the parent and are removed on close
+            status = 1
+            try:
+                child_files = api.connector.certificate.cert
+                os.write(ready_write, b'1')
+                os.read(rotated_read, 1)
+                if child_files != parent_files and all(os.path.exists(path) for path in child_files):
+                    api.connector.send_echo()
+                    api.connector.close()
+                    if not any(os.path.exists(path) for path in child_files):
+                        status = 0
+            finally:
+                os._exit(status)
+
+        os.read(ready_read, 1)
+        self._write_p12(self.p12s[1])
+        self._wait_for_serial(api, '1002')
+        # the parent removed its old files, the child still has to work
+        self.assertFalse(any(os.path.exists(path) for path in parent_files))
+        os.write(rotated_write, b'1')
+
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+        for descriptor in (ready_read, ready_write, rotated_read, rotated_write):
+            os.close(descriptor)
+
+        # the child did not remove the parent's current files
+        self.assertTrue(all(os.path.exists(path) for path in api.connector.certificate.cert))
+        api.connector.close()
+
+    def test_zoi_cache_follows_certificate(self):
+        api = self._api(deterministic_zoi=True)
+        invoice = dict(tax_number=10039856, issued_date=datetime.datetime(2020, 1, 1, 12), invoice_number='1',
+                       business_premise_id='BP101', electronic_device_id='B1', invoice_amount=12.2)
+        first = api.calculate_zoi(**invoice)
+
+        self._write_p12(self.p12s[1])
+        self._wait_for_serial(api, '1002')
+
+        second = api.calculate_zoi(**invoice)
+        self.assertNotEqual(first, second)
+        self.assertTrue(api.verify_zoi(second, **invoice))
+        api.connector.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import datetime
+import http.client
+import os
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+from furs_fiscal import daemon
+from furs_fiscal.api import TaxesPerSeller
+from furs_fiscal.client import FURSDaemonClient
+from furs_fiscal.daemon import FiscalAPI, HTTPDaemonServer
+from furs_fiscal.health import HealthMonitor
+from furs_fiscal.transport import LoopbackTransport
+
+
+P12_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'demos', 'demo_podjetje.p12')
+P12_PASSWORD = 'Geslo123#'
+
+
+class FURSDaemonClientTest(unittest.TestCase):
+
+    def setUp(self):
+        # idle connections are closed by the daemon quickly, so the tests do not wait for it
+        patcher = mock.patch.object(daemon._DaemonRequestHandler, 'timeout', 0.1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.api = FiscalAPI(p12_path=P12_PATH, p12_password=P12_PASSWORD, endpoint='https://localhost',
+                             transport=LoopbackTransport(), health_monitor=HealthMonitor())
+        self.server = HTTPDaemonServer(self.api, port=0)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.stop)
+        self.addCleanup(self.api.connector.close)
+
+        self.client = FURSDaemonClient(port=self.server.server_address[1], idle_timeout=60)
+        self.seller = TaxesPerSeller()
+        self.seller.add_vat_amount(tax_rate=22, tax_base=10, tax_amount=2.2)
+        self.invoice = (10039856, datetime.datetime(2020, 1, 1, 12), '1', 'BP101', 'B1', 12.2)
+
+    def test_positional_arguments(self):
+        zoi = self.client.calculate_zoi(*self.invoice)
+        eor = self.client.get_invoice_eor(zoi, *self.invoice, [self.seller])
+        self.assertTrue(eor)
+
+        with self.assertRaises(TypeError):
+            self.client.get_invoice_eor(zoi, *self.invoice, unknown=1)
+        self.assertEqual(self.client.stats()['calls']['get_invoice_eor'], 1)
+
+    def test_reconnect_after_daemon_closed_idle_connection(self):
+        self.assertIn('calls', self.client.stats())
+        time.sleep(0.3)
+        self.assertIn('calls', self.client.stats())
+        time.sleep(0.3)
+        self.assertIn('accessible', self.client.health())
+        time.sleep(0.3)
+        self.assertIn('accessible', self.client.health())
+
+    def test_invoice_not_sent_twice(self):
+        zoi = self.client.calculate_zoi(*self.invoice)
+        getresponse = http.client.HTTPConnection.getresponse
+        failures = []
+
+        def fail_once(connection):
+            if not failures:
+                failures.append(connection)
+                connection.sock.recv(65536)
+                raise http.client.RemoteDisconnected("closed")
+            return getresponse(connection)
+
+        with mock.patch.object(http.client.HTTPConnection, 'getresponse', fail_once):
+            with self.assertRaises(http.client.RemoteDisconnected):
+                self.client.get_invoice_eor(zoi, *self.invoice, [self.seller])
+        self.assertEqual(self.client.stats()['calls']['get_invoice_eor'], 1)
+
+        # repeating calculate_zoi is harmless, it is retried
+        failures.clear()
+        with mock.patch.object(http.client.HTTPConnection, 'getresponse', fail_once):
+            self.assertTrue(self.client.calculate_zoi(*self.invoice))
+        self.assertEqual(self.client.stats()['calls']['calculate_zoi'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import threading
+import time
+import unittest
+
+from furs_fiscal.health import HealthMonitor
+from furs_fiscal.transport import TransportResponse
+
+
+class _SlowEchoConnector(object):
+
+    def __init__(self, delay, status=200):
+        self.delay = delay
+        self.status = status
+        self.echoes = 0
+
+    def send_echo(self):
+        self.echoes += 1
+        time.sleep(self.delay)
+        return TransportResponse(self.status, b'{}')
+
+
+class HealthMonitorTest(unittest.TestCase):
+
+    def test_concurrent_checks_share_one_echo(self):
+        connector = _SlowEchoConnector(0.1)
+        monitor = HealthMonitor(connector, ttl=10)
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(monitor.is_accessible())) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [True] * 20)
+        self.assertEqual(connector.echoes, 1)
+
+    def test_background_refresh_keeps_result_fresh(self):
+        connector = _SlowEchoConnector(0.01)
+        monitor = HealthMonitor(connector, ttl=0.2)
+        with monitor:
+            time.sleep(0.05)
+            for _ in range(10):
+                self.assertLess(monitor.status()['age'], 0.2)
+                self.assertTrue(monitor.is_accessible())
+                time.sleep(0.05)
+        # checks never found an old result, so they never sent echoes of their own
+        self.assertEqual(monitor.status()['echoes'], connector.echoes)
+        self.assertLessEqual(connector.echoes, 8)
+
+    def test_failed_echo(self):
+        monitor = HealthMonitor(_SlowEchoConnector(0, status=500), ttl=10)
+        self.assertFalse(monitor.is_accessible())
+        self.assertEqual(monitor.status()['error'], 'HTTP 500')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from decimal import Decimal
+
+from furs_fiscal.api import FURSInvoiceAPI, TaxesPerSeller
+from furs_fiscal.index import InvoiceIndex
+from furs_fiscal.transport import LoopbackTransport
+
+
+P12_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'demos', 'demo_podjetje.p12')
+P12_PASSWORD = 'Geslo123#'
+
+
+class InvoiceIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'invoices.jsonl')
+
+        self.index = InvoiceIndex(path=self.path, business_premise_id='BP101', electronic_device_id='B1')
+        self.addCleanup(self.index.close)
+        self.api = FURSInvoiceAPI(p12_path=P12_PATH, p12_password=P12_PASSWORD, endpoint='https://localhost',
+                                  transport=LoopbackTransport(), listeners=[self.index])
+        self.addCleanup(self.api.connector.close)
+
+        self.seller = TaxesPerSeller()
+        self.seller.add_vat_amount(tax_rate=22, tax_base=10, tax_amount=2.2)
+        self.issued_date = datetime.datetime(2020, 1, 1, 12)
+
+    def _issue(self, invoice_number, **kwargs):
+        invoice = dict(tax_number=10039856, issued_date=self.issued_date, invoice_number=invoice_number,
+                       business_premise_id='BP101', electronic_device_id='B1', invoice_amount=12.2)
+        invoice.update(kwargs)
+        zoi = self.api.calculate_zoi(**{key: invoice[key] for key in ('tax_number', 'issued_date', 'invoice_number',
+                                                                      'business_premise_id', 'electronic_device_id',
+                                                                      'invoice_amount')})
+        return self.api.get_invoice_eor(zoi=zoi, taxes_per_seller=[self.seller], **invoice)
+
+    def test_storno_from_invoice_number(self):
+        eor = self._issue('11')
+        self._issue('12')
+
+        invoice = self.index.get('11')
+        self.assertEqual(invoice.eor, eor)
+        self.assertEqual(invoice.issued_date, self.issued_date)
+
+        kwargs = self.index.storno_kwargs('11')
+        self.assertEqual(kwargs, {
+            'reference_invoice_number': '11',
+            'reference_invoice_business_premise_id': 'BP101',
+            'reference_invoice_electronic_device_id': 'B1',
+            'reference_invoice_issued_date': self.issued_date,
+            'invoice_amount': -12.2,
+        })
+        self.assertRaises(KeyError, self.index.storno_kwargs, '99')
+
+        self._issue('13', **kwargs)
+        self.assertTrue(self.index.is_cancelled('11'))
+        self.assertFalse(self.index.is_cancelled('12'))
+
+        # the storno itself and the cancelled invoice are skipped
+        day = self.index.storno_kwargs_for_day(self.issued_date.date())
+        self.assertEqual([kwargs['reference_invoice_number'] for kwargs in day], ['12'])
+
+    def test_journal_is_reloaded(self):
+        self.index.add('BP101', 'B1', '21', self.issued_date, Decimal('5.10'), 'a' * 32, 'eor-21')
+        self.index.add_cancelled('BP101', 'B1', '21')
+        self.index.add_sales_book('BP101', '01', '123456789012', '1', self.issued_date.date(), Decimal('1.00'),
+                                  'eor-sb')
+        self.index.close()
+
+        index = InvoiceIndex(path=self.path, business_premise_id='BP101', electronic_device_id='B1')
+        self.addCleanup(index.close)
+        self.assertEqual(index.get('21'), self.index.get('21'))
+        self.assertEqual(index.get('21').invoice_amount, Decimal('5.10'))
+        self.assertTrue(index.is_cancelled('21'))
+        self.assertEqual(index.storno_kwargs_for_day(self.issued_date.date()), [])
+        self.assertEqual(index.sales_book_reference_kwargs('1', '01', '123456789012')['reference_sales_book_number'],
+                         '1')
+
+
+if __name__ == '__main__':
+    unittest.main()
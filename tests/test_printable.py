@@ -0,0 +1,65 @@
+import struct
+import unittest
+import zlib
+
+from furs_fiscal import printable
+
+
+DATA_RECORD = '223575694612345678901234567890123456789012345678901015121259'
+
+
+class PrintableTest(unittest.TestCase):
+
+    def test_qr_matrix(self):
+        matrix = printable.qr_matrix(DATA_RECORD)
+        # version 2 fits 60 digits at level M
+        self.assertEqual(len(matrix), 25)
+        self.assertTrue(all(len(row) == 25 for row in matrix))
+        # finder pattern in the top left corner
+        self.assertEqual(matrix[0][:7], [True] * 7)
+        self.assertEqual(matrix[1][:7], [True] + [False] * 5 + [True])
+        self.assertRaises(ValueError, printable.qr_matrix, 'ABC')
+
+    def test_code128_matrix(self):
+        modules = printable.code128_modules(DATA_RECORD)
+        # start, 30 digit pairs, checksum, stop (13 modules)
+        self.assertEqual(len(modules), 11 * 32 + 13)
+        matrix = printable.code128_matrix(DATA_RECORD, height=10)
+        self.assertEqual(len(matrix), 10)
+        self.assertRaises(ValueError, printable.code128_modules, '123')
+
+    def test_png(self):
+        matrix = printable.qr_matrix(DATA_RECORD)
+        png = printable.to_png(matrix, scale=2, quiet_zone=4)
+        self.assertTrue(png.startswith(b'\x89PNG\r\n\x1a\n'))
+        width, height = struct.unpack('>II', png[16:24])
+        self.assertEqual((width, height), ((25 + 8) * 2, (25 + 8) * 2))
+
+        # first pixel row is quiet zone (white), row 8 starts the finder pattern after the margin
+        idat = png.index(b'IDAT')
+        length = struct.unpack('>I', png[idat - 4:idat])[0]
+        raw = zlib.decompress(png[idat + 4:idat + 4 + length])
+        stride = 1 + (width + 7) // 8
+        self.assertEqual(set(raw[1:stride]), {255})
+        self.assertEqual(raw[8 * stride + 1], 0xff)
+        self.assertEqual(raw[8 * stride + 2], 0x00)
+
+    def test_escpos_raster(self):
+        raster = printable.to_escpos_raster(printable.qr_matrix(DATA_RECORD), scale=4)
+        width_bytes, height = struct.unpack('<HH', raster[4:8])
+        self.assertEqual(raster[:4], b'\x1dv0\x00')
+        self.assertEqual((width_bytes, height), ((25 * 4 + 7) // 8, 25 * 4))
+        self.assertEqual(len(raster), 8 + width_bytes * height)
+
+    def test_pdf417_is_only_native(self):
+        command = printable.escpos_pdf417(DATA_RECORD)
+        self.assertIn(DATA_RECORD.encode('ascii'), command)
+
+        self.assertRaises(NotImplementedError, printable.pdf417_matrix, DATA_RECORD)
+        for render in (printable.to_png, printable.to_svg, printable.to_escpos_raster):
+            with self.assertRaisesRegex(TypeError, 'PDF417'):
+                render(command)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import datetime
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from unittest import mock
+
+from furs_fiscal import profiling
+from furs_fiscal.api import FURSInvoiceAPI, TaxesPerSeller
+from furs_fiscal.profiling import SlowRequestProfiler
+from furs_fiscal.simulator import FURSSimulator
+from furs_fiscal.transport import LoopbackTransport
+
+
+P12_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'demos', 'demo_podjetje.p12')
+P12_PASSWORD = 'Geslo123#'
+
+
+def _slow_work(seconds):
+    time.sleep(seconds)
+
+
+class SlowRequestProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        # slow calls are logged as warnings
+        patcher = mock.patch.object(profiling.logger, 'warning')
+        self.warning = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _call(self, profiler, seconds):
+        with profiling.call(profiler, 'send_request'):
+            with profiling.phase(profiler, 'validate'):
+                pass
+            with profiling.phase(profiler, 'transport'):
+                _slow_work(seconds)
+
+    def test_only_slow_calls_are_kept(self):
+        profiler = SlowRequestProfiler(threshold=0.1, interval=0.005, sample_after=0.01, directory=self.directory)
+
+        self._call(profiler, 0)
+        self.assertEqual(profiler.profiles(), [])
+        self.assertEqual(os.listdir(self.directory), [])
+        self.warning.assert_not_called()
+
+        self._call(profiler, 0.2)
+        profile, = profiler.profiles()
+        self.assertEqual(profile['name'], 'send_request')
+        self.assertGreaterEqual(profile['elapsed'], 0.2)
+        self.assertEqual(set(profile['phases']), {'validate', 'transport'})
+        self.assertGreaterEqual(profile['phases']['transport'], 0.2)
+
+        for line in profile['folded']:
+            stack, count = line.rsplit(' ', 1)
+            self.assertTrue(stack.startswith('send_request;'), stack)
+            self.assertGreater(int(count), 0)
+        # almost all samples are taken while sleeping in the transport phase
+        self.assertTrue(any(line.startswith('send_request;transport;') and '_slow_work (test_profiling.py:' in line
+                            for line in profile['folded']))
+
+        written, = os.listdir(self.directory)
+        with open(os.path.join(self.directory, written)) as folded:
+            self.assertEqual(folded.read().splitlines(), profile['folded'])
+
+        stats = profiler.stats()
+        self.assertEqual((stats['calls'], stats['slow']), (2, 1))
+        self.assertGreater(stats['samples'], 0)
+        self.assertEqual(self.warning.call_count, 1)
+
+    def test_fast_calls_are_not_sampled(self):
+        profiler = SlowRequestProfiler(threshold=0.01, interval=0.001, sample_after=10)
+        self._call(profiler, 0.05)
+
+        profile, = profiler.profiles()
+        self.assertEqual(profile['folded'], [])
+        self.assertEqual(profiler.stats()['samples'], 0)
+
+    def test_slow_request_phases(self):
+        profiler = SlowRequestProfiler(threshold=0.1, interval=0.005, sample_after=0.01)
+        api = FURSInvoiceAPI(p12_path=P12_PATH, p12_password=P12_PASSWORD, endpoint='https://localhost',
+                             transport=LoopbackTransport(FURSSimulator(latency=0.15)), profiler=profiler)
+        self.addCleanup(api.connector.close)
+
+        seller = TaxesPerSeller()
+        seller.add_vat_amount(tax_rate=22, tax_base=10, tax_amount=2.2)
+        invoice = dict(tax_number=10039856, issued_date=datetime.datetime.now(), invoice_number='1',
+                       business_premise_id='BP101', electronic_device_id='B1', invoice_amount=12.2)
+        api.get_invoice_eor(zoi=api.calculate_zoi(**invoice), taxes_per_seller=[seller], **invoice)
+
+        # calculate_zoi was fast and is not kept
+        profile, = profiler.profiles()
+        self.assertEqual(profile['name'], 'send_request')
+        self.assertGreaterEqual(profile['phases']['post;transport'], 0.15)
+        self.assertTrue(any(line.startswith('send_request;post;transport;') for line in profile['folded']))
+
+
+if __name__ == '__main__':
+    unittest.main()
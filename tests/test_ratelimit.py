@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from furs_fiscal.exceptions import RateLimitTimeoutException
+from furs_fiscal.ratelimit import RateLimiter
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.state_path = os.path.join(self.directory, 'limits')
+
+    def _limiter(self, **kwargs):
+        limiter = RateLimiter(state_path=self.state_path, **kwargs)
+        self.addCleanup(limiter.close)
+        return limiter
+
+    def _identity(self):
+        stat = os.stat(self.state_path)
+        return stat.st_ino, stat.st_mtime_ns
+
+    def test_burst_then_wait(self):
+        limiter = self._limiter(limits={'limited': (1, 3)})
+        for _ in range(3):
+            self.assertEqual(limiter._take('key', 'limited'), 0)
+        self.assertGreater(limiter._take('key', 'limited'), 0)
+
+        limiter.set_limit('slow', rate=0.1, burst=1)
+        limiter.acquire('key', 'slow')
+        with self.assertRaises(RateLimitTimeoutException):
+            limiter.acquire('key', 'slow', timeout=0.05)
+
+    def test_unlimited_path_does_not_write_state(self):
+        limiter = self._limiter(limits={'limited': (1000, 3)})
+        identity = self._identity()
+        for _ in range(100):
+            limiter.acquire('key', 'unlimited')
+        self.assertEqual(self._identity(), identity)
+
+    def test_waiting_does_not_write_state(self):
+        limiter = self._limiter(limits={'limited': (0.01, 1)})
+        limiter.acquire('key', 'limited')
+        identity = self._identity()
+        for _ in range(10):
+            self.assertGreater(limiter._take('key', 'limited'), 0)
+        self.assertEqual(self._identity(), identity)
+
+    def test_limits_shared_between_limiters(self):
+        first = self._limiter()
+        second = self._limiter()
+        self.assertEqual(first._take('key', 'path'), 0)
+
+        # a limit set through another limiter applies to a path this one knew as unlimited
+        second.set_limit('path', rate=0.01, burst=1)
+        self.assertEqual(first._take('key', 'path'), 0)
+        self.assertGreater(first._take('key', 'path'), 0)
+
+    def test_corrupt_state(self):
+        with open(self.state_path, 'w') as state_file:
+            state_file.write('{corrupt')
+        limiter = self._limiter(limits={'limited': (1, 1)})
+        self.assertEqual(limiter.get_limits(), {'limited': [1, 1]})
+        self.assertEqual(limiter._take('key', 'limited'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
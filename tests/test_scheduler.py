@@ -0,0 +1,101 @@
+import datetime
+import os
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+from requests.exceptions import Timeout
+
+from furs_fiscal.api import FURSInvoiceAPI, TaxesPerSeller
+from furs_fiscal.exceptions import ConnectionTimedOutException
+from furs_fiscal.scheduler import PRIORITY_BULK, PRIORITY_INTERACTIVE, PriorityScheduler
+from furs_fiscal.transport import LoopbackTransport
+
+
+P12_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'demos', 'demo_podjetje.p12')
+P12_PASSWORD = 'Geslo123#'
+
+
+class PrioritySchedulerTest(unittest.TestCase):
+
+    def test_interactive_before_bulk(self):
+        scheduler = PriorityScheduler(max_concurrency=1)
+        scheduler.acquire(PRIORITY_BULK)
+
+        order = []
+
+        def request(priority):
+            scheduler.acquire(priority)
+            order.append(priority)
+            scheduler.release(priority)
+
+        threads = [threading.Thread(target=request, args=(PRIORITY_BULK,))]
+        threads[0].start()
+        self._wait_for_queued(scheduler, PRIORITY_BULK, 1)
+        threads.append(threading.Thread(target=request, args=(PRIORITY_INTERACTIVE,)))
+        threads[1].start()
+        self._wait_for_queued(scheduler, PRIORITY_INTERACTIVE, 1)
+
+        scheduler.release(PRIORITY_BULK)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [PRIORITY_INTERACTIVE, PRIORITY_BULK])
+
+    def test_interrupted_wait_leaves_queue(self):
+        scheduler = PriorityScheduler(max_concurrency=1)
+        scheduler.acquire(PRIORITY_BULK)
+
+        with mock.patch.object(scheduler._condition, 'wait', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                scheduler.acquire(PRIORITY_INTERACTIVE)
+        self.assertEqual(scheduler.stats()[PRIORITY_INTERACTIVE]['queued'], 0)
+
+        # the slot goes to the next caller, not to the abandoned ticket
+        scheduler.release(PRIORITY_BULK)
+        scheduler.acquire(PRIORITY_BULK)
+        self.assertEqual(scheduler.stats()[PRIORITY_BULK]['in_flight'], 1)
+
+    def test_acquire_timeout(self):
+        scheduler = PriorityScheduler(max_concurrency=1)
+        scheduler.acquire(PRIORITY_BULK)
+
+        started = time.monotonic()
+        with self.assertRaises(Timeout):
+            scheduler.acquire(PRIORITY_INTERACTIVE, timeout=0.1)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(scheduler.stats()[PRIORITY_INTERACTIVE]['queued'], 0)
+
+    def test_time_limit_while_slots_held(self):
+        scheduler = PriorityScheduler(max_concurrency=2)
+        api = FURSInvoiceAPI(p12_path=P12_PATH, p12_password=P12_PASSWORD, endpoint='https://localhost',
+                             transport=LoopbackTransport(), scheduler=scheduler)
+        self.addCleanup(api.connector.close)
+        for _ in range(2):
+            scheduler.acquire(PRIORITY_BULK)
+
+        seller = TaxesPerSeller()
+        seller.add_vat_amount(tax_rate=22, tax_base=10, tax_amount=2.2)
+        issued_date = datetime.datetime.now()
+        invoice = dict(tax_number=10039856, issued_date=issued_date, invoice_number='1', business_premise_id='BP101',
+                       electronic_device_id='B1', invoice_amount=12.2)
+        zoi = api.calculate_zoi(**invoice)
+
+        started = time.monotonic()
+        with self.assertRaises(ConnectionTimedOutException):
+            api.get_invoice_eor(zoi=zoi, taxes_per_seller=[seller], time_limit=0.2, **invoice)
+        elapsed = time.monotonic() - started
+        self.assertGreaterEqual(elapsed, 0.2)
+        self.assertLess(elapsed, 0.7)
+        self.assertEqual(scheduler.stats()[PRIORITY_INTERACTIVE]['queued'], 0)
+
+    def _wait_for_queued(self, scheduler, priority, count):
+        deadline = time.monotonic() + 5
+        while scheduler.stats()[priority]['queued'] != count:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.001)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+import unittest
+
+from unittest import mock
+
+from furs_fiscal import sequences
+from furs_fiscal.sequences import RESULT_DUPLICATE, RESULT_FILLED, RESULT_GAP, RESULT_NEXT, NumberRuns, \
+    SequenceTracker
+
+
+class NumberRunsTest(unittest.TestCase):
+
+    def test_runs(self):
+        runs = NumberRuns()
+        for number in (1, 2, 3, 6, 7):
+            runs.add(number)
+        self.assertEqual(runs.runs(), [(1, 3), (6, 7)])
+        self.assertEqual(runs.gaps(), [(4, 5)])
+
+        self.assertEqual(runs.add(5), RESULT_FILLED)
+        self.assertEqual(runs.add(4), RESULT_FILLED)
+        self.assertEqual(runs.runs(), [(1, 7)])
+        self.assertEqual(runs.add(8), RESULT_NEXT)
+        self.assertEqual(runs.add(3), RESULT_DUPLICATE)
+        self.assertEqual(runs.duplicates, {3: 2})
+
+
+class SequenceTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'sequences.json')
+
+    def test_out_of_order_numbers_are_not_logged(self):
+        tracker = SequenceTracker(gap_grace=60)
+        with mock.patch.object(sequences.logger, 'warning') as warning:
+            self.assertEqual(tracker.add_invoice('BP101', 'B1', 1), 'first')
+            self.assertEqual(tracker.add_invoice('BP101', 'B1', 3), RESULT_GAP)
+            self.assertEqual(tracker.add_invoice('BP101', 'B1', 2), RESULT_FILLED)
+            tracker.close()
+        warning.assert_not_called()
+        self.assertEqual(tracker.gaps(), {})
+
+    def test_gap_logged_after_grace(self):
+        tracker = SequenceTracker(gap_grace=0.05)
+        tracker.add_invoice('BP101', 'B1', 1)
+        tracker.add_invoice('BP101', 'B1', 5)
+        tracker.add_invoice('BP101', 'B1', 3)
+        time.sleep(0.1)
+        with self.assertLogs('furs_fiscal.sequences', level='WARNING') as logs:
+            tracker.add_invoice('BP101', 'B1', 6)
+        self.assertEqual([record.getMessage() for record in logs.records],
+                         ['Invoice number 2 of invoice/BP101/B1 is missing',
+                          'Invoice number 4 of invoice/BP101/B1 is missing'])
+        self.assertEqual(tracker.gaps(), {('invoice', 'BP101', 'B1'): [(2, 2), (4, 4)]})
+
+    def test_saved_at_exit(self):
+        script = textwrap.dedent('''
+            from furs_fiscal.sequences import SequenceTracker
+            tracker = SequenceTracker(%r, save_interval=3600)
+            for number in range(1, 11):
+                tracker.add_invoice('BP101', 'B1', number)
+        ''' % self.path)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.check_call([sys.executable, '-c', script], cwd=root)
+
+        tracker = SequenceTracker(self.path)
+        self.assertEqual(tracker.stats()['runs'], 1)
+        self.assertIn(10, tracker._sequences[('invoice', 'BP101', 'B1')])
+        self.assertEqual(tracker.add_invoice('BP101', 'B1', 11), RESULT_NEXT)
+
+
+if __name__ == '__main__':
+    unittest.main()
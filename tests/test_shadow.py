@@ -0,0 +1,94 @@
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from furs_fiscal.api import FURSInvoiceAPI, TaxesPerSeller
+from furs_fiscal.shadow import OUTCOME_OK, ShadowMirror
+from furs_fiscal.transport import LoopbackTransport, TransportResponse
+
+
+P12_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'demos', 'demo_podjetje.p12')
+P12_PASSWORD = 'Geslo123#'
+
+
+class _BlockingTransport(LoopbackTransport):
+
+    def __init__(self):
+        super(_BlockingTransport, self).__init__()
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def post(self, url, json, headers, timeout, cert):
+        self.entered.set()
+        self.release.wait()
+        return super(_BlockingTransport, self).post(url, json, headers, timeout, cert)
+
+
+class _FailingTransport(LoopbackTransport):
+
+    def post(self, url, json, headers, timeout, cert):
+        return TransportResponse(500, b'{}')
+
+
+class ShadowMirrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.seller = TaxesPerSeller()
+        self.seller.add_vat_amount(tax_rate=22, tax_base=10, tax_amount=2.2)
+
+    def _api(self, transport, **kwargs):
+        api = FURSInvoiceAPI(p12_path=P12_PATH, p12_password=P12_PASSWORD, endpoint='https://localhost',
+                             transport=transport, **kwargs)
+        self.addCleanup(api.connector.close)
+        return api
+
+    def _issue(self, api, invoice_number):
+        invoice = dict(tax_number=10039856, issued_date=datetime.datetime.now(), invoice_number=str(invoice_number),
+                       business_premise_id='BP101', electronic_device_id='B1', invoice_amount=12.2)
+        return api.get_invoice_eor(zoi=api.calculate_zoi(**invoice), taxes_per_seller=[self.seller], **invoice)
+
+    def test_copies_are_dropped_when_queue_is_full(self):
+        transport = _BlockingTransport()
+        shadow = ShadowMirror(self._api(transport), capacity=2, tax_number=12345678)
+        api = self._api(LoopbackTransport(), shadow=shadow)
+
+        # the shadow thread takes the first copy and blocks on it
+        self._issue(api, 1)
+        self.assertTrue(transport.entered.wait(5))
+
+        # production requests do not wait for the shadow
+        for number in range(2, 6):
+            self.assertTrue(self._issue(api, number))
+        stats = shadow.stats()
+        self.assertEqual(stats['queued'], 2)
+        self.assertEqual(stats['dropped'], 2)
+
+        transport.release.set()
+        shadow.close(timeout=5)
+        stats = shadow.stats()
+        self.assertEqual((stats['mirrored'], stats['matched'], stats['dropped'], stats['different']), (3, 3, 2, 0))
+        self.assertIsNotNone(stats['shadow']['p50'])
+
+    def test_different_outcomes_are_recorded(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'diffs.jsonl')
+
+        shadow = ShadowMirror(self._api(_FailingTransport()), path=path)
+        api = self._api(LoopbackTransport(), shadow=shadow)
+        self._issue(api, 1)
+        shadow.close(timeout=5)
+
+        self.assertEqual(shadow.stats()['different'], 1)
+        diff, = shadow.diffs()
+        self.assertEqual(diff['production'], OUTCOME_OK)
+        self.assertEqual(diff['shadow'], 'ConnectionException 500')
+        with open(path) as diffs:
+            self.assertEqual(len(diffs.readlines()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
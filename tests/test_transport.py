@@ -0,0 +1,81 @@
+import datetime
+import os
+import socket
+import unittest
+
+import requests
+
+from furs_fiscal.api import FURSInvoiceAPI, TaxesPerSeller
+from furs_fiscal.simulator import SimulatorServer
+from furs_fiscal.transport import LoopbackTransport, RequestsTransport, Urllib3Transport
+
+
+P12_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'demos', 'demo_podjetje.p12')
+P12_PASSWORD = 'Geslo123#'
+
+ECHO_PATH = 'v1/cash_registers/echo'
+# the simulator speaks plain HTTP, client certificates are not used
+NO_CERT = (None, None)
+
+
+class TransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SimulatorServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def _transports(self):
+        for transport in (RequestsTransport(), Urllib3Transport()):
+            self.addCleanup(transport.close)
+            yield transport
+
+    def test_invoice_over_every_transport(self):
+        seller = TaxesPerSeller()
+        seller.add_vat_amount(tax_rate=22, tax_base=10, tax_amount=2.2)
+        invoice = dict(tax_number=10039856, issued_date=datetime.datetime(2020, 1, 1, 12), invoice_number='1',
+                       business_premise_id='BP101', electronic_device_id='B1', invoice_amount=12.2)
+
+        for transport in list(self._transports()) + [LoopbackTransport(self.server.simulator)]:
+            with self.subTest(transport=type(transport).__name__):
+                requests_before = self.server.simulator.requests
+                api = FURSInvoiceAPI(p12_path=P12_PATH, p12_password=P12_PASSWORD, endpoint=self.server.endpoint,
+                                     transport=transport)
+                self.addCleanup(api.connector.close)
+
+                self.assertTrue(api.is_server_accessible())
+                eor = api.get_invoice_eor(zoi=api.calculate_zoi(**invoice), taxes_per_seller=[seller], **invoice)
+                self.assertTrue(eor)
+                self.assertEqual(self.server.simulator.requests - requests_before, 2)
+
+    def test_response(self):
+        for transport in self._transports():
+            with self.subTest(transport=type(transport).__name__):
+                response = transport.post(url='%s/%s' % (self.server.endpoint, ECHO_PATH),
+                                          json={'EchoRequest': 'furs'}, headers={}, timeout=5, cert=NO_CERT)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), {'EchoResponse': 'furs'})
+                self.assertIn('furs', response.text)
+
+    def test_timeout(self):
+        self.server.simulator.latency = 0.5
+        for transport in self._transports():
+            with self.subTest(transport=type(transport).__name__):
+                self.assertRaises(requests.exceptions.Timeout, transport.post,
+                                  url='%s/%s' % (self.server.endpoint, ECHO_PATH), json={'EchoRequest': 'furs'},
+                                  headers={}, timeout=(1, 0.05), cert=NO_CERT)
+
+    def test_connection_refused(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            url = 'http://127.0.0.1:%d/%s' % (sock.getsockname()[1], ECHO_PATH)
+
+        for transport in self._transports():
+            with self.subTest(transport=type(transport).__name__):
+                with self.assertRaises(requests.exceptions.ConnectionError) as context:
+                    transport.post(url=url, json={}, headers={}, timeout=1, cert=NO_CERT)
+                self.assertNotIsInstance(context.exception, requests.exceptions.Timeout)
+
+
+if __name__ == '__main__':
+    unittest.main()
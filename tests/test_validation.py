@@ -0,0 +1,92 @@
+import copy
+import datetime
+import os
+import unittest
+
+from unittest import mock
+
+from furs_fiscal.api import FURSInvoiceAPI, TaxesPerSeller
+from furs_fiscal.exceptions import ValidationException
+from furs_fiscal.transport import LoopbackTransport
+from furs_fiscal.validation import get_errors, validate, validate_many
+
+
+P12_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'demos', 'demo_podjetje.p12')
+P12_PASSWORD = 'Geslo123#'
+
+INVOICE_REQUEST = {
+    'InvoiceRequest': {
+        'Header': {
+            'MessageID': '6f2b1c3e-6a1d-4c7e-9d1f-2b3c4d5e6f70',
+            'DateTime': '2020-01-01T12:00:00',
+        },
+        'Invoice': {
+            'TaxNumber': 10039856,
+            'IssueDateTime': '2020-01-01T12:00:00',
+            'NumberingStructure': 'B',
+            'InvoiceIdentifier': {
+                'BusinessPremiseID': 'BP101',
+                'ElectronicDeviceID': 'B1',
+                'InvoiceNumber': '1',
+            },
+            'InvoiceAmount': 12.2,
+            'PaymentAmount': 12.2,
+            'ProtectedID': 'a' * 32,
+            'TaxesPerSeller': [{'VAT': [{'TaxRate': 22, 'TaxableAmount': 10, 'TaxAmount': 2.2}]}],
+        },
+    },
+}
+
+
+class ValidationTest(unittest.TestCase):
+
+    def test_valid_message(self):
+        self.assertEqual(get_errors(INVOICE_REQUEST), [])
+        validate(INVOICE_REQUEST)
+
+    def test_errors_have_paths(self):
+        message = copy.deepcopy(INVOICE_REQUEST)
+        invoice = message['InvoiceRequest']['Invoice']
+        invoice['InvoiceIdentifier']['BusinessPremiseID'] = 'BP-101'
+        invoice['TaxesPerSeller'][0]['VAT'][0]['TaxAmount'] = 2.225
+        del invoice['PaymentAmount']
+
+        paths = sorted(error.path for error in get_errors(message))
+        self.assertEqual(paths, ['InvoiceRequest.Invoice.InvoiceIdentifier.BusinessPremiseID',
+                                 'InvoiceRequest.Invoice.PaymentAmount',
+                                 'InvoiceRequest.Invoice.TaxesPerSeller[0].VAT[0].TaxAmount'])
+
+        with self.assertRaises(ValidationException) as context:
+            validate(message)
+        self.assertEqual(len(context.exception.errors), 3)
+
+    def test_unknown_message(self):
+        self.assertEqual(len(get_errors({'EchoRequest': 'hello'})), 1)
+
+    def test_validate_many(self):
+        invalid = copy.deepcopy(INVOICE_REQUEST)
+        invalid['InvoiceRequest']['Invoice']['NumberingStructure'] = 'X'
+
+        results = list(validate_many([INVOICE_REQUEST, invalid, INVOICE_REQUEST]))
+        self.assertEqual([index for index, _ in results], [1])
+        self.assertEqual(results[0][1][0].path, 'InvoiceRequest.Invoice.NumberingStructure')
+
+    def test_invalid_request_is_not_sent(self):
+        api = FURSInvoiceAPI(p12_path=P12_PATH, p12_password=P12_PASSWORD, endpoint='https://localhost',
+                             transport=LoopbackTransport())
+        self.addCleanup(api.connector.close)
+        seller = TaxesPerSeller()
+        seller.add_vat_amount(tax_rate=22, tax_base=10, tax_amount=2.2)
+        invoice = dict(tax_number=10039856, issued_date=datetime.datetime(2020, 1, 1, 12), invoice_number='1',
+                       business_premise_id='BP-101', electronic_device_id='B1', invoice_amount=12.2)
+
+        with mock.patch.object(LoopbackTransport, 'post') as post:
+            with self.assertRaises(ValidationException) as context:
+                api.get_invoice_eor(zoi=api.calculate_zoi(**invoice), taxes_per_seller=[seller], **invoice)
+        post.assert_not_called()
+        self.assertEqual([error.path for error in context.exception.errors],
+                         ['InvoiceRequest.Invoice.InvoiceIdentifier.BusinessPremiseID'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import datetime
+import threading
+import time
+import unittest
+
+from furs_fiscal.transport import TransportResponse
+from furs_fiscal.warmer import ConnectionWarmer
+
+
+class _EchoConnector(object):
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.echoes = 0
+        self.lock = threading.Lock()
+
+    def send_echo(self):
+        with self.lock:
+            response = self.responses[self.echoes % len(self.responses)]
+            self.echoes += 1
+        if isinstance(response, Exception):
+            raise response
+        return TransportResponse(response, b'{}')
+
+
+class ConnectionWarmerTest(unittest.TestCase):
+
+    def test_only_ok_echo_counts_as_success(self):
+        connector = _EchoConnector([200, 500, ConnectionError('refused')])
+        warmer = ConnectionWarmer(connector, connections=3)
+        warmer.warm()
+
+        self.assertEqual(connector.echoes, 3)
+        self.assertEqual(warmer.stats, {'rounds': 1, 'echo_success': 1, 'echo_failure': 2})
+
+    def test_schedule_with_ramp_up(self):
+        warmer = ConnectionWarmer(_EchoConnector([200]), schedule=[(datetime.time(8, 0), datetime.time(20, 0))],
+                                  ramp_up=900)
+        day = datetime.date(2020, 1, 1)
+
+        self.assertFalse(warmer.is_active(datetime.datetime.combine(day, datetime.time(7, 44))))
+        self.assertTrue(warmer.is_active(datetime.datetime.combine(day, datetime.time(7, 45))))
+        self.assertTrue(warmer.is_active(datetime.datetime.combine(day, datetime.time(19, 59))))
+        self.assertFalse(warmer.is_active(datetime.datetime.combine(day, datetime.time(20, 0))))
+
+    def test_schedule_across_midnight(self):
+        warmer = ConnectionWarmer(_EchoConnector([200]), schedule=[(datetime.time(22, 0), datetime.time(2, 0))],
+                                  ramp_up=0)
+        day = datetime.date(2020, 1, 1)
+
+        self.assertTrue(warmer.is_active(datetime.datetime.combine(day, datetime.time(23, 0))))
+        self.assertTrue(warmer.is_active(datetime.datetime.combine(day, datetime.time(1, 0))))
+        self.assertFalse(warmer.is_active(datetime.datetime.combine(day, datetime.time(3, 0))))
+        self.assertTrue(ConnectionWarmer(None).is_active())
+
+    def test_background_rounds(self):
+        connector = _EchoConnector([200])
+        with ConnectionWarmer(connector, connections=2, interval=0.01) as warmer:
+            deadline = time.monotonic() + 5
+            while warmer.stats['rounds'] < 3:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+        rounds = warmer.stats['rounds']
+
+        time.sleep(0.05)
+        self.assertEqual(warmer.stats['rounds'], rounds)
+        self.assertEqual(warmer.stats['echo_success'], 2 * rounds)
+
+
+if __name__ == '__main__':
+    unittest.main()